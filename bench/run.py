@@ -0,0 +1,202 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+BENCH_API_KEY = 'bench-api-key'
+SCENARIOS = ('upload', 'retrieve')
+
+
+def start_stub(latency_ms: float, indexing_delay: float, rate_limit: float = 0.0,
+               error_rate: float = 0.0) -> subprocess.Popen:
+    """Start the stub API in its own process so it does not compete with the tools for the GIL"""
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'bench.stub_server', '--latency-ms', str(latency_ms), '--indexing-delay', str(indexing_delay),
+         '--rate-limit', str(rate_limit), '--error-rate', str(error_rate)],
+        stdout=subprocess.PIPE, text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    process.base_url = process.stdout.readline().strip()
+    return process
+
+
+def configure_environment(base_url: str) -> None:
+    """Point the tools at the stub, must run before the tools are imported"""
+    os.environ['DIFY_KNOWLEDGE_API_BASE_URL'] = base_url
+    os.environ['DIFY_KNOWLEDGE_DATA_DIR'] = tempfile.mkdtemp(prefix='dify_knowledge_bench_')
+    os.environ.setdefault('DIFY_KNOWLEDGE_LOG_LEVEL', 'ERROR')
+
+
+def make_tool(tool_class):
+    from dify_plugin.entities.tool import ToolRuntime
+    return tool_class(ToolRuntime(credentials={'api_key': BENCH_API_KEY}, user_id=None, session_id=None), None)
+
+
+def json_output(messages: List) -> Optional[Dict]:
+    """Return the JSON message of a tool invocation, the tools yield it last"""
+    for message in reversed(messages):
+        json_object = getattr(message.message, 'json_object', None)
+        if json_object is not None:
+            return json_object
+    return None
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of the given latencies"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+
+def run_level(operation: Callable[[int], bool], count: int, concurrency: int) -> Dict:
+    """Run an operation count times with the given concurrency, timing every call"""
+    latencies = []
+    failures = 0
+
+    def timed(index: int) -> None:
+        nonlocal failures
+        started_at = time.perf_counter()
+        try:
+            ok = operation(index)
+        except Exception:
+            ok = False
+        latencies.append(time.perf_counter() - started_at)
+        if not ok:
+            failures += 1
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed, range(count)))
+    elapsed = time.perf_counter() - started_at
+
+    return {
+        "concurrency": concurrency,
+        "requests": count,
+        "errors": failures,
+        "throughput": count / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99)
+    }
+
+
+def upload_operation(run_id: str) -> Callable[[int], bool]:
+    from tools.knowledge_upload import KnowledgeUploadTool
+    tool = make_tool(KnowledgeUploadTool)
+
+    def upload(index: int) -> bool:
+        result = json_output(list(tool._invoke({
+            "knowledge_base_name": f"bench-upload-{run_id}",
+            "reuse_existing": True,
+            "document_name": f"doc-{run_id}-{index}",
+            "text": f"Benchmark document {index}\n\n" + "lorem ipsum " * 400,
+            "indexing_technique": "economy"
+        })))
+        return bool(result) and result.get('document', {}).get('status') == 'completed'
+
+    return upload
+
+
+def retrieve_operation(run_id: str, use_cache: bool) -> Callable[[int], bool]:
+    from tools.knowledge_retrieve import KnowledgeRetrieveTool
+    from tools.knowledge_upload import KnowledgeUploadTool
+
+    # Seed one knowledge base with a few documents to retrieve from
+    uploader = make_tool(KnowledgeUploadTool)
+    dataset_id = None
+    for index in range(5):
+        result = json_output(list(uploader._invoke({
+            "knowledge_base_name": f"bench-retrieve-{run_id}",
+            "reuse_existing": True,
+            "document_name": f"seed-{index}",
+            "text": f"Seed document {index}"
+        })))
+        dataset_id = result and result.get('id')
+    if not dataset_id:
+        raise RuntimeError("Could not seed the retrieve benchmark knowledge base")
+
+    tool = make_tool(KnowledgeRetrieveTool)
+
+    def retrieve(index: int) -> bool:
+        result = json_output(list(tool._invoke({
+            "dataset_id": dataset_id,
+            # Distinct queries unless the cache is being measured
+            "query": "benchmark query" if use_cache else f"benchmark query {index}",
+            "top_k": 3,
+            "use_cache": use_cache
+        })))
+        return bool(result) and result.get('status') == 'success'
+
+    return retrieve
+
+
+def format_table(scenario: str, rows: List[Dict]) -> str:
+    lines = [f"{scenario}", f"{'concurrency':>11} {'requests':>8} {'errors':>6} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"]
+    for row in rows:
+        lines.append(f"{row['concurrency']:>11} {row['requests']:>8} {row['errors']:>6} {row['throughput']:>9.1f} "
+                     f"{row['p50'] * 1000:>9.1f} {row['p95'] * 1000:>9.1f} {row['p99'] * 1000:>9.1f}")
+    return '\n'.join(lines)
+
+
+def format_phases(snapshot: Dict) -> str:
+    # Quantiles come from the metrics histograms and are bucket upper bounds
+    lines = ["API phases", f"{'phase':>20} {'calls':>7} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"]
+    for phase, values in sorted(snapshot['phases'].items()):
+        mean = values['sum'] / values['count'] if values['count'] else 0.0
+        lines.append(f"{phase:>20} {values['count']:>7} {mean * 1000:>9.1f} {values['p50'] * 1000:>9.1f} "
+                     f"{values['p95'] * 1000:>9.1f} {values['p99'] * 1000:>9.1f}")
+    return '\n'.join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the upload and retrieve tools against a local stub Dify API")
+    parser.add_argument('--scenario', default=','.join(SCENARIOS), help="Comma-separated scenarios: upload, retrieve")
+    parser.add_argument('--concurrency', default='1,4,16', help="Comma-separated concurrency levels")
+    parser.add_argument('--requests', type=int, default=50, help="Tool invocations per concurrency level")
+    parser.add_argument('--latency-ms', type=float, default=20.0, help="Stub API response latency")
+    parser.add_argument('--indexing-delay', type=float, default=0.5, help="Seconds until the stub finishes indexing a document")
+    parser.add_argument('--rate-limit', type=float, default=0.0, help="Requests per second the stub accepts before returning 429")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of stub responses that are 503 errors")
+    parser.add_argument('--use-cache', action='store_true', help="Repeat one query so retrieve is served from the cache")
+    parser.add_argument('--json', action='store_true', help="Print the results as JSON")
+    args = parser.parse_args()
+
+    scenarios = [scenario.strip() for scenario in args.scenario.split(',') if scenario.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario: {', '.join(sorted(unknown))}")
+    levels = [int(level) for level in args.concurrency.split(',') if level.strip()]
+
+    stub = start_stub(args.latency_ms, args.indexing_delay, args.rate_limit, args.error_rate)
+    try:
+        configure_environment(stub.base_url)
+        from utils.metrics import get_metrics
+
+        results = {}
+        for scenario in scenarios:
+            rows = []
+            for level in levels:
+                run_id = uuid.uuid4().hex[:8]
+                operation = upload_operation(run_id) if scenario == 'upload' else retrieve_operation(run_id, args.use_cache)
+                rows.append(run_level(operation, args.requests, level))
+            results[scenario] = rows
+
+        if args.json:
+            print(json.dumps({"results": results, "phases": get_metrics().snapshot()['phases']}, indent=2))
+        else:
+            for scenario, rows in results.items():
+                print(format_table(scenario, rows) + '\n')
+            print(format_phases(get_metrics().snapshot()))
+    finally:
+        stub.terminate()
+        stub.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+import argparse
+import compileall
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from bench.run import configure_environment, json_output, make_tool, start_stub
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Tool modules in the order the provider registers them, the plugin imports all of them at startup
+TOOLS = (
+    ('tools.knowledge_upload', 'KnowledgeUploadTool'),
+    ('tools.knowledge_retrieve', 'KnowledgeRetrieveTool'),
+    ('tools.knowledge_bulk_upload', 'KnowledgeBulkUploadTool'),
+    ('tools.knowledge_status', 'KnowledgeStatusTool'),
+    ('tools.knowledge_sync', 'KnowledgeSyncTool'),
+    ('tools.knowledge_list', 'KnowledgeListTool')
+)
+PLUGIN_PACKAGES = ('tools', 'utils')
+# Written to stderr between the phases so the -X importtime lines can be told apart
+PHASE_MARKER = 'bench.startup phase:'
+
+
+def elapsed_since(started_at: float) -> float:
+    return time.perf_counter() - started_at
+
+
+def invoke_parameters(module: str, run_id: str, state: Dict) -> Dict:
+    """Parameters for a small but complete invocation of a tool, later tools use what earlier ones created"""
+    knowledge_base_name = f"bench-startup-{run_id}"
+    if module == 'tools.knowledge_upload':
+        return {"knowledge_base_name": knowledge_base_name, "reuse_existing": True, "document_name": "startup",
+                "text": "Startup benchmark", "indexing_technique": "economy"}
+    if module == 'tools.knowledge_retrieve':
+        return {"dataset_id": state['dataset_id'], "query": "startup", "top_k": 3}
+    if module == 'tools.knowledge_bulk_upload':
+        return {"knowledge_base_name": knowledge_base_name, "indexing_technique": "economy",
+                "documents": json.dumps([{"name": "bulk", "text": "Startup benchmark"}])}
+    if module == 'tools.knowledge_status':
+        return {"dataset_id": state['dataset_id'], "batch": state['batch']}
+    if module == 'tools.knowledge_sync':
+        return {"knowledge_base_name": knowledge_base_name, "directory": state['directory'],
+                "indexing_technique": "economy"}
+    return {"resource": "documents", "dataset_id": state['dataset_id']}
+
+
+def invoke(tool, parameters: Dict) -> Tuple[float, Optional[Dict]]:
+    started_at = time.perf_counter()
+    result = json_output(list(tool._invoke(parameters)))
+    return elapsed_since(started_at), result
+
+
+def measure() -> Dict:
+    """Time the SDK import, every tool module import and the first two invocations of every tool"""
+    started_at = time.perf_counter()
+    # The SDK pulls in httpx, import it the way the plugin entrypoint does
+    import httpx  # noqa: F401
+    import dify_plugin  # noqa: F401
+    sdk_import = elapsed_since(started_at)
+
+    imports = {}
+    tool_classes = {}
+    for module, class_name in TOOLS:
+        print(f"{PHASE_MARKER} import {module}", file=sys.stderr, flush=True)
+        started_at = time.perf_counter()
+        tool_classes[module] = getattr(importlib.import_module(module), class_name)
+        imports[module] = elapsed_since(started_at)
+
+    directory = tempfile.mkdtemp(prefix='dify_knowledge_startup_')
+    with open(os.path.join(directory, 'startup.md'), 'w', encoding='utf-8') as file:
+        file.write("# Startup\n\nStartup benchmark\n")
+    state = {'directory': directory}
+    run_id = uuid.uuid4().hex[:8]
+
+    invokes = {}
+    for module, _ in TOOLS:
+        print(f"{PHASE_MARKER} invoke {module}", file=sys.stderr, flush=True)
+        tool = make_tool(tool_classes[module])
+        parameters = invoke_parameters(module, run_id, state)
+        first, result = invoke(tool, parameters)
+        second, _ = invoke(tool, parameters)
+        invokes[module] = {"first": first, "second": second, "ok": bool(result) and 'error' not in result}
+        if module == 'tools.knowledge_upload' and result:
+            state['dataset_id'] = result.get('id')
+            state['batch'] = result.get('document', {}).get('batch')
+    print(f"{PHASE_MARKER} done -", file=sys.stderr, flush=True)
+
+    return {"sdk_import": sdk_import, "imports": imports, "invokes": invokes}
+
+
+def parse_importtime(stderr: str) -> Dict[str, List[Dict]]:
+    """Group the -X importtime lines by the phase that triggered the import"""
+    phases = {'sdk': []}
+    phase = 'sdk'
+    for line in stderr.splitlines():
+        if line.startswith(PHASE_MARKER):
+            kind, module = line[len(PHASE_MARKER):].split()
+            phase = module if kind == 'invoke' else kind
+            phases.setdefault(phase, [])
+            continue
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        phases[phase].append({"module": name.strip(), "self": int(self_us) / 1e6, "cumulative": int(cumulative_us) / 1e6})
+    return phases
+
+
+def run_once() -> Dict:
+    """Measure one cold start in a fresh interpreter"""
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-m', 'bench.startup', '--child'],
+                             cwd=ROOT, capture_output=True, text=True, env=os.environ.copy())
+    if process.returncode != 0:
+        raise RuntimeError(f"Startup benchmark process failed:\n{process.stderr[-2000:]}")
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    phases = parse_importtime(process.stderr)
+    result['modules'] = {entry['module']: entry for entry in phases.pop('import', [])
+                         if entry['module'].split('.')[0] in PLUGIN_PACKAGES}
+    # Imports the tools defer until they are invoked
+    result['deferred'] = {module: [entry for entry in entries if entry['module'].split('.')[0] not in PLUGIN_PACKAGES]
+                          for module, entries in phases.items() if module not in ('sdk', 'done')}
+    return result
+
+
+def median_of(runs: List[Dict]) -> Dict:
+    """Median of every timing over the runs"""
+    median = lambda values: statistics.median(values) if values else 0.0
+    first = runs[-1]
+    return {
+        "runs": len(runs),
+        "sdk_import": median([run['sdk_import'] for run in runs]),
+        "tool_imports": median([sum(run['imports'].values()) for run in runs]),
+        "imports": {module: median([run['imports'][module] for run in runs]) for module in first['imports']},
+        "modules": {module: {key: median([run['modules'][module][key] for run in runs if module in run['modules']])
+                             for key in ('self', 'cumulative')} for module in first['modules']},
+        "invokes": {module: {"first": median([run['invokes'][module]['first'] for run in runs]),
+                             "second": median([run['invokes'][module]['second'] for run in runs]),
+                             "ok": all(run['invokes'][module]['ok'] for run in runs)} for module in first['invokes']},
+        "deferred": {module: sorted(({"module": entry['module'], "self": entry['self']} for entry in entries),
+                                    key=lambda entry: -entry['self']) for module, entries in first['deferred'].items()}
+    }
+
+
+def format_report(report: Dict, top: int) -> str:
+    lines = [f"startup (median of {report['runs']} runs)",
+             f"{'sdk import ms':>24} {report['sdk_import'] * 1000:>9.1f}",
+             f"{'tool imports ms':>24} {report['tool_imports'] * 1000:>9.1f}", "",
+             "tool imports", f"{'module':>32} {'ms':>9}"]
+    for module, seconds in report['imports'].items():
+        lines.append(f"{module:>32} {seconds * 1000:>9.1f}")
+    lines += ["", "plugin modules", f"{'module':>32} {'self ms':>9} {'cumul ms':>9}"]
+    for module, values in sorted(report['modules'].items(), key=lambda item: -item[1]['cumulative']):
+        lines.append(f"{module:>32} {values['self'] * 1000:>9.1f} {values['cumulative'] * 1000:>9.1f}")
+    lines += ["", "tool invokes", f"{'module':>32} {'first ms':>9} {'second ms':>9} {'ok':>4}"]
+    for module, values in report['invokes'].items():
+        lines.append(f"{module:>32} {values['first'] * 1000:>9.1f} {values['second'] * 1000:>9.1f} "
+                     f"{'yes' if values['ok'] else 'no':>4}")
+    lines += ["", "imported on first invoke", f"{'module':>32} {'import':>32} {'self ms':>9}"]
+    for module, entries in report['deferred'].items():
+        for entry in entries[:top]:
+            lines.append(f"{module:>32} {entry['module']:>32} {entry['self'] * 1000:>9.1f}")
+    return '\n'.join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure the plugin cold start: import time and time to the first tool invocation")
+    parser.add_argument('--runs', type=int, default=3, help="Fresh interpreters to measure, the report shows the median")
+    parser.add_argument('--latency-ms', type=float, default=5.0, help="Stub API response latency")
+    parser.add_argument('--top', type=int, default=5, help="Slowest imports to list per tool for the first invoke")
+    parser.add_argument('--json', action='store_true', help="Print the results as JSON")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure()))
+        return
+
+    # A deployed plugin runs from compiled bytecode, compile it first so the runs do not measure compilation
+    for package in PLUGIN_PACKAGES + ('bench',):
+        compileall.compile_dir(os.path.join(ROOT, package), quiet=1)
+
+    stub = start_stub(args.latency_ms, 0.0)
+    try:
+        configure_environment(stub.base_url)
+        report = median_of([run_once() for _ in range(max(args.runs, 1))])
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(format_report(report, args.top))
+
+
+if __name__ == '__main__':
+    main()
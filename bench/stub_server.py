@@ -0,0 +1,330 @@
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+API_PREFIX = '/v1'
+SEGMENT_CHARS = 500
+
+
+class StubState:
+    """In-memory knowledge bases and documents served by the stub API"""
+
+    def __init__(self, latency: float = 0.0, indexing_delay: float = 0.0, rate_limit: float = 0.0,
+                 error_rate: float = 0.0):
+        self.latency = latency
+        self.indexing_delay = indexing_delay
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.window_started_at = time.monotonic()
+        self.window_requests = 0
+        self.datasets: Dict[str, Dict] = {}
+        self.documents: Dict[str, Dict] = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def throttled(self) -> bool:
+        """Count a request against the per-second limit and return True when it is over it"""
+        if self.rate_limit <= 0:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_started_at >= 1.0:
+                self.window_started_at = now
+                self.window_requests = 0
+            self.window_requests += 1
+            return self.window_requests > self.rate_limit
+
+    def add_dataset(self, name: str) -> Optional[Dict]:
+        with self.lock:
+            if any(dataset['name'] == name for dataset in self.datasets.values()):
+                return None
+            dataset = {'id': str(uuid.uuid4()), 'name': name, 'documents': []}
+            self.datasets[dataset['id']] = dataset
+            return dataset
+
+    def add_document(self, dataset_id: str, name: str, text: str, document_id: Optional[str] = None,
+                     separator: Optional[str] = None) -> Dict:
+        with self.lock:
+            document = {
+                'id': document_id or str(uuid.uuid4()),
+                'name': name,
+                'batch': uuid.uuid4().hex,
+                'segments': self.split_segments(text, separator),
+                'created_at': time.monotonic()
+            }
+            self.documents[document['batch']] = document
+            # Updating a document replaces it in its knowledge base
+            documents = self.datasets[dataset_id]['documents']
+            documents[:] = [existing for existing in documents if existing['id'] != document['id']]
+            documents.append(document)
+            return document
+
+    @staticmethod
+    def split_segments(text: str, separator: Optional[str] = None) -> List[Dict]:
+        """Split text the way a custom separator or the automatic rule would"""
+        if separator:
+            contents = [content.strip() for content in text.split(separator)]
+        else:
+            contents = [text[start:start + SEGMENT_CHARS] for start in range(0, len(text), SEGMENT_CHARS)]
+        contents = [content for content in contents if content] or ['']
+        return [StubState.new_segment(content, position) for position, content in enumerate(contents, 1)]
+
+    @staticmethod
+    def new_segment(content: str, position: int) -> Dict:
+        return {'id': str(uuid.uuid4()), 'position': position, 'content': content, 'enabled': True}
+
+    def indexing_status(self, document: Dict) -> Dict:
+        total = len(document['segments'])
+        progress = 1.0
+        if self.indexing_delay > 0:
+            progress = min(1.0, (time.monotonic() - document['created_at']) / self.indexing_delay)
+        return {
+            'id': document['id'],
+            'indexing_status': 'completed' if progress >= 1.0 else 'indexing',
+            'completed_segments': int(total * progress),
+            'total_segments': total
+        }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Implements the subset of the Dify datasets API used by the tools"""
+
+    protocol_version = 'HTTP/1.1'
+    # Avoid delayed ACK stalls on keep-alive connections skewing the latencies
+    disable_nagle_algorithm = True
+
+    @property
+    def state(self) -> StubState:
+        return self.server.state
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        self._handle('GET')
+
+    def do_POST(self) -> None:
+        self._handle('POST')
+
+    def do_DELETE(self) -> None:
+        self._handle('DELETE')
+
+    def _handle(self, method: str) -> None:
+        body = self._read_body()
+        with self.state.lock:
+            self.state.requests += 1
+        if self.state.latency > 0:
+            time.sleep(self.state.latency)
+
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            return self._send(401, {'code': 'unauthorized', 'message': 'Invalid API key'})
+        if self.state.throttled():
+            return self._send(429, {'code': 'too_many_requests', 'message': 'Too many requests'}, {'Retry-After': '1'})
+        if self.state.error_rate > 0 and random.random() < self.state.error_rate:
+            return self._send(503, {'code': 'service_unavailable', 'message': 'Service unavailable'})
+
+        url = urlparse(self.path)
+        parts = url.path[len(API_PREFIX):].strip('/').split('/') if url.path.startswith(API_PREFIX) else []
+        status, payload = self._route(method, parts, parse_qs(url.query), body)
+        self._send(status, payload)
+
+    def _route(self, method: str, parts: list, query: Dict, body: bytes) -> Tuple[int, Dict]:
+        if parts == ['datasets']:
+            return self._list_datasets(query) if method == 'GET' else self._create_dataset(body)
+
+        dataset = self.state.datasets.get(parts[1]) if len(parts) > 1 and parts[0] == 'datasets' else None
+        if dataset is None:
+            return 404, {'code': 'dataset_not_found', 'message': 'Dataset not found'}
+        route = parts[2:]
+
+        if method == 'POST' and route in (['document', 'create-by-text'], ['document', 'create-by-file']):
+            data = json.loads(body) if route[1] == 'create-by-text' else {'name': 'file', 'text': body.decode('latin-1')}
+            document = self.state.add_document(dataset['id'], data.get('name', ''), data.get('text', ''),
+                                               separator=self._separator(data))
+            return 200, self._document_response(document)
+        if method == 'POST' and len(route) == 3 and route[0] == 'documents' and route[2] == 'update-by-text':
+            data = json.loads(body)
+            document = self.state.add_document(dataset['id'], data.get('name', ''), data.get('text', ''), route[1],
+                                               self._separator(data))
+            return 200, self._document_response(document)
+        if method == 'GET' and route == ['documents']:
+            return 200, self._page(query, [self._document_summary(document) for document in dataset['documents']])
+        if len(route) >= 2 and route[0] == 'documents' and (len(route) == 2 or route[2] == 'segments'):
+            return self._document_route(method, dataset, route[1], route[2:], query, body)
+        if method == 'GET' and len(route) == 3 and route[0] == 'documents' and route[2] == 'indexing-status':
+            document = self.state.documents.get(route[1])
+            if document is None:
+                return 404, {'code': 'not_found', 'message': 'Batch not found'}
+            return 200, {'data': [self.state.indexing_status(document)]}
+        if method == 'POST' and route == ['retrieve']:
+            return 200, self._retrieve(dataset, json.loads(body))
+        return 404, {'code': 'not_found', 'message': 'Not found'}
+
+    def _list_datasets(self, query: Dict) -> Tuple[int, Dict]:
+        return 200, self._page(query, [{'id': dataset['id'], 'name': dataset['name']}
+                                       for dataset in self.state.datasets.values()])
+
+    def _page(self, query: Dict, items: List[Dict]) -> Dict:
+        page = int(query.get('page', ['1'])[0])
+        limit = int(query.get('limit', ['20'])[0])
+        start = (page - 1) * limit
+        return {'data': items[start:start + limit], 'has_more': start + limit < len(items), 'page': page,
+                'limit': limit, 'total': len(items)}
+
+    def _document_route(self, method: str, dataset: Dict, document_id: str, route: list, query: Dict,
+                        body: bytes) -> Tuple[int, Dict]:
+        document = next((document for document in dataset['documents'] if document['id'] == document_id), None)
+        if document is None:
+            return 404, {'code': 'not_found', 'message': 'Document not found'}
+        segments = document['segments']
+
+        if method == 'GET' and not route:
+            return 200, self._document_summary(document)
+        if method == 'DELETE' and not route:
+            with self.state.lock:
+                dataset['documents'].remove(document)
+            return 204, {}
+        if route == ['segments'] and method == 'GET':
+            return 200, self._page(query, segments)
+        if route == ['segments'] and method == 'POST':
+            with self.state.lock:
+                added = [self.state.new_segment(segment.get('content', ''), len(segments) + index)
+                         for index, segment in enumerate(json.loads(body).get('segments', []), 1)]
+                segments.extend(added)
+            return 200, {'data': added}
+        segment = next((segment for segment in segments if len(route) == 2 and segment['id'] == route[1]), None)
+        if segment is None:
+            return 404, {'code': 'not_found', 'message': 'Segment not found'}
+        if method == 'POST':
+            segment.update(json.loads(body).get('segment', {}))
+            return 200, {'data': segment}
+        if method == 'DELETE':
+            with self.state.lock:
+                segments.remove(segment)
+            return 204, {}
+        return 404, {'code': 'not_found', 'message': 'Not found'}
+
+    @staticmethod
+    def _separator(data: Dict) -> Optional[str]:
+        rules = (data.get('process_rule') or {}).get('rules') or {}
+        return (rules.get('segmentation') or {}).get('separator')
+
+    def _document_summary(self, document: Dict) -> Dict:
+        return {'id': document['id'], 'name': document['name'],
+                'indexing_status': self.state.indexing_status(document)['indexing_status']}
+
+    def _create_dataset(self, body: bytes) -> Tuple[int, Dict]:
+        dataset = self.state.add_dataset(json.loads(body).get('name', ''))
+        if dataset is None:
+            return 409, {'code': 'dataset_name_duplicate', 'message': 'The dataset name already exists'}
+        return 200, {'id': dataset['id'], 'name': dataset['name']}
+
+    def _document_response(self, document: Dict) -> Dict:
+        return {'document': {'id': document['id'], 'name': document['name'], 'indexing_status': 'waiting'},
+                'batch': document['batch']}
+
+    def _retrieve(self, dataset: Dict, payload: Dict) -> Dict:
+        top_k = (payload.get('retrieval_model') or {}).get('top_k') or 3
+        records = [
+            {
+                'segment': {
+                    'id': f"{document['id']}-0",
+                    'content': f"Stub segment of {document['name']}",
+                    'document': {'id': document['id'], 'name': document['name']}
+                },
+                'score': round(1.0 - index / (top_k + 1), 4)
+            }
+            for index, document in enumerate(dataset['documents'][:top_k])
+        ]
+        return {'query': {'content': payload.get('query')}, 'records': records}
+
+    def _read_body(self) -> bytes:
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+                if size == 0:
+                    return b''.join(chunks)
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _send(self, status: int, payload: Dict, headers: Optional[Dict] = None) -> None:
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StubDifyServer:
+    """Local stub of the Dify datasets API with configurable latency and indexing time"""
+
+    def __init__(self, latency: float = 0.0, indexing_delay: float = 0.0, host: str = '127.0.0.1', port: int = 0,
+                 rate_limit: float = 0.0, error_rate: float = 0.0):
+        self.state = StubState(latency, indexing_delay, rate_limit, error_rate)
+        # Bursts of new connections from the async engine overflow the default backlog of 5
+        ThreadingHTTPServer.request_queue_size = 128
+        self._server = ThreadingHTTPServer((host, port), StubHandler)
+        self._server.daemon_threads = True
+        self._server.state = self.state
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    def serve_forever(self) -> None:
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def start(self) -> 'StubDifyServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'StubDifyServer':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a local stub of the Dify datasets API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0, help="Port to listen on, 0 picks a free port")
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Delay added to every response")
+    parser.add_argument('--indexing-delay', type=float, default=0.0, help="Seconds until a document is indexed")
+    parser.add_argument('--rate-limit', type=float, default=0.0, help="Requests per second answered before returning 429")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of requests answered with 503")
+    args = parser.parse_args()
+
+    server = StubDifyServer(args.latency_ms / 1000, args.indexing_delay, args.host, args.port, args.rate_limit,
+                            args.error_rate)
+    # The first line tells the benchmark where to send requests
+    print(server.base_url, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
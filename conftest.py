@@ -0,0 +1,12 @@
+import pytest
+
+from utils import config, manifest
+
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    """Give every test its own plugin data directory, so no upload manifest is shared between runs"""
+    monkeypatch.setattr(config, 'DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(manifest, 'DATA_DIR', str(tmp_path))
+    monkeypatch.setattr(manifest, '_manifest', None)
+    return tmp_path
@@ -1,10 +1,12 @@
 from typing import Any
-import requests
-import os
 
 from dify_plugin import ToolProvider
 from dify_plugin.errors.tool import ToolProviderCredentialValidationError
 
+from utils.config import get_base_url
+from utils.credential_cache import credential_key, get_credential_cache
+from utils.dify_client import DifyClient, build_headers, response_error
+
 
 class KnowledgeProvider(ToolProvider):
     def _validate_credentials(self, credentials: dict[str, Any]) -> None:
@@ -13,20 +15,31 @@ class KnowledgeProvider(ToolProvider):
             if not api_key:
                 raise ValueError("API Key is required")
             
-            # 将API Key保存到环境变量中，以便工具可以访问
-            os.environ['DIFY_KNOWLEDGE_API_KEY'] = api_key
+            # 检查检索缓存配置，必须为非负整数
+            for setting in ('retrieve_cache_size', 'retrieve_cache_ttl'):
+                value = credentials.get(setting)
+                if value not in (None, '') and not str(value).isdigit():
+                    raise ValueError(f"{setting} must be a non-negative integer")
+            
+            # 检查API地址格式，为空时使用默认地址
+            base_url = get_base_url(credentials)
+            if base_url and not base_url.startswith(('http://', 'https://')):
+                raise ValueError("API base URL must start with http:// or https://")
+            
+            # 最近验证成功的API Key无需再次请求，工具通过运行时凭据获取API Key
+            cache = get_credential_cache()
+            key = credential_key(api_key, base_url)
+            if cache.is_valid(key):
+                return
             
             # 尝试使用API Key获取知识库列表，验证API Key是否有效
-            headers = {
-                'Authorization': f'Bearer {api_key}',
-                'Content-Type': 'application/json'
-            }
+            headers = build_headers(api_key)
             
-            response = requests.get('https://api.dify.ai/v1/datasets?page=1&limit=1', headers=headers)
+            response = DifyClient(headers, base_url).validate_credentials()
             
             if response.status_code != 200:
-                error_data = response.json()
-                raise ValueError(f"API Key validation failed: {error_data.get('message', 'Unknown error')}")
+                raise ValueError(f"API Key validation failed: {response_error(response)[1]}")
+            cache.remember(key)
                 
         except Exception as e:
             raise ToolProviderCredentialValidationError(str(e))
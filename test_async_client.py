@@ -0,0 +1,30 @@
+import httpx
+
+from utils.async_client import AsyncDifyClient, AsyncEngine, gather_limited
+from utils.dify_client import build_headers
+
+
+def test_async_client_retries_throttled_requests_on_the_engine():
+    """Test that the sync facade runs concurrent requests on one loop and retries throttled ones"""
+    attempts = {}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        attempts[path] = attempts.get(path, 0) + 1
+        if path.endswith('/ds-1/retrieve') and attempts[path] == 1:
+            return httpx.Response(429, headers={'Retry-After': '0'}, json={'code': 'too_many_requests'})
+        return httpx.Response(200, json={'records': [{'path': path}]})
+
+    engine = AsyncEngine(pool_size=4, transport=httpx.MockTransport(handler))
+    client = AsyncDifyClient(build_headers('test-key'), 'http://dify.test/v1', engine)
+    try:
+        requests = [client.retrieve(ds_id, {'query': 'q'}) for ds_id in ('ds-1', 'ds-2', 'ds-3')]
+        responses = engine.run(gather_limited(requests, 2), timeout=10)
+    finally:
+        engine.close()
+
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    assert [response.json()['records'][0]['path'] for response in responses] == [
+        '/v1/datasets/ds-1/retrieve', '/v1/datasets/ds-2/retrieve', '/v1/datasets/ds-3/retrieve'
+    ]
+    assert attempts['/v1/datasets/ds-1/retrieve'] == 2
@@ -0,0 +1,25 @@
+import time
+
+from utils.credential_cache import CredentialCache, credential_key
+
+
+def test_credential_cache_ttl_and_scoping():
+    """Test that validations are remembered per key and deployment until they expire"""
+    cache = CredentialCache(ttl=0.05)
+    key = credential_key("app-key", "https://api.dify.ai/v1")
+
+    assert "app-key" not in key
+    assert key != credential_key("app-key", "http://dify-api:5001/v1")
+    assert not cache.is_valid(key)
+
+    cache.remember(key)
+    assert cache.is_valid(key)
+    assert not cache.is_valid(credential_key("other-key", "https://api.dify.ai/v1"))
+
+    time.sleep(0.06)
+    assert not cache.is_valid(key)
+
+    # A TTL of 0 disables the cache
+    disabled = CredentialCache(ttl=0)
+    disabled.remember(key)
+    assert not disabled.is_valid(key)
@@ -0,0 +1,51 @@
+from utils.dataset_index import DatasetNameIndex
+from utils.dify_client import build_headers
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self.payload = payload
+        self.status_code = status_code
+
+    def json(self):
+        return self.payload
+
+
+class FakeClient:
+    def __init__(self, names, api_key='test-key'):
+        self.headers = build_headers(api_key)
+        self.base_url = 'http://dify.test/v1'
+        self.names = names
+        self.pages = []
+
+    def list_datasets(self, page, limit):
+        self.pages.append(page)
+        data = [{"id": f"id-{name}", "name": name} for name in self.names[(page - 1) * 2:page * 2]]
+        return FakeResponse({"data": data, "has_more": page * 2 < len(self.names)})
+
+
+def test_dataset_name_index_lists_once_and_refreshes_unknown_names():
+    """Test that names are resolved across pages, served from the index and refreshed when unknown"""
+    index = DatasetNameIndex(ttl=60)
+    client = FakeClient(["a", "b", "c"])
+
+    assert index.resolve(client, "c") == "id-c"
+    assert client.pages == [1, 2]
+    assert index.resolve(client, "a") == "id-a"
+    assert client.pages == [1, 2]
+
+    # A knowledge base created elsewhere is found by listing again
+    client.names.append("d")
+    assert index.resolve(client, "d") == "id-d"
+    assert index.resolve(client, "missing") is None
+    assert len(client.pages) == 6
+
+    # Knowledge bases created by this process are known without listing
+    index.add(client, "e", "id-e")
+    assert index.resolve(client, "e") == "id-e"
+    assert len(client.pages) == 6
+
+    # Every API key has its own index
+    other = FakeClient(["a"], api_key='other-key')
+    assert index.resolve(other, "c") is None
+    assert other.pages == [1]
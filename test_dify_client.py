@@ -0,0 +1,23 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from bench.stub_server import StubDifyServer
+from utils.dify_client import DifyClient, build_headers, get_session
+
+
+def test_clients_share_one_keep_alive_session():
+    """Test that every client and thread sends through one pooled session that reuses its connection"""
+    with StubDifyServer() as server:
+        clients = [DifyClient(build_headers('test-key'), server.base_url) for _ in range(3)]
+        for client in clients:
+            assert client.list_datasets().status_code == 200
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            sessions = set(executor.map(lambda _: id(get_session()), range(8)))
+        url = urlsplit(server.base_url)
+        pools = get_session().get_adapter(server.base_url).poolmanager.pools
+        connections = sum(pools[key].num_connections for key in pools.keys()
+                          if (key.key_host, key.key_port) == (url.hostname, url.port))
+
+    assert sessions == {id(get_session())}
+    # Sequential requests of all clients went over a single kept-alive connection
+    assert connections == 1
@@ -0,0 +1,86 @@
+import os
+
+from utils.keyword_index import KeywordIndex, KeywordMirror, tokenize, write_index
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.payload = payload
+        self.status_code = 200
+
+    def json(self):
+        return self.payload
+
+
+class FakeClient:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def list_documents(self, dataset_id, page, limit):
+        data = [{"id": document_id, "name": f"{document_id}.md", "indexing_status": "completed"}
+                for document_id in self.documents]
+        return FakeResponse({"data": data, "has_more": False, "total": len(data)})
+
+    def list_segments(self, dataset_id, document_id, page, limit):
+        data = [{"id": f"{document_id}-{position}", "position": position, "content": content, "enabled": True,
+                 "status": "completed"} for position, content in enumerate(self.documents[document_id], 1)]
+        return FakeResponse({"data": data, "has_more": False, "total": len(data)})
+
+
+def test_keyword_index_ranks_with_bm25(tmp_path):
+    """Test that the memory-mapped index ranks rare and repeated terms first"""
+    segments = [
+        {"id": "a", "content": "Dify plugins call the knowledge API"},
+        {"id": "b", "content": "The retrieve API returns segments, segments and more segments"},
+        {"id": "c", "content": "Unrelated text about cooking"},
+        {"id": "d", "content": "知识库检索"}
+    ]
+    write_index(str(tmp_path), segments, {"built_at": 0})
+    index = KeywordIndex(str(tmp_path))
+
+    records = index.search("segments API", top_k=3)
+    assert [record["segment"]["id"] for record in records] == ["b", "a"]
+    assert records[0]["score"] == 1.0
+    assert index.search("检索", top_k=3)[0]["segment"]["id"] == "d"
+    assert index.search("missing", top_k=3) == []
+    assert tokenize("Hello, 世界!") == ["hello", "世", "界"]
+
+
+def test_keyword_mirror_is_stale_until_written_documents_are_mirrored(tmp_path):
+    """Test that a write keeps searches off the mirror until the document is copied again"""
+    mirror = KeywordMirror(str(tmp_path), ttl=60)
+    client = FakeClient({"doc-1": ["alpha beta", "gamma"], "doc-2": ["delta"]})
+    assert mirror.search("scope", "ds-1", "alpha", 3) is None
+
+    assert mirror.rebuild(client, "scope", "ds-1")
+    records = mirror.search("scope", "ds-1", "alpha", 3)
+    assert records[0]["segment"]["id"] == "doc-1-1"
+    assert records[0]["segment"]["document"]["name"] == "doc-1.md"
+
+    mirror.mark_stale("scope", "ds-1", ["doc-2"])
+    assert mirror.search("scope", "ds-1", "delta", 3) is None
+
+    client.documents["doc-2"] = ["epsilon"]
+    assert mirror.update_documents(client, "scope", "ds-1", {"doc-2": "doc-2.md"})
+    assert mirror.search("scope", "ds-1", "delta", 3) == []
+    assert mirror.search("scope", "ds-1", "epsilon", 3)[0]["segment"]["id"] == "doc-2-1"
+    assert mirror.search("scope", "ds-1", "alpha", 3)[0]["segment"]["id"] == "doc-1-1"
+
+
+def test_keyword_mirror_survives_rebuilds_and_falls_back_on_errors(tmp_path, monkeypatch):
+    """Test that an index opened before a rebuild still answers, and a failing search is left to the API"""
+    client = FakeClient({"doc-1": ["alpha beta"]})
+    mirror = KeywordMirror(str(tmp_path), ttl=60)
+    assert mirror.rebuild(client, "scope", "ds-1")
+    opened = KeywordIndex(mirror._current(mirror._directory("scope", "ds-1")))
+
+    # Another worker rebuilds the mirror and removes the build this one has open
+    assert KeywordMirror(str(tmp_path), ttl=60).rebuild(client, "scope", "ds-1")
+    assert not os.path.exists(opened.directory)
+    assert opened.search("alpha", 3)[0]["segment"]["id"] == "doc-1-1"
+
+    def fail(index, query, top_k):
+        raise FileNotFoundError("segments.json")
+
+    monkeypatch.setattr(KeywordIndex, 'search', fail)
+    assert mirror.search("scope", "ds-1", "alpha", 3) is None
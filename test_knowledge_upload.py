@@ -0,0 +1,145 @@
+import time
+import uuid
+
+from dify_plugin.entities.tool import ToolRuntime
+
+from bench.run import json_output
+from bench.stub_server import StubDifyServer
+from utils import keyword_index
+from utils.dify_client import DifyClient, build_headers
+from utils.keyword_index import KeywordMirror
+from utils.retrieve_cache import cache_scope
+from tools.knowledge_status import KnowledgeStatusTool
+from tools.knowledge_upload import KnowledgeUploadTool
+
+
+def make_tool(tool_class, server):
+    runtime = ToolRuntime(credentials={'api_key': 'test-key', 'base_url': server.base_url}, user_id=None, session_id=None)
+    return tool_class(runtime, None)
+
+
+def split_upload(tool, knowledge_base_name, text, **parameters):
+    return json_output(list(tool._invoke(dict({
+        "knowledge_base_name": knowledge_base_name,
+        "reuse_existing": True,
+        "document_name": "Doc",
+        "text": text,
+        "split_large_text": True,
+        "max_part_bytes": 40,
+        "indexing_technique": "economy"
+    }, **parameters))))
+
+
+def test_split_upload_keeps_part_names_and_removes_leftover_parts():
+    """Test that an edited text updates its parts in place and deletes the parts it no longer has"""
+    knowledge_base_name = f"split-{uuid.uuid4().hex[:8]}"
+    paragraphs = ["First paragraph of the text.\n\n", "Second paragraph of the text.\n\n", "Third paragraph.\n"]
+    with StubDifyServer() as server:
+        tool = make_tool(KnowledgeUploadTool, server)
+        result = split_upload(tool, knowledge_base_name, ''.join(paragraphs))
+        parts = {part['name']: part for part in result['document']['parts']}
+        assert list(parts) == ["Doc (part 1)", "Doc (part 2)", "Doc (part 3)"]
+        assert result['document']['status'] == 'completed'
+
+        # A part named after an earlier number of parts is replaced as well
+        dataset_id = result['id']
+        server.state.add_document(dataset_id, "Doc (part 1/3)", "Old naming")
+
+        result = split_upload(tool, knowledge_base_name, paragraphs[0] + "Second paragraph, edited.\n")
+        actions = {part['name']: (part['id'], part['action']) for part in result['document']['parts']}
+        assert actions == {"Doc (part 1)": (parts["Doc (part 1)"]['id'], 'skipped'),
+                           "Doc (part 2)": (parts["Doc (part 2)"]['id'], 'updated')}
+        assert sorted(result['document']['removed_parts']) == ["Doc (part 1/3)", "Doc (part 3)"]
+        documents = server.state.datasets[dataset_id]['documents']
+        assert sorted(document['name'] for document in documents) == ["Doc (part 1)", "Doc (part 2)"]
+
+
+def test_split_upload_without_waiting_returns_the_batches_to_check():
+    """Test that a split upload that does not wait reports every part's batch and the status tool tracks them"""
+    knowledge_base_name = f"split-{uuid.uuid4().hex[:8]}"
+    with StubDifyServer(indexing_delay=0.3) as server:
+        upload = make_tool(KnowledgeUploadTool, server)
+        messages = list(upload._invoke({
+            "knowledge_base_name": knowledge_base_name,
+            "document_name": "Doc",
+            "text": "First paragraph of the text.\n\nSecond paragraph of the text.\n",
+            "split_large_text": True,
+            "max_part_bytes": 40,
+            "wait_for_indexing": False,
+            "indexing_technique": "economy"
+        }))
+        assert any("Knowledge Status tool" in getattr(message.message, 'text', '') for message in messages)
+        result = json_output(messages)
+        assert result['document']['status'] == 'waiting'
+        batches = [part['batch'] for part in result['document']['parts']]
+        assert len(batches) == 2 and all(batches)
+
+        status = make_tool(KnowledgeStatusTool, server)
+        # A batch given twice is checked once
+        parameters = {"dataset_id": result['id'], "batch": ",".join(batches + batches[:1])}
+        checked = json_output(list(status._invoke(parameters)))
+        assert checked['done'] is False
+        assert [document['batch'] for document in checked['documents']] == batches
+
+        time.sleep(0.4)
+        checked = json_output(list(status._invoke(parameters)))
+        assert checked['done'] is True
+        assert checked['summary'] == {"completed": 2}
+        assert {document['id'] for document in checked['documents']} == {part['id'] for part in result['document']['parts']}
+
+
+def test_upload_creates_an_unchanged_document_again_once_it_was_deleted():
+    """Test that the manifest only skips a document that still exists in the knowledge base"""
+    knowledge_base_name = f"skip-{uuid.uuid4().hex[:8]}"
+    with StubDifyServer() as server:
+        tool = make_tool(KnowledgeUploadTool, server)
+        first = split_upload(tool, knowledge_base_name, "Short text.", split_large_text=False)
+        assert first['document']['action'] == 'created'
+        assert split_upload(tool, knowledge_base_name, "Short text.", split_large_text=False)['document']['action'] == 'skipped'
+
+        # The document is deleted on the platform
+        server.state.datasets[first['id']]['documents'].clear()
+        again = split_upload(tool, knowledge_base_name, "Short text.", split_large_text=False)
+        assert again['document']['action'] == 'created'
+        assert again['document']['id'] != first['document']['id']
+        assert [document['id'] for document in server.state.datasets[first['id']]['documents']] == [again['document']['id']]
+
+
+def test_upload_reports_document_errors_once():
+    """Test that an error message of the document helpers reaches the user unchanged"""
+    with StubDifyServer() as server:
+        tool = make_tool(KnowledgeUploadTool, server)
+        tool._create_document_by_text = lambda *args: "Error: File size exceeded."
+        messages = list(tool._invoke({"knowledge_base_name": f"error-{uuid.uuid4().hex[:8]}", "document_name": "Doc",
+                                      "text": "Some text."}))
+    assert messages[-1].message.text == "Error: File size exceeded."
+
+
+def test_status_tool_mirrors_documents_uploaded_without_waiting(tmp_path, monkeypatch):
+    """Test that documents reported completed by the status tool are copied into the keyword mirror"""
+    mirror = KeywordMirror(str(tmp_path / "mirror"), ttl=60)
+    monkeypatch.setattr(keyword_index, '_mirror', mirror)
+    with StubDifyServer(indexing_delay=0.2) as server:
+        dataset = server.state.add_dataset(f"mirror-{uuid.uuid4().hex[:8]}")
+        server.state.add_document(dataset['id'], "Existing", "existing text")
+        headers = build_headers('test-key')
+        scope = cache_scope(headers, server.base_url)
+        assert mirror.rebuild(DifyClient(headers, server.base_url), scope, dataset['id'])
+
+        result = json_output(list(make_tool(KnowledgeUploadTool, server)._invoke({
+            "knowledge_base_name": dataset['name'],
+            "reuse_existing": True,
+            "document_name": "Fresh",
+            "text": "uploaded without waiting",
+            "wait_for_indexing": False,
+            "indexing_technique": "economy"
+        })))
+        # The written document keeps keyword searches off the mirror until it is mirrored
+        assert mirror.search(scope, dataset['id'], "waiting", 3) is None
+
+        time.sleep(0.3)
+        status = make_tool(KnowledgeStatusTool, server)
+        assert json_output(list(status._invoke({"dataset_id": dataset['id'], "batch": result['document']['batch']})))['done']
+
+    records = mirror.search(scope, dataset['id'], "waiting", 3)
+    assert [record['segment']['document']['name'] for record in records] == ["Fresh"]
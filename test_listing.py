@@ -0,0 +1,53 @@
+import threading
+
+from utils.listing import iter_pages, list_all
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self.payload = payload
+        self.status_code = status_code
+        self.reason = "Error"
+
+    def json(self):
+        return self.payload
+
+
+def fake_endpoint(total, failing=(), report_total=True):
+    requested = []
+    lock = threading.Lock()
+
+    def fetch(page, limit):
+        with lock:
+            requested.append(page)
+        if page in failing:
+            return FakeResponse({"code": "unavailable", "message": "Unavailable"}, 503)
+        items = [{"id": index} for index in range((page - 1) * limit, min(page * limit, total))]
+        payload = {"data": items, "has_more": page * limit < total, "page": page, "limit": limit}
+        if report_total:
+            payload["total"] = total
+        return FakeResponse(payload)
+
+    return fetch, requested
+
+
+def test_iter_pages_yields_every_page_in_order():
+    """Test that concurrently fetched pages come out in page order"""
+    fetch, requested = fake_endpoint(total=95)
+    pages = list(iter_pages(fetch, 10, 4, "documents"))
+    assert [page for page, _ in pages] == list(range(1, 11))
+    assert [item["id"] for _, items in pages for item in items] == list(range(95))
+    assert sorted(requested) == list(range(1, 11))
+
+    # Endpoints without a total are walked page by page
+    fetch, _ = fake_endpoint(total=25, report_total=False)
+    assert len(list_all(fetch, 10, 4, "segments")) == 25
+
+
+def test_iter_pages_reports_failed_pages():
+    """Test that a failed page is reported without losing the others"""
+    fetch, _ = fake_endpoint(total=50, failing={3})
+    pages = dict(iter_pages(fetch, 10, 4, "documents"))
+    assert pages[3] is None
+    assert sum(len(items) for items in pages.values() if items) == 40
+    assert list_all(fetch, 10, 4, "documents") is None
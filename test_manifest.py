@@ -0,0 +1,25 @@
+from utils.manifest import UploadManifest, content_hash
+
+
+def test_upload_manifest_plans_create_skip_and_update(tmp_path):
+    """Test that the manifest skips unchanged documents and updates changed ones"""
+    manifest = UploadManifest(str(tmp_path / "manifest.sqlite3"))
+
+    action, entry, text_hash = manifest.plan("ds-1", "Doc", "first version")
+    assert action == "create"
+    assert entry is None
+    assert text_hash == content_hash("first version")
+
+    manifest.record("ds-1", "Doc", text_hash, "doc-1", "waiting")
+    # A document that is still indexing is not uploaded again, one that failed is
+    assert manifest.plan("ds-1", "Doc", "first version")[0] == "skip"
+    manifest.update_status("ds-1", "Doc", "error")
+    assert manifest.plan("ds-1", "Doc", "first version")[0] == "update"
+
+    manifest.update_status("ds-1", "Doc", "completed")
+    action, entry, _ = manifest.plan("ds-1", "Doc", "first version")
+    assert action == "skip"
+    assert entry["document_id"] == "doc-1"
+
+    assert manifest.plan("ds-1", "Doc", "second version")[0] == "update"
+    assert manifest.plan("ds-2", "Doc", "first version")[0] == "create"
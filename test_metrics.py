@@ -0,0 +1,29 @@
+from utils.metrics import Metrics
+
+
+def test_metrics_histograms_counters_and_hooks():
+    """Test per-phase latency quantiles, error counters, hooks and the text exposition"""
+    metrics = Metrics(buckets=(0.1, 0.5, 1.0))
+    calls = []
+    metrics.add_hook(lambda *args: calls.append(args))
+
+    for _ in range(9):
+        metrics.observe('retrieve', 0.05)
+    metrics.observe('retrieve', 0.7, 'error', 'dataset_not_found')
+
+    phase = metrics.snapshot()['phases']['retrieve']
+    assert phase['count'] == 10
+    assert phase['p50'] == 0.1
+    assert phase['p99'] == 1.0
+    assert calls[-1] == ('retrieve', 0.7, 'error', 'dataset_not_found')
+
+    text = metrics.render_text()
+    assert 'dify_knowledge_phase_seconds_bucket{phase="retrieve",le="0.1"} 9' in text
+    assert 'dify_knowledge_phase_seconds_bucket{phase="retrieve",le="+Inf"} 10' in text
+    assert 'dify_knowledge_requests_total{outcome="error",phase="retrieve"} 1' in text
+    assert 'dify_knowledge_errors_total{code="dataset_not_found",phase="retrieve"} 1' in text
+
+    # A failing hook does not break observation
+    metrics.add_hook(lambda *args: 1 / 0)
+    metrics.observe('poll', 0.2)
+    assert metrics.snapshot()['phases']['poll']['count'] == 1
@@ -0,0 +1,53 @@
+import email
+import json
+
+from bench.stub_server import StubDifyServer
+from utils.dify_client import build_headers
+from utils.documents import create_document_by_file
+from utils.multipart import MultipartStream, iter_file_chunks
+
+
+def test_multipart_stream_reads_the_file_lazily(tmp_path):
+    """Test that the body is a valid form whose file part is read chunk by chunk while it is sent"""
+    path = tmp_path / "notes.txt"
+    content = b"line of text\n" * 1000
+    path.write_bytes(content)
+
+    read = []
+
+    def chunks():
+        for chunk in iter_file_chunks(str(path), chunk_size=4096):
+            read.append(len(chunk))
+            yield chunk
+
+    body = MultipartStream({"data": json.dumps({"indexing_technique": "economy"})}, "file", "notes.txt", chunks(),
+                           len(content), "text/plain")
+    pieces = iter(body)
+    head = next(pieces)
+    # Nothing is read from the file before the form fields are sent
+    assert read == []
+    sent = b''.join(pieces)
+    assert read == [4096, 4096, 4096, 712]
+    assert len(head) + len(sent) == body.len
+
+    message = email.message_from_bytes(f"Content-Type: {body.content_type}\r\n\r\n".encode() + head + sent)
+    fields, upload = message.get_payload()
+    assert json.loads(fields.get_payload()) == {"indexing_technique": "economy"}
+    assert upload.get_filename() == "notes.txt"
+    assert upload.get_payload(decode=True) == content
+
+
+def test_create_document_by_file_streams_to_the_api(tmp_path):
+    """Test that a file is uploaded as a streamed body of unknown length"""
+    path = tmp_path / "notes.txt"
+    path.write_text("Streamed file content", encoding="utf-8")
+    headers = build_headers("test-key")
+
+    with StubDifyServer() as server:
+        dataset = server.state.add_dataset("files")
+        result = create_document_by_file(headers, dataset['id'], "notes.txt", iter_file_chunks(str(path)), None,
+                                         "text/plain", "economy", server.base_url)
+        document = server.state.datasets[dataset['id']]['documents'][0]
+
+    assert result == {"id": document['id'], "batch": document['batch']}
+    assert "Streamed file content" in ''.join(segment['content'] for segment in document['segments'])
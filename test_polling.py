@@ -0,0 +1,125 @@
+import pytest
+
+from utils import polling
+from utils.polling import IndexingPoller, poll_batches, poll_progress, run_to_completion
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self.payload = payload
+        self.status_code = status_code
+
+    def json(self):
+        return self.payload
+
+
+class FakeClient:
+    """Reports each batch as indexing until its scripted number of checks has passed"""
+
+    def __init__(self, rounds, failing=()):
+        self.rounds = rounds
+        self.failing = set(failing)
+        self.checks = {}
+
+    def get_indexing_status(self, dataset_id, batch):
+        self.checks[batch] = self.checks.get(batch, 0) + 1
+        if batch in self.failing and self.checks[batch] == 1:
+            raise ConnectionError("connection reset")
+        rounds, final = self.rounds[batch]
+        status = final if self.checks[batch] >= rounds else 'indexing'
+        return FakeResponse({"data": [{"indexing_status": status, "completed_segments": min(self.checks[batch], rounds),
+                                       "total_segments": rounds}]})
+
+
+class FakeTime:
+    """Clock that only moves when something sleeps"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(polling, 'time', fake)
+    return fake
+
+
+def test_indexing_poller_backs_off_until_the_deadline(clock):
+    """Test that checks back off exponentially, follow the progress estimate and stop at the deadline"""
+    poller = IndexingPoller(clock.now + 10, first_interval=1.0, max_interval=4.0, factor=2.0, jitter=0.0)
+    delays = []
+    while (delay := poller.next_delay()) is not None:
+        delays.append(delay)
+        clock.sleep(delay)
+
+    # The last wait is cut short so no check happens after the deadline
+    assert delays == [1.0, 2.0, 4.0, 3.0]
+    assert poller.attempts == 4
+    assert clock.now == 1010.0
+
+    poller = IndexingPoller(clock.now + 60, first_interval=8.0, max_interval=8.0, jitter=0.0)
+    poller.observe(10, 100)
+    clock.sleep(2.0)
+    poller.observe(30, 100)
+    # 20 segments in 2s leaves about 7s for the last 70
+    assert poller.estimated_remaining == pytest.approx(7.0)
+    assert poller.next_delay() == pytest.approx(7.0)
+
+
+def test_poll_batches_checks_unfinished_batches_each_round(clock):
+    """Test that one loop tracks many batches, only unfinished ones are checked again"""
+    client = FakeClient({"b1": (1, 'completed'), "b2": (3, 'completed'), "b3": (2, 'error')}, failing=["b2"])
+    rounds = []
+    poll = poll_batches(client, "ds-1", ["b1", "b2", "b3"], clock.now + 60, max_concurrency=2)
+    while True:
+        try:
+            statuses = next(poll)
+        except StopIteration as stop:
+            statuses = stop.value
+            break
+        rounds.append({batch: status['indexing_status'] for batch, status in statuses.items()})
+
+    assert rounds == [
+        # The failed check of b2 leaves it waiting, the next round checks it again
+        {"b1": 'completed', "b2": 'waiting', "b3": 'indexing'},
+        {"b1": 'completed', "b2": 'indexing', "b3": 'error'},
+        {"b1": 'completed', "b2": 'completed', "b3": 'error'}
+    ]
+    assert client.checks == {"b1": 1, "b2": 3, "b3": 2}
+    # One wait per round for the whole set
+    assert len(clock.sleeps) == 2
+
+
+def test_poll_batches_stops_at_the_deadline(clock):
+    """Test that batches still indexing at the deadline are returned with their last status"""
+    client = FakeClient({"b1": (100, 'completed')})
+    statuses = run_to_completion(poll_batches(client, "ds-1", ["b1"], clock.now + 5))
+    assert statuses["b1"]["indexing_status"] == 'indexing'
+    assert clock.now == pytest.approx(1005.0)
+
+
+def test_poll_progress_reports_changes_in_finished_batches(clock):
+    """Test that progress is reported once per change in the number of finished batches"""
+    client = FakeClient({"b1": (1, 'completed'), "b2": (3, 'completed'), "b3": (3, 'error')})
+    poll = poll_progress(client, "ds-1", ["b1", "b2", "b3"], clock.now + 60, 2, lambda finished, total: (finished, total))
+    reported = []
+    while True:
+        try:
+            reported.append(next(poll))
+        except StopIteration as stop:
+            statuses = stop.value
+            break
+
+    # The second round finishes nothing and reports nothing
+    assert reported == [(1, 3), (3, 3)]
+    assert {batch: status['indexing_status'] for batch, status in statuses.items()} == {
+        "b1": 'completed', "b2": 'completed', "b3": 'error'}
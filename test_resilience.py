@@ -0,0 +1,83 @@
+import time
+
+import httpx
+import pytest
+import requests
+
+from utils import async_client, dify_client
+from utils.resilience import CircuitBreaker, RetryPolicy, TokenBucket, retry_after
+
+
+def make_response(status_code, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return response
+
+
+def test_retry_policy_honors_retry_after_and_idempotency():
+    """Test which failures are retried and how long the policy waits"""
+    policy = RetryPolicy(max_retries=2, base_delay=0.1, max_delay=5)
+
+    assert retry_after(make_response(429, {'Retry-After': '2'})) == 2.0
+    assert policy.delay(0, make_response(429, {'Retry-After': '2'})) == 2.0
+    # Waits longer than the limit are not retried
+    assert policy.delay(0, make_response(429, {'Retry-After': '60'})) is None
+    assert 0.075 <= policy.delay(0) <= 0.125
+
+    assert policy.should_retry(0, False, response=make_response(429))
+    assert not policy.should_retry(0, False, response=make_response(502))
+    assert policy.should_retry(0, True, response=make_response(502))
+    assert not policy.should_retry(0, True, response=make_response(400))
+    assert not policy.should_retry(2, True, response=make_response(503))
+    assert policy.should_retry(0, False, error=requests.exceptions.ConnectTimeout())
+    assert not policy.should_retry(0, False, error=requests.exceptions.ReadTimeout())
+
+
+def test_token_bucket_and_circuit_breaker():
+    """Test the rate limiter spacing calls and the breaker opening, failing fast and recovering"""
+    bucket = TokenBucket(rate=50, burst=2)
+    assert bucket.acquire() == 0 and bucket.acquire() == 0
+    assert 0.01 <= bucket.acquire() <= 0.03
+
+    breaker = CircuitBreaker(threshold=2, reset_timeout=0.05)
+    assert not breaker.record_failure()
+    assert breaker.record_failure()
+    assert breaker.allow() is not None
+
+    time.sleep(0.06)
+    # One probe is let through, a failing probe opens the circuit again
+    assert breaker.allow() is None
+    assert breaker.allow() is not None
+    assert breaker.record_failure()
+
+    time.sleep(0.06)
+    assert breaker.allow() is None
+    breaker.record_success()
+    assert breaker.state == 'closed' and breaker.allow() is None
+
+
+def test_circuit_breaker_probe_released_by_unexpected_errors(monkeypatch):
+    """Test that a probe failing with a non-network error lets the next call probe the circuit again"""
+    breaker = CircuitBreaker(threshold=1, reset_timeout=0.0)
+    monkeypatch.setattr(dify_client, 'get_circuit_breaker', lambda base_url: breaker)
+    monkeypatch.setattr(async_client, 'get_circuit_breaker', lambda base_url: breaker)
+
+    def fail(*args, **kwargs):
+        raise ValueError("broken response")
+
+    client = dify_client.DifyClient(dify_client.build_headers('test-key'), 'http://dify.test/v1')
+    monkeypatch.setattr(client, '_send', fail)
+    breaker.record_failure()
+    with pytest.raises(ValueError):
+        client.list_datasets()
+    # The circuit is open again with its reset time passed, so the async request below is the next probe
+    assert breaker.state == 'open'
+
+    engine = async_client.AsyncEngine(pool_size=1, transport=httpx.MockTransport(fail))
+    try:
+        with pytest.raises(ValueError):
+            engine.run(async_client.AsyncDifyClient(client.headers, client.base_url, engine).retrieve('ds-1', {}), timeout=10)
+    finally:
+        engine.close()
+    assert breaker.state == 'open' and breaker.allow() is None
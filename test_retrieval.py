@@ -0,0 +1,59 @@
+from utils.retrieval import (compact_records, merge_top_k, parse_list_parameter, parse_query_batch,
+                             reciprocal_rank_fusion)
+
+
+def test_parse_list_parameter():
+    """Test the accepted forms of list parameters"""
+    assert parse_list_parameter("ds-1") == ["ds-1"]
+    assert parse_list_parameter(" ds-1, ds-2 ,") == ["ds-1", "ds-2"]
+    assert parse_list_parameter('["ds-1", "ds-2"]') == ["ds-1", "ds-2"]
+    assert parse_list_parameter(["ds-1", ""]) == ["ds-1"]
+    assert parse_list_parameter(None) == []
+
+
+def test_merge_top_k_applies_threshold_after_merge():
+    """Test that records from several datasets are merged by score"""
+    first = [{"score": 0.9, "id": "a"}, {"score": 0.4, "id": "b"}]
+    second = [{"score": 0.7, "id": "c"}, {"score": 0.6, "id": "d"}]
+
+    merged = merge_top_k([first, second], top_k=3)
+    assert [record["id"] for record in merged] == ["a", "c", "d"]
+
+    merged = merge_top_k([first, second], top_k=3, score_threshold=0.65)
+    assert [record["id"] for record in merged] == ["a", "c"]
+
+
+def test_parse_query_batch():
+    """Test that only JSON arrays switch retrieval to batch mode"""
+    assert parse_query_batch("what is dify, and why") is None
+    assert parse_query_batch('["first", " second ", ""]') == ["first", "second"]
+    assert parse_query_batch("[not json") is None
+
+
+def test_reciprocal_rank_fusion_merges_by_segment():
+    """Test that segments found by several searches rank above segments found by one"""
+    semantic = [{"segment": {"id": "a"}, "score": 0.9}, {"segment": {"id": "b"}, "score": 0.8}]
+    full_text = [{"segment": {"id": "c"}, "score": 12.0}, {"segment": {"id": "b"}, "score": 9.0}]
+
+    fused = reciprocal_rank_fusion([semantic, full_text], top_k=2)
+    assert [record["segment"]["id"] for record in fused] == ["b", "a"]
+    assert fused[0]["score"] == round(2 / 62, 6)
+    assert reciprocal_rank_fusion([semantic, full_text], top_k=0) == []
+
+
+def test_compact_records_applies_budgets():
+    """Test that compact records keep only the needed fields and respect the character budgets"""
+    records = [
+        {"segment": {"id": "a", "content": "x" * 10, "keywords": ["k"], "document": {"id": "d", "name": "Doc"}}, "score": 0.9},
+        {"segment": {"id": "b", "content": "y" * 10, "document": {"name": "Doc"}}, "score": 0.8},
+        {"segment": {"id": "c", "content": "z" * 10, "document": {"name": "Doc"}}, "score": 0.7}
+    ]
+
+    compact, omitted = compact_records(records)
+    assert compact[0] == {"segment_id": "a", "document": "Doc", "score": 0.9, "content": "x" * 10}
+    assert omitted == 0
+
+    compact, omitted = compact_records(records, max_record_chars=6, max_total_chars=9)
+    assert [record["content"] for record in compact] == ["x" * 6, "y" * 3]
+    assert all(record["truncated"] for record in compact)
+    assert omitted == 1
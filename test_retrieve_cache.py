@@ -0,0 +1,71 @@
+import os
+import time
+
+from utils.retrieve_cache import DiskRetrieveCache, RetrieveCache
+
+
+def test_retrieve_cache_lru_ttl_and_invalidation():
+    """Test eviction order, expiry and per-dataset invalidation of the retrieve cache"""
+    cache = RetrieveCache(max_size=2, ttl=60)
+    model = {"search_method": "semantic_search", "top_k": 3}
+
+    key_a = cache.make_key("ds-1", "what is  dify ", model)
+    key_b = cache.make_key("ds-1", "other", model)
+    key_c = cache.make_key("ds-2", "third", model)
+
+    # Queries differing only in whitespace share an entry
+    assert key_a == cache.make_key("ds-1", "what is dify", model)
+
+    cache.set(key_a, {"records": ["a"]})
+    cache.set(key_b, {"records": ["b"]})
+    assert cache.get(key_a) == {"records": ["a"]}
+
+    # key_b is least recently used and gets evicted
+    cache.set(key_c, {"records": ["c"]})
+    assert cache.get(key_b) is None
+    assert cache.get(key_c) == {"records": ["c"]}
+
+    assert cache.invalidate_dataset("ds-1") == 1
+    assert cache.get(key_a) is None
+    assert cache.get(key_c) is not None
+
+    stats = cache.stats()
+    assert stats["hits"] == 3
+    assert stats["misses"] == 2
+
+    cache.configure(max_size=2, ttl=0.01)
+    cache.set(key_a, {"records": ["a"]})
+    time.sleep(0.02)
+    assert cache.get(key_a) is None
+
+
+def test_disk_retrieve_cache_is_shared_between_instances(tmp_path):
+    """Test that workers using the same cache file share entries, invalidation and eviction"""
+    path = os.path.join(str(tmp_path), "retrieve_cache.sqlite3")
+    worker_a = DiskRetrieveCache(path, max_size=2, ttl=60)
+    worker_b = DiskRetrieveCache(path, max_size=2, ttl=60)
+    model = {"search_method": "semantic_search", "top_k": 3}
+
+    key_a = worker_a.make_key("ds-1", "what is dify", model)
+    key_b = worker_a.make_key("ds-1", "other", model)
+    key_c = worker_a.make_key("ds-2", "third", model)
+
+    worker_a.set(key_a, {"records": ["a"]})
+    assert worker_b.get(key_a) == {"records": ["a"]}
+
+    worker_b.set(key_b, {"records": ["b"]})
+    time.sleep(0.01)
+    assert worker_a.get(key_a) is not None
+
+    # key_b is least recently used and gets evicted
+    worker_a.set(key_c, {"records": ["c"]})
+    assert worker_b.get(key_b) is None
+
+    assert worker_b.invalidate_dataset("ds-1") == 1
+    assert worker_a.get(key_a) is None
+    assert worker_a.get(key_c) == {"records": ["c"]}
+
+    worker_a.configure(max_size=2, ttl=0.01)
+    worker_a.set(key_a, {"records": ["a"]})
+    time.sleep(0.02)
+    assert worker_b.get(key_a) is None
@@ -0,0 +1,46 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils.single_flight import SingleFlight
+
+
+def test_single_flight_shares_one_call():
+    """Test that concurrent callers with the same key share the result and error of one call"""
+    flight = SingleFlight()
+    entered = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow_call():
+        calls.append(1)
+        entered.set()
+        release.wait(1)
+        return {"records": []}
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(flight.do, "key", slow_call) for _ in range(4)]
+        entered.wait(1)
+        # Give the other callers time to join the call in flight
+        time.sleep(0.05)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True]
+    assert all(result is results[0][0] for result, _ in results)
+    assert flight.in_flight() == 0
+
+    def failing_call():
+        release.wait(1)
+        raise ValueError("upstream failed")
+
+    release.clear()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(flight.do, "key", failing_call) for _ in range(2)]
+        release.set()
+        for future in futures:
+            with pytest.raises(ValueError):
+                future.result()
@@ -0,0 +1,60 @@
+from utils.sync import chunk_document, diff_segments, segment_fingerprint
+
+
+def test_chunk_document_splits_at_headings():
+    """Test that an edit in one section leaves the chunks of the other sections unchanged"""
+    text = "# Intro\n\nFirst paragraph.\n\n## Usage\n\nSecond paragraph.\n\n## Notes\n\nThird paragraph.\n"
+    chunks = chunk_document(text)
+    assert len(chunks) == 3
+    assert chunks[1].startswith("## Usage")
+
+    edited = chunk_document(text.replace("Second paragraph.", "Second paragraph, edited."))
+    assert edited[0] == chunks[0] and edited[2] == chunks[2]
+    assert edited[1] != chunks[1]
+
+
+def test_diff_segments_plans_minimal_changes():
+    """Test that only edited, added and removed chunks produce segment changes"""
+    segments = [{"id": f"seg-{index}", "position": index + 1, "content": content}
+                for index, content in enumerate(["alpha", "beta", "gamma", "delta"])]
+    # Dify strips leading symbols and the position order counts, not the list order
+    segments[0]["content"] = "# alpha"
+    segments.reverse()
+
+    plan = diff_segments(segments, ["# alpha", "beta edited", "gamma", "delta", "epsilon"])
+    assert plan["update"] == [("seg-1", "beta edited")]
+    assert plan["add"] == ["epsilon"]
+    assert plan["delete"] == []
+    assert plan["unchanged"] == 3
+
+    plan = diff_segments(segments, ["alpha", "delta"])
+    assert plan["update"] == [] and plan["add"] == []
+    assert plan["delete"] == ["seg-1", "seg-2"]
+    assert segment_fingerprint("  #  alpha\n") == segment_fingerprint("alpha")
+
+
+def apply_plan(segments, plan):
+    """Apply a plan the way Dify does, added segments are appended at the end"""
+    updates = dict(plan["update"])
+    applied = [{"id": segment["id"], "position": index + 1, "content": updates.get(segment["id"], segment["content"])}
+               for index, segment in enumerate(segment for segment in segments if segment["id"] not in plan["delete"])]
+    applied.extend({"id": f"new-{index}", "position": len(applied) + index + 1, "content": chunk}
+                   for index, chunk in enumerate(plan["add"]))
+    return applied
+
+
+def test_diff_segments_keeps_the_order_of_inserted_chunks():
+    """Test that a chunk inserted in the middle leaves the document in file order and a second sync has nothing to do"""
+    segments = [{"id": f"seg-{index}", "position": index + 1, "content": content}
+                for index, content in enumerate(["alpha", "beta", "gamma"])]
+    chunks = ["alpha", "inserted", "beta", "gamma"]
+
+    plan = diff_segments(segments, chunks)
+    assert plan["update"] == [("seg-1", "inserted"), ("seg-2", "beta")]
+    assert plan["add"] == ["gamma"]
+    assert plan["unchanged"] == 1
+
+    applied = apply_plan(segments, plan)
+    assert [segment["content"] for segment in applied] == chunks
+    plan = diff_segments(applied, chunks)
+    assert plan == {"update": [], "add": [], "delete": [], "unchanged": 4}
@@ -0,0 +1,21 @@
+from utils.text_splitter import split_text, text_size
+
+
+def test_split_text_respects_limit_and_keeps_content():
+    """Test that large text is split on block boundaries under the byte limit"""
+    text = "# Intro\nshort paragraph\n\n## Details\n" + "word " * 40 + "\n\n## Unicode\n" + "知识库" * 30 + "\n"
+
+    assert split_text(text, 10000) == [text]
+
+    parts = split_text(text, 100)
+    assert len(parts) > 1
+    assert all(text_size(part) <= 100 for part in parts)
+    assert "".join(parts).replace("\n", "") == text.replace("\n", "")
+    # Headings start a new part when the previous one is full
+    assert any(part.startswith("## Details") or part.startswith("## Unicode") for part in parts)
+
+
+def test_split_text_keeps_whole_characters_below_the_minimum_size():
+    """Test that a limit below one character still splits, one whole character per part"""
+    assert split_text("\u4e2d\u6587" * 3, 2) == ["\u4e2d", "\u6587"] * 3
+    assert split_text("ab\U0001F600cd", 1) == ["ab", "\U0001F600", "cd"]
@@ -193,6 +193,12 @@ def test_knowledge_upload_tool():
     tool._create_knowledge_base = lambda headers, name, desc, perm, tech: "test-dataset-id-123"
     tool._create_document_by_text = lambda headers, dataset_id, doc_name, text, tech: {"id": "test-doc-id-456", "batch": "test-batch-789"}
     tool._check_document_status = lambda headers, dataset_id, batch: "completed"
+
+    def mock_poll_document_status(headers, dataset_id, batch, deadline=None):
+        return "completed"
+        yield
+    
+    tool._poll_document_status = mock_poll_document_status
     
     # Mock the create_text_message and create_json_message methods
     def mock_create_text_message(content):
@@ -0,0 +1,152 @@
+import json
+from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+from dify_plugin import Tool
+from dify_plugin.entities.tool import ToolInvokeMessage
+
+from utils.config import DEFAULT_MAX_CONCURRENCY, get_api_key, get_base_url, get_credentials
+from utils.dify_client import DifyClient, build_headers
+from utils.documents import create_knowledge_base, find_knowledge_base, upload_document
+from utils.keyword_index import mark_documents_written, mirror_documents
+from utils.logger import get_logger
+from utils.manifest import open_upload_manifest
+from utils.polling import poll_deadline, poll_progress
+from utils.retrieve_cache import get_retrieve_cache
+
+logger = get_logger(__name__)
+
+class KnowledgeBulkUploadTool(Tool):
+    def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[ToolInvokeMessage, None, None]:
+        deadline = poll_deadline()
+        
+        # Get parameters
+        knowledge_base_name = tool_parameters.get('knowledge_base_name')
+        description = tool_parameters.get('description', '')
+        documents_param = tool_parameters.get('documents')
+        permission = tool_parameters.get('permission', 'only_me')
+        indexing_technique = tool_parameters.get('indexing_technique', 'high_quality')
+        reuse_existing = tool_parameters.get('reuse_existing', True)
+        skip_unchanged = tool_parameters.get('skip_unchanged', True)
+        max_concurrency = int(tool_parameters.get('max_concurrency') or DEFAULT_MAX_CONCURRENCY)
+        wait_for_indexing = tool_parameters.get('wait_for_indexing', True)
+        
+        # Check required parameters
+        if not knowledge_base_name:
+            yield self.create_text_message("Knowledge base name is required.")
+            return
+        
+        documents = self._parse_documents(documents_param)
+        if isinstance(documents, str):
+            yield self.create_text_message(documents)
+            return
+        
+        # Get API Key from the provider credentials
+        api_key = get_api_key(get_credentials(self.runtime))
+        if not api_key:
+            yield self.create_text_message("API Key not found. Please make sure it's set in the plugin configuration.")
+            return
+        
+        # Set request headers
+        headers = build_headers(api_key)
+        base_url = self._get_base_url()
+        
+        # Step 1: Create knowledge base, or reuse an existing one with the same name
+        dataset_id = find_knowledge_base(headers, knowledge_base_name, base_url=base_url) if reuse_existing else None
+        if dataset_id:
+            yield self.create_text_message(f"Using existing knowledge base: {knowledge_base_name}, ID: {dataset_id}")
+        else:
+            yield self.create_text_message(f"Creating knowledge base: {knowledge_base_name}...")
+            dataset_id = create_knowledge_base(headers, knowledge_base_name, description, permission, indexing_technique, base_url)
+            if not dataset_id and reuse_existing:
+                dataset_id = find_knowledge_base(headers, knowledge_base_name, force_refresh=True, base_url=base_url)
+            if not dataset_id:
+                yield self.create_text_message("Failed to create knowledge base. Please check your API Key and parameters.")
+                return
+            yield self.create_text_message(f"Knowledge base created successfully, ID: {dataset_id}")
+        
+        # Step 2: Create or update all changed documents concurrently
+        yield self.create_text_message(f"Uploading {len(documents)} documents...")
+        
+        manifest = open_upload_manifest() if skip_unchanged else None
+        workers = max(1, min(max_concurrency, len(documents)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            summaries = list(executor.map(
+                lambda document: upload_document(headers, dataset_id, document['name'], document['text'], indexing_technique,
+                                                 manifest, base_url),
+                documents
+            ))
+        
+        get_retrieve_cache().invalidate_dataset(dataset_id)
+        
+        created = [summary for summary in summaries if summary.get('batch')]
+        mark_documents_written(headers, base_url, dataset_id, [summary['id'] for summary in created])
+        skipped = sum(1 for summary in summaries if summary.get('action') == 'skipped')
+        yield self.create_text_message(f"{len(created)} of {len(documents)} documents uploaded successfully, {skipped} unchanged and skipped")
+        
+        # Step 3: Track the processing status of all documents with one poller, unless the caller uses the status tool
+        if created and not wait_for_indexing:
+            yield self.create_text_message("Indexing continues in the background, check it with the Knowledge Status tool using the document batches.")
+        elif created:
+            yield self.create_text_message("Processing documents, please wait...")
+            statuses = yield from poll_progress(
+                DifyClient(headers, base_url), dataset_id, [summary['batch'] for summary in created], deadline, max_concurrency,
+                lambda finished, total: self.create_text_message(f"{finished} of {total} documents processed")
+            )
+            get_retrieve_cache().invalidate_dataset(dataset_id)
+            
+            for summary in created:
+                status = statuses.get(summary['batch'], {})
+                summary['status'] = status.get('indexing_status', 'processing')
+                if status.get('error'):
+                    summary['error'] = status['error']
+                if manifest:
+                    manifest.update_status(dataset_id, summary['name'], summary['status'])
+            mirror_documents(headers, base_url, dataset_id, {summary['id']: summary['name'] for summary in created
+                                                             if summary['status'] == 'completed'})
+        
+        counts = {}
+        for summary in summaries:
+            counts[summary['status']] = counts.get(summary['status'], 0) + 1
+        yield self.create_text_message(
+            "Upload finished: " + ", ".join(f"{count} {status}" for status, count in counts.items())
+        )
+        
+        # Return detailed information
+        yield self.create_json_message({
+            "status": 200,
+            "id": dataset_id,
+            "knowledge_base": {
+                "id": dataset_id,
+                "name": knowledge_base_name
+            },
+            "summary": counts,
+            "documents": summaries
+        })
+    
+    def _get_base_url(self) -> Optional[str]:
+        """Return the Dify API base URL configured for the provider"""
+        return get_base_url(get_credentials(self.runtime))
+    
+    def _parse_documents(self, documents_param: Any) -> Any:
+        """Parse the documents parameter into a list of name and text pairs, or return an error message"""
+        if not documents_param:
+            return "Documents are required."
+        
+        documents = documents_param
+        if isinstance(documents_param, str):
+            try:
+                documents = json.loads(documents_param)
+            except ValueError:
+                return "Documents must be a JSON array of objects with 'name' and 'text'."
+        
+        if not isinstance(documents, list) or not documents:
+            return "Documents must be a JSON array of objects with 'name' and 'text'."
+        
+        parsed = []
+        for i, document in enumerate(documents):
+            if not isinstance(document, dict) or not document.get('name') or not document.get('text'):
+                return f"Document {i+1} must have a 'name' and a 'text'."
+            parsed.append({"name": str(document['name']), "text": str(document['text'])})
+        return parsed
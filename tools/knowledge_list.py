@@ -0,0 +1,84 @@
+import json
+from collections.abc import Generator
+from typing import Any, Callable, Optional
+
+from dify_plugin import Tool
+from dify_plugin.entities.tool import ToolInvokeMessage
+
+from utils.config import DEFAULT_MAX_CONCURRENCY, get_api_key, get_base_url, get_credentials
+from utils.dify_client import DifyClient, build_headers
+from utils.listing import MAX_PAGE_SIZE, iter_pages
+
+RESOURCES = ('datasets', 'documents', 'segments')
+OUTPUT_FORMATS = ('json', 'jsonl')
+
+class KnowledgeListTool(Tool):
+    def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[ToolInvokeMessage, None, None]:
+        # Get parameters
+        resource = tool_parameters.get('resource') or 'documents'
+        dataset_id = tool_parameters.get('dataset_id')
+        document_id = tool_parameters.get('document_id')
+        page_size = int(tool_parameters.get('page_size') or MAX_PAGE_SIZE)
+        max_concurrency = int(tool_parameters.get('max_concurrency') or DEFAULT_MAX_CONCURRENCY)
+        output_format = tool_parameters.get('output_format') or 'json'
+        
+        # Check required parameters
+        if resource not in RESOURCES:
+            yield self.create_text_message(f"Resource must be one of: {', '.join(RESOURCES)}.")
+            return
+        
+        if resource != 'datasets' and not dataset_id:
+            yield self.create_text_message("Knowledge base ID is required to list documents and segments.")
+            return
+        
+        if resource == 'segments' and not document_id:
+            yield self.create_text_message("Document ID is required to list segments.")
+            return
+        
+        if output_format not in OUTPUT_FORMATS:
+            yield self.create_text_message(f"Output format must be one of: {', '.join(OUTPUT_FORMATS)}.")
+            return
+        
+        # Get API Key from the provider credentials
+        api_key = get_api_key(get_credentials(self.runtime))
+        if not api_key:
+            yield self.create_text_message("API Key not found. Please make sure it's set in the plugin configuration.")
+            return
+        
+        client = DifyClient(build_headers(api_key), get_base_url(get_credentials(self.runtime)))
+        fetch = self._page_fetcher(client, resource, dataset_id, document_id)
+        
+        # Every page is sent on as soon as it is its turn, so only the pages in flight are held in memory
+        count = 0
+        failed_pages = []
+        for page, items in iter_pages(fetch, page_size, max_concurrency, resource, dataset_id=dataset_id,
+                                      document_id=document_id):
+            if items is None:
+                failed_pages.append(page)
+                yield self.create_text_message(f"Error: Page {page} of the {resource} could not be read.")
+                continue
+            count += len(items)
+            if output_format == 'jsonl':
+                if items:
+                    yield self.create_text_message('\n'.join(json.dumps(item, ensure_ascii=False) for item in items) + '\n')
+            else:
+                yield self.create_json_message({"resource": resource, "page": page, "items": items})
+        
+        # Return the listing summary last
+        yield self.create_json_message({
+            "status": 200,
+            "resource": resource,
+            "dataset_id": dataset_id,
+            "document_id": document_id,
+            "count": count,
+            "failed_pages": failed_pages
+        })
+    
+    def _page_fetcher(self, client: DifyClient, resource: str, dataset_id: Optional[str],
+                      document_id: Optional[str]) -> Callable:
+        """Return a function requesting one page of the resource"""
+        if resource == 'datasets':
+            return lambda page, limit: client.list_datasets(page, limit)
+        if resource == 'documents':
+            return lambda page, limit: client.list_documents(dataset_id, page, limit)
+        return lambda page, limit: client.list_segments(dataset_id, document_id, page, limit)
@@ -1,12 +1,28 @@
-import os
-import json
-import requests
 from collections.abc import Generator
-from typing import Any, Dict, Optional, List
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from typing import TYPE_CHECKING, Any, Dict, Optional, List, Tuple
 
 from dify_plugin import Tool
 from dify_plugin.entities.tool import ToolInvokeMessage
 
+from utils.config import (DEFAULT_MAX_CONCURRENCY, get_api_key, get_base_url, get_credentials, get_int_setting,
+                          use_async_engine)
+from utils.dify_client import DifyClient, build_headers, response_error
+from utils.keyword_index import get_keyword_mirror
+from utils.logger import fields, get_logger
+from utils.metrics import get_metrics
+from utils.retrieval import (FUSION_METHODS, compact_records, merge_top_k, parse_list_parameter, parse_query_batch,
+                             reciprocal_rank_fusion, record_key)
+from utils.retrieve_cache import (DEFAULT_CACHE_SIZE, DEFAULT_CACHE_TTL, RetrieveCache, cache_scope,
+                                  get_retrieve_cache)
+from utils.single_flight import get_single_flight
+
+if TYPE_CHECKING:
+    from utils.async_client import AsyncDifyClient
+
+logger = get_logger(__name__)
+
 class KnowledgeRetrieveTool(Tool):
     def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[ToolInvokeMessage, None, None]:
         # Get parameters
@@ -17,12 +33,21 @@ class KnowledgeRetrieveTool(Tool):
         top_k = tool_parameters.get('top_k', 3)
         score_threshold_enabled = tool_parameters.get('score_threshold_enabled', False)
         score_threshold = tool_parameters.get('score_threshold', 0.5)
+        use_cache = tool_parameters.get('use_cache', True)
+        max_concurrency = tool_parameters.get('max_concurrency') or DEFAULT_MAX_CONCURRENCY
+        fusion_methods = list(dict.fromkeys(parse_list_parameter(tool_parameters.get('fusion_methods'))))
+        compact = tool_parameters.get('output_mode', 'full') == 'compact'
+        # 0 leaves the content of compact results uncut
+        max_record_chars = int(tool_parameters.get('max_record_chars') or 0) or None
+        max_total_chars = int(tool_parameters.get('max_total_chars') or 0) or None
+        
+        # Parameter names only, queries may contain user data
+        logger.debug(fields("retrieve invoked", parameters=",".join(tool_parameters)))
         
-        # Debug information
-        print(f"Received parameters: {tool_parameters}")
+        dataset_ids = parse_list_parameter(dataset_id)
         
         # Check required parameters
-        if not dataset_id:
+        if not dataset_ids:
             yield self.create_text_message("Knowledge base ID is required.")
             return
         
@@ -30,17 +55,21 @@ class KnowledgeRetrieveTool(Tool):
             yield self.create_text_message("Query content is required.")
             return
         
-        # Get API Key from environment variables
-        api_key = os.environ.get('DIFY_KNOWLEDGE_API_KEY')
+        unknown_methods = [method for method in fusion_methods if method not in FUSION_METHODS]
+        if unknown_methods:
+            yield self.create_text_message(
+                f"Unsupported fusion methods: {', '.join(unknown_methods)}. Use {', '.join(FUSION_METHODS)}."
+            )
+            return
+        
+        # Get API Key from the provider credentials
+        api_key = get_api_key(get_credentials(self.runtime))
         if not api_key:
             yield self.create_text_message("API Key not found. Please make sure it's set in the plugin configuration.")
             return
         
         # Set request headers
-        headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json'
-        }
+        headers = build_headers(api_key)
         
         # Build retrieval model parameters
         retrieval_model = {
@@ -57,10 +86,27 @@ class KnowledgeRetrieveTool(Tool):
             "score_threshold": score_threshold if score_threshold_enabled else None
         }
         
+        search_methods = fusion_methods or [search_method]
+        if len(search_methods) > 1:
+            # Reciprocal rank fusion takes the place of the reranking model
+            retrieval_model["reranking_enable"] = False
+        
+        # Several queries given as a JSON array are retrieved as one batch
+        queries = parse_query_batch(query)
+        if queries is not None:
+            if not queries:
+                yield self.create_text_message("Query content is required.")
+                return
+            yield from self._invoke_batch(headers, dataset_id, dataset_ids, queries, retrieval_model, use_cache, max_concurrency,
+                                          search_methods, compact, max_record_chars, max_total_chars)
+            return
+        
         # Perform knowledge base retrieval
-        yield self.create_text_message(f"Retrieving information from knowledge base {dataset_id} related to '{query}'...")
+        if not compact:
+            yield self.create_text_message(f"Retrieving information from knowledge base {dataset_id} related to '{query}'...")
         
-        result = self._retrieve_from_knowledge_base(headers, dataset_id, query, retrieval_model)
+        result = self._search_many(headers, dataset_ids, [query], retrieval_model, use_cache, max_concurrency,
+                                   search_methods)[0]
         if not result:
             yield self.create_text_message("Retrieval failed. Please check your API Key and parameters.")
             return
@@ -76,66 +122,331 @@ class KnowledgeRetrieveTool(Tool):
             yield self.create_text_message(f"No information found related to '{query}'.")
             return
         
-        # Return retrieval results
-        yield self.create_text_message(f"Found {len(records)} related results:")
+        errors = result.get('errors')
+        if errors and not compact:
+            yield self.create_text_message(f"Some knowledge bases could not be searched: {', '.join(errors)}")
         
-        for i, record in enumerate(records):
-            segment = record.get('segment', {})
-            content = segment.get('content', '')
-            document = segment.get('document', {})
-            document_name = document.get('name', 'Unknown document')
-            score = record.get('score', 0)
+        if compact:
+            # A single message holding only what the model needs, cut to the character budgets
+            results, omitted = compact_records(records, max_record_chars, max_total_chars)
+        else:
+            # Return retrieval results
+            yield self.create_text_message(f"Found {len(records)} related results:")
             
-            result_text = f"Result {i+1}:\n"
-            result_text += f"Document: {document_name}\n"
-            result_text += f"Relevance: {score}\n"
-            result_text += f"Content: {content}\n"
-            result_text += "-------------------"
-            
-            yield self.create_text_message(result_text)
+            for i, record in enumerate(records):
+                yield self.create_text_message(self._format_record(i, record))
+            results, omitted = records, 0
         
         # Return detailed information
-        yield self.create_json_message({
+        response = {
             "status": "success",
             "query": query,
             "knowledge_base_id": dataset_id,
-            "results": records
-        })
+            "results": results
+        }
+        if omitted:
+            response["omitted"] = omitted
+        if len(dataset_ids) > 1:
+            response["knowledge_base_ids"] = dataset_ids
+        if len(search_methods) > 1:
+            response["search_methods"] = search_methods
+        if len(dataset_ids) > 1 or len(search_methods) > 1:
+            response["errors"] = result.get('errors', {})
+        yield self.create_json_message(response)
+    
+    def _invoke_batch(self, headers: Dict, dataset_id: str, dataset_ids: List[str], queries: List[str],
+                      retrieval_model: Dict, use_cache: bool, max_concurrency: int,
+                      search_methods: Optional[List[str]] = None, compact: bool = False,
+                      max_record_chars: Optional[int] = None,
+                      max_total_chars: Optional[int] = None) -> Generator[ToolInvokeMessage, None, None]:
+        """Retrieve several queries at once and return one combined result"""
+        if not compact:
+            yield self.create_text_message(f"Retrieving information from knowledge base {dataset_id} for {len(queries)} queries...")
+        
+        results = self._search_many(headers, dataset_ids, queries, retrieval_model, use_cache, max_concurrency, search_methods)
+        
+        batch_results = []
+        listed = set()
+        result_index = 0
+        # The total character budget is shared by all queries of the batch
+        remaining = max_total_chars
+        for query, result in zip(queries, results):
+            if not isinstance(result, dict):
+                error = result or "Retrieval failed"
+                batch_results.append({"query": query, "status": "error", "error": error, "results": []})
+                if not compact:
+                    yield self.create_text_message(f"Query '{query}' failed: {error}")
+                continue
+            
+            records = result.get('records', [])
+            query_result = {"query": query, "status": "success", "results": records}
+            if result.get('errors'):
+                query_result["errors"] = result['errors']
+            batch_results.append(query_result)
+            
+            if compact:
+                query_result["results"], omitted = compact_records(records, max_record_chars, remaining)
+                if omitted:
+                    query_result["omitted"] = omitted
+                if remaining is not None:
+                    remaining -= sum(len(record['content']) for record in query_result["results"])
+                continue
+            
+            # Segments matched by an earlier query are only listed once
+            new_records = [record for record in records if record_key(record) not in listed]
+            listed.update(record_key(record) for record in new_records)
+            
+            yield self.create_text_message(
+                f"Query '{query}': found {len(records)} related results, {len(new_records)} not listed above"
+            )
+            for record in new_records:
+                yield self.create_text_message(self._format_record(result_index, record))
+                result_index += 1
+        
+        response = {
+            "status": "success",
+            "queries": queries,
+            "knowledge_base_id": dataset_id,
+            "results": batch_results
+        }
+        if len(dataset_ids) > 1:
+            response["knowledge_base_ids"] = dataset_ids
+        if search_methods and len(search_methods) > 1:
+            response["search_methods"] = search_methods
+        yield self.create_json_message(response)
+    
+    def _format_record(self, index: int, record: Dict) -> str:
+        """Format a retrieved record as text"""
+        segment = record.get('segment', {})
+        content = segment.get('content', '')
+        document = segment.get('document', {})
+        document_name = document.get('name', 'Unknown document')
+        score = record.get('score', 0)
+        
+        result_text = f"Result {index+1}:\n"
+        result_text += f"Document: {document_name}\n"
+        result_text += f"Relevance: {score}\n"
+        result_text += f"Content: {content}\n"
+        result_text += "-------------------"
+        return result_text
+    
+    def _search_many(self, headers: Dict, dataset_ids: List[str], queries: List[str], retrieval_model: Dict,
+                     use_cache: bool = True, max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+                     search_methods: Optional[List[str]] = None) -> List:
+        """Retrieve every query from every knowledge base with every search method on one bounded thread pool"""
+        federated = len(dataset_ids) > 1
+        methods = search_methods or [retrieval_model.get('search_method')]
+        fused = len(methods) > 1
+        # With several knowledge bases the threshold is applied once on the merged records,
+        # fused ranks have no comparable score so each search applies it instead
+        merge_threshold = federated and not fused
+        dataset_model = dict(retrieval_model, score_threshold_enabled=False, score_threshold=None) if merge_threshold else retrieval_model
+        
+        tasks = [(query, ds_id, method) for query in queries for ds_id in dataset_ids for method in methods]
+        retrieve = lambda task: self._cached_retrieve(headers, task[1], task[0], dict(dataset_model, search_method=task[2]), use_cache)
+        if len(tasks) == 1:
+            results = [retrieve(tasks[0])]
+        elif use_async_engine():
+            results = self._retrieve_many_async(headers, tasks, dataset_model, use_cache, max_concurrency)
+        else:
+            workers = max(1, min(int(max_concurrency), len(tasks)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(retrieve, tasks))
+        
+        if not federated and not fused:
+            return results
+        
+        top_k = retrieval_model.get('top_k', 3)
+        score_threshold = retrieval_model.get('score_threshold') if retrieval_model.get('score_threshold_enabled') else None
+        per_query = len(dataset_ids) * len(methods)
+        merged = []
+        for i in range(len(queries)):
+            query_results = results[i * per_query:(i + 1) * per_query]
+            if fused:
+                merged.append(self._fuse_results(dataset_ids, methods, query_results, top_k))
+            else:
+                merged.append(self._merge_dataset_results(dataset_ids, query_results, top_k, score_threshold))
+        return merged
+    
+    def _fuse_results(self, dataset_ids: List[str], methods: List[str], results: List, top_k: int) -> Optional[Dict]:
+        """Fuse the rankings of one query from every knowledge base and search method with reciprocal rank fusion"""
+        federated = len(dataset_ids) > 1
+        record_lists = []
+        errors = {}
+        for (ds_id, method), result in zip(product(dataset_ids, methods), results):
+            if isinstance(result, dict):
+                records = result.get('records', [])
+                record_lists.append([dict(record, dataset_id=ds_id) for record in records] if federated else records)
+            else:
+                errors[f"{ds_id} ({method})"] = result or "Retrieval failed"
+        
+        if not record_lists:
+            return "; ".join(f"{search}: {error}" for search, error in errors.items())
+        
+        return {
+            "records": reciprocal_rank_fusion(record_lists, top_k),
+            "errors": errors
+        }
+    
+    def _merge_dataset_results(self, dataset_ids: List[str], results: List, top_k: int,
+                               score_threshold: Optional[float]) -> Optional[Dict]:
+        """Merge the results of one query across knowledge bases into one top-k"""
+        record_lists = []
+        errors = {}
+        for ds_id, result in zip(dataset_ids, results):
+            if isinstance(result, dict):
+                record_lists.append([dict(record, dataset_id=ds_id) for record in result.get('records', [])])
+            else:
+                errors[ds_id] = result or "Retrieval failed"
+        
+        if not record_lists:
+            return "; ".join(f"{ds_id}: {error}" for ds_id, error in errors.items())
+        
+        return {
+            "records": merge_top_k(record_lists, top_k, score_threshold),
+            "errors": errors
+        }
+    
+    def _get_base_url(self) -> Optional[str]:
+        """Return the Dify API base URL configured for the provider"""
+        return get_base_url(get_credentials(self.runtime))
+    
+    def _get_cache(self) -> RetrieveCache:
+        """Return the shared retrieve cache configured from the provider settings"""
+        credentials = get_credentials(self.runtime)
+        cache = get_retrieve_cache()
+        max_size = get_int_setting(credentials, 'retrieve_cache_size', DEFAULT_CACHE_SIZE)
+        ttl = get_int_setting(credentials, 'retrieve_cache_ttl', DEFAULT_CACHE_TTL)
+        if (max_size, ttl) != (cache.max_size, cache.ttl):
+            cache.configure(max_size, ttl)
+        return cache
+    
+    def _cached_retrieve(self, headers: Dict, dataset_id: str, query: str, retrieval_model: Dict, use_cache: bool = True) -> Optional[Dict]:
+        """Retrieve from knowledge base, serving repeated queries from the result cache"""
+        if use_cache:
+            result = self._mirror_search(headers, dataset_id, query, retrieval_model)
+            if result is not None:
+                return result
+        
+        cache = self._get_cache()
+        key = cache.make_key(dataset_id, query, retrieval_model, cache_scope(headers, self._get_base_url()))
+        if not use_cache or not cache.enabled:
+            return self._coalesced_retrieve(key, headers, dataset_id, query, retrieval_model)
+        
+        result = cache.get(key)
+        get_metrics().increment('dify_knowledge_retrieve_cache_total', result='miss' if result is None else 'hit')
+        if result is not None:
+            return result
+        
+        result = self._coalesced_retrieve(key, headers, dataset_id, query, retrieval_model)
+        # Only successful responses are cached, error messages are strings
+        if isinstance(result, dict):
+            cache.set(key, result)
+        return result
+    
+    def _mirror_search(self, headers: Dict, dataset_id: str, query: str, retrieval_model: Dict) -> Optional[Dict]:
+        """Answer a keyword search from the local mirror of the knowledge base, refreshing it when stale"""
+        mirror = get_keyword_mirror()
+        # The mirror cannot apply a reranking model, and its scores are relative so a score threshold means nothing to it
+        if (not mirror.enabled or retrieval_model.get('search_method') != 'keyword_search'
+                or retrieval_model.get('reranking_enable') or retrieval_model.get('score_threshold_enabled')):
+            return None
+        
+        scope = cache_scope(headers, self._get_base_url())
+        records = mirror.search(scope, dataset_id, query, retrieval_model.get('top_k', 3))
+        if records is None:
+            # This search goes to the API, later ones are answered locally once the mirror is rebuilt
+            mirror.refresh_in_background(DifyClient(headers, self._get_base_url()), scope, dataset_id)
+            return None
+        return {"query": {"content": query}, "records": records}
+    
+    def _coalesced_retrieve(self, key: Tuple, headers: Dict, dataset_id: str, query: str, retrieval_model: Dict) -> Optional[Dict]:
+        """Retrieve from knowledge base, sharing one request among concurrent callers with the same key"""
+        result, shared = get_single_flight().do(
+            key, lambda: self._retrieve_from_knowledge_base(headers, dataset_id, query, retrieval_model)
+        )
+        if shared:
+            get_metrics().increment('dify_knowledge_retrieve_coalesced_total')
+        return result
+    
+    def _retrieve_many_async(self, headers: Dict, tasks: List[Tuple], retrieval_model: Dict, use_cache: bool,
+                             max_concurrency: int) -> List:
+        """Retrieve (query, dataset ID, search method) tasks on the async engine, serving cached ones first"""
+        cache = self._get_cache()
+        scope = cache_scope(headers, self._get_base_url())
+        results = [None] * len(tasks)
+        # Identical tasks of one invocation are sent once
+        missing: Dict[Tuple, List[int]] = {}
+        for index, (query, ds_id, method) in enumerate(tasks):
+            if use_cache:
+                results[index] = self._mirror_search(headers, ds_id, query, dict(retrieval_model, search_method=method))
+                if results[index] is not None:
+                    continue
+            key = cache.make_key(ds_id, query, dict(retrieval_model, search_method=method), scope)
+            if use_cache and cache.enabled:
+                cached = cache.get(key)
+                get_metrics().increment('dify_knowledge_retrieve_cache_total', result='miss' if cached is None else 'hit')
+                if cached is not None:
+                    results[index] = cached
+                    continue
+            missing.setdefault(key, []).append(index)
+        if not missing:
+            return results
+        
+        # The async engine pulls in asyncio, so it is only imported when it is used
+        from utils.async_client import AsyncDifyClient, gather_limited, get_async_engine
+        client = AsyncDifyClient(headers, self._get_base_url())
+        pending = []
+        for indexes in missing.values():
+            query, ds_id, method = tasks[indexes[0]]
+            pending.append(self._retrieve_async(client, ds_id, query, dict(retrieval_model, search_method=method)))
+        fetched = get_async_engine().run(gather_limited(pending, max_concurrency))
+        
+        for (key, indexes), result in zip(missing.items(), fetched):
+            # Only successful responses are cached, error messages are strings
+            if use_cache and isinstance(result, dict):
+                cache.set(key, result)
+            for index in indexes:
+                results[index] = result
+        return results
+    
+    async def _retrieve_async(self, client: 'AsyncDifyClient', dataset_id: str, query: str, retrieval_model: Dict) -> Optional[Dict]:
+        """Retrieve information from knowledge base on the async engine"""
+        try:
+            response = await client.retrieve(dataset_id, {"query": query, "retrieval_model": retrieval_model})
+            return self._retrieve_result(dataset_id, response)
+        except Exception as e:
+            logger.error(fields("retrieval failed", dataset_id=dataset_id, error=str(e)))
+            return f"Exception occurred: {str(e)}"
     
     def _retrieve_from_knowledge_base(self, headers: Dict, dataset_id: str, query: str, retrieval_model: Dict) -> Optional[Dict]:
         """Retrieve information from knowledge base"""
         try:
-            url = f"https://api.dify.ai/v1/datasets/{dataset_id}/retrieve"
+            client = DifyClient(headers, self._get_base_url())
             
             payload = {
                 "query": query,
                 "retrieval_model": retrieval_model
             }
             
-            print(f"Knowledge base retrieval request URL: {url}")
-            print(f"Knowledge base retrieval request parameters: {payload}")
-            
-            response = requests.post(url, headers=headers, json=payload)
-            
-            print(f"Knowledge base retrieval response status code: {response.status_code}")
-            print(f"Knowledge base retrieval response content: {response.text}")
-            
-            if response.status_code == 200:
-                return response.json()
-            else:
-                error_data = response.json()
-                error_code = error_data.get('code', 'unknown_error')
-                error_message = error_data.get('message', 'Unknown error')
-                
-                if error_code == "dataset_not_found":
-                    return "Knowledge base does not exist or you don't have access"
-                elif error_code == "invalid_api_key":
-                    return "Invalid API Key"
-                else:
-                    print(f"Error retrieving from knowledge base: {error_message}")
-                    print(f"Status code: {response.status_code}")
-                    print(f"Response content: {response.text}")
-                    return f"Retrieval failed: {error_message}"
+            response = client.retrieve(dataset_id, payload)
+            return self._retrieve_result(dataset_id, response)
         except Exception as e:
-            print(f"Error occurred while retrieving from knowledge base: {str(e)}")
-            return f"Exception occurred: {str(e)}" 
\ No newline at end of file
+            logger.error(fields("retrieval failed", dataset_id=dataset_id, error=str(e)))
+            return f"Exception occurred: {str(e)}"
+    
+    def _retrieve_result(self, dataset_id: str, response: Any) -> Optional[Dict]:
+        """Return the body of a retrieve response, or an error message when it failed"""
+        if response.status_code == 200:
+            return response.json()
+        
+        error_code, error_message = response_error(response)
+        
+        if error_code == "dataset_not_found":
+            return "Knowledge base does not exist or you don't have access"
+        elif error_code == "invalid_api_key":
+            return "Invalid API Key"
+        else:
+            logger.error(fields("retrieval failed", dataset_id=dataset_id, status=response.status_code,
+                                code=error_code, message=error_message))
+            return f"Retrieval failed: {error_message}" 
\ No newline at end of file
@@ -0,0 +1,139 @@
+from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, List
+
+from dify_plugin import Tool
+from dify_plugin.entities.tool import ToolInvokeMessage
+
+from utils.config import DEFAULT_MAX_CONCURRENCY, get_api_key, get_base_url, get_credentials
+from utils.dify_client import DifyClient, build_headers
+from utils.keyword_index import get_keyword_mirror, mirror_documents
+from utils.logger import fields, get_logger
+from utils.manifest import get_upload_manifest
+from utils.polling import TERMINAL_STATUSES, check_batches
+from utils.retrieval import parse_list_parameter
+from utils.retrieve_cache import get_retrieve_cache
+
+logger = get_logger(__name__)
+
+class KnowledgeStatusTool(Tool):
+    def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[ToolInvokeMessage, None, None]:
+        # Get parameters
+        dataset_id = tool_parameters.get('dataset_id')
+        # Duplicate batch IDs are checked once
+        batches = list(dict.fromkeys(parse_list_parameter(tool_parameters.get('batch'))))
+        max_concurrency = int(tool_parameters.get('max_concurrency') or DEFAULT_MAX_CONCURRENCY)
+        
+        # Check required parameters
+        if not dataset_id:
+            yield self.create_text_message("Knowledge base ID is required.")
+            return
+        
+        if not batches:
+            yield self.create_text_message("At least one batch ID is required.")
+            return
+        
+        # Get API Key from the provider credentials
+        api_key = get_api_key(get_credentials(self.runtime))
+        if not api_key:
+            yield self.create_text_message("API Key not found. Please make sure it's set in the plugin configuration.")
+            return
+        
+        # Set request headers
+        headers = build_headers(api_key)
+        
+        # Check every batch once, concurrently, without waiting for them to finish
+        client = DifyClient(headers, get_base_url(get_credentials(self.runtime)))
+        statuses = check_batches(client, dataset_id, batches, max_concurrency)
+        
+        documents = [self._document_status(batch, statuses.get(batch)) for batch in batches]
+        finished = [document for document in documents if document['status'] in TERMINAL_STATUSES]
+        
+        if any(document['status'] == 'completed' for document in finished):
+            # Newly indexed documents change what retrieval returns
+            get_retrieve_cache().invalidate_dataset(dataset_id)
+        self._record_statuses(dataset_id, finished)
+        self._mirror_completed(client, dataset_id, finished, max_concurrency)
+        
+        for document in documents:
+            yield self.create_text_message(self._format_status(document))
+        
+        counts = {}
+        for document in documents:
+            counts[document['status']] = counts.get(document['status'], 0) + 1
+        done = len(finished) == len(documents)
+        yield self.create_text_message(
+            f"{len(finished)} of {len(documents)} documents finished" + ("" if done else ", check again later for the others")
+        )
+        
+        # Return detailed information
+        yield self.create_json_message({
+            "status": 200,
+            "id": dataset_id,
+            "done": done,
+            "summary": counts,
+            "documents": documents
+        })
+    
+    def _document_status(self, batch: str, status: Optional[Dict]) -> Dict:
+        """Summarize the indexing status of one batch"""
+        if status is None:
+            return {"batch": batch, "status": "unknown", "error": "The status could not be checked, please try again."}
+        
+        document = {
+            "batch": batch,
+            "id": status.get('id'),
+            "status": status.get('indexing_status', 'unknown'),
+            "completed_segments": status.get('completed_segments'),
+            "total_segments": status.get('total_segments')
+        }
+        error = status.get('error')
+        if error:
+            document["error"] = error
+        return document
+    
+    def _format_status(self, document: Dict) -> str:
+        """Format the status of one document as text"""
+        message = f"Batch {document['batch']}: {document['status']}"
+        completed = document.get('completed_segments')
+        total = document.get('total_segments')
+        if isinstance(completed, int) and isinstance(total, int) and total > 0:
+            message += f", {completed}/{total} segments indexed"
+        if document.get('error'):
+            message += f" ({document['error']})"
+        return message
+    
+    def _mirror_completed(self, client: DifyClient, dataset_id: str, documents: List[Dict], max_concurrency: int) -> None:
+        """Copy the segments of completed documents into the keyword mirror, as a waiting upload does"""
+        document_ids = [document['id'] for document in documents if document['status'] == 'completed' and document.get('id')]
+        if not document_ids or not get_keyword_mirror().enabled:
+            return
+        # Indexing statuses do not carry the document names the mirror keeps with each segment
+        workers = max(1, min(max_concurrency, len(document_ids)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            names = dict(zip(document_ids, executor.map(lambda document_id: self._document_name(client, dataset_id, document_id),
+                                                        document_ids)))
+        mirror_documents(client.headers, client.base_url, dataset_id,
+                         {document_id: name for document_id, name in names.items() if name is not None})
+    
+    def _document_name(self, client: DifyClient, dataset_id: str, document_id: str) -> Optional[str]:
+        """Return the name of a document, or None when it could not be read"""
+        try:
+            response = client.get_document(dataset_id, document_id)
+            if response.status_code == 200:
+                return response.json().get('name', '')
+        except Exception as e:
+            logger.warning(fields("document name unavailable", dataset_id=dataset_id, document_id=document_id, error=str(e)))
+        return None
+    
+    def _record_statuses(self, dataset_id: str, documents: List[Dict]) -> None:
+        """Store final statuses in the upload manifest so unchanged documents are skipped next time"""
+        documents = [document for document in documents if document.get('id')]
+        if not documents:
+            return
+        try:
+            manifest = get_upload_manifest()
+            for document in documents:
+                manifest.update_status_by_document(dataset_id, document['id'], document['status'])
+        except Exception as e:
+            logger.warning(fields("upload manifest unavailable", error=str(e)))
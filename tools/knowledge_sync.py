@@ -0,0 +1,256 @@
+import os
+from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, List, Tuple
+
+from dify_plugin import Tool
+from dify_plugin.entities.tool import ToolInvokeMessage
+
+from utils.config import DEFAULT_MAX_CONCURRENCY, get_api_key, get_base_url, get_credentials
+from utils.dify_client import DifyClient, build_headers
+from utils.documents import create_document_by_text, create_knowledge_base, find_knowledge_base, update_document_by_text
+from utils.keyword_index import mark_documents_written, mirror_documents
+from utils.listing import list_documents, list_segments
+from utils.logger import fields, get_logger
+from utils.manifest import UploadManifest, content_hash, open_upload_manifest
+from utils.polling import poll_deadline, poll_progress
+from utils.retrieval import parse_list_parameter
+from utils.retrieve_cache import get_retrieve_cache
+from utils.sync import (DEFAULT_SYNC_PATTERNS, REINDEX_RATIO, SEGMENT_SEPARATOR, changed_segments, chunk_document,
+                        diff_segments, list_files, segment_changes, send_change, sync_process_rule)
+
+logger = get_logger(__name__)
+
+class KnowledgeSyncTool(Tool):
+    def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[ToolInvokeMessage, None, None]:
+        deadline = poll_deadline()
+        
+        # Get parameters
+        knowledge_base_name = tool_parameters.get('knowledge_base_name')
+        directory = tool_parameters.get('directory')
+        patterns = parse_list_parameter(tool_parameters.get('patterns')) or list(DEFAULT_SYNC_PATTERNS)
+        permission = tool_parameters.get('permission', 'only_me')
+        indexing_technique = tool_parameters.get('indexing_technique', 'high_quality')
+        delete_missing = tool_parameters.get('delete_missing', False)
+        max_concurrency = int(tool_parameters.get('max_concurrency') or DEFAULT_MAX_CONCURRENCY)
+        wait_for_indexing = tool_parameters.get('wait_for_indexing', True)
+        
+        # Check required parameters
+        if not knowledge_base_name:
+            yield self.create_text_message("Knowledge base name is required.")
+            return
+        
+        if not directory or not os.path.isdir(directory):
+            yield self.create_text_message("Directory is required and must exist on the plugin host.")
+            return
+        
+        files = list_files(directory, patterns)
+        if not files and not delete_missing:
+            yield self.create_text_message(f"No files matching {', '.join(patterns)} found in {directory}.")
+            return
+        
+        # Get API Key from the provider credentials
+        api_key = get_api_key(get_credentials(self.runtime))
+        if not api_key:
+            yield self.create_text_message("API Key not found. Please make sure it's set in the plugin configuration.")
+            return
+        
+        # Set request headers
+        headers = build_headers(api_key)
+        base_url = get_base_url(get_credentials(self.runtime))
+        
+        # Step 1: Find the knowledge base, or create it on the first sync
+        dataset_id = find_knowledge_base(headers, knowledge_base_name, base_url=base_url)
+        if dataset_id:
+            yield self.create_text_message(f"Using existing knowledge base: {knowledge_base_name}, ID: {dataset_id}")
+        else:
+            yield self.create_text_message(f"Creating knowledge base: {knowledge_base_name}...")
+            dataset_id = create_knowledge_base(headers, knowledge_base_name, '', permission, indexing_technique, base_url)
+            if not dataset_id:
+                dataset_id = find_knowledge_base(headers, knowledge_base_name, force_refresh=True, base_url=base_url)
+            if not dataset_id:
+                yield self.create_text_message("Failed to create knowledge base. Please check your API Key and parameters.")
+                return
+            yield self.create_text_message(f"Knowledge base created successfully, ID: {dataset_id}")
+        
+        # Step 2: Compare every file with its document and segments concurrently
+        client = DifyClient(headers, base_url)
+        remote_documents = list_documents(client, dataset_id, max_concurrency)
+        if remote_documents is None:
+            yield self.create_text_message("Failed to list the documents of the knowledge base, please try again.")
+            return
+        remote_by_name = {document.get('name'): document for document in remote_documents}
+        
+        yield self.create_text_message(f"Comparing {len(files)} files with {len(remote_documents)} documents...")
+        
+        manifest = open_upload_manifest()
+        workers = max(1, min(max_concurrency, len(files) or 1))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            plans = list(executor.map(
+                lambda file: self._plan_file(client, dataset_id, file[0], file[1], remote_by_name.get(file[0]), manifest),
+                files
+            ))
+            if delete_missing:
+                local_names = {name for name, _ in files}
+                plans.extend({"name": name, "action": "delete", "id": document.get('id')}
+                             for name, document in remote_by_name.items() if name not in local_names)
+            
+            # Step 3: Send every document and segment change through one pool, whatever file it belongs to
+            changes = [(index, change) for index, plan in enumerate(plans)
+                       for change in self._changes(client, headers, base_url, dataset_id, plan, indexing_technique)]
+            yield self.create_text_message(f"Sending {len(changes)} changes...")
+            results = list(executor.map(lambda change: change[1](), changes))
+        
+        summaries = self._summarize(plans, changes, results)
+        if changes:
+            get_retrieve_cache().invalidate_dataset(dataset_id)
+            mark_documents_written(headers, base_url, dataset_id, [summary['id'] for summary in summaries if summary.get('id')
+                                                                   and summary['action'] != 'unchanged'])
+        self._record(manifest, dataset_id, plans, summaries)
+        
+        # Step 4: Track the documents that are indexed again as a whole, segment changes apply right away
+        indexed = [summary for summary in summaries if summary.get('batch')]
+        if indexed and not wait_for_indexing:
+            yield self.create_text_message("Indexing continues in the background, check it with the Knowledge Status tool using the document batches.")
+        elif indexed:
+            yield self.create_text_message("Processing documents, please wait...")
+            statuses = yield from poll_progress(
+                client, dataset_id, [summary['batch'] for summary in indexed], deadline, max_concurrency,
+                lambda finished, total: self.create_text_message(f"{finished} of {total} documents processed")
+            )
+            get_retrieve_cache().invalidate_dataset(dataset_id)
+            
+            for summary in indexed:
+                status = statuses.get(summary['batch'], {})
+                summary['status'] = status.get('indexing_status', 'processing')
+                if status.get('error'):
+                    summary['error'] = status['error']
+                if manifest:
+                    manifest.update_status(dataset_id, summary['name'], summary['status'])
+        
+        # Patched segments are searchable right away, indexed documents once they completed
+        mirror_documents(headers, base_url, dataset_id,
+                         {summary['id']: summary['name'] for summary in summaries
+                          if summary['action'] in ('patched', 'created', 'reindexed') and summary['status'] == 'completed'},
+                         [summary['id'] for summary in summaries if summary['action'] == 'deleted'])
+        
+        counts = {}
+        for summary in summaries:
+            counts[summary['action']] = counts.get(summary['action'], 0) + 1
+        yield self.create_text_message(
+            "Sync finished: " + ", ".join(f"{count} {action}" for action, count in counts.items())
+        )
+        
+        # Return detailed information
+        yield self.create_json_message({
+            "status": 200,
+            "id": dataset_id,
+            "knowledge_base": {
+                "id": dataset_id,
+                "name": knowledge_base_name
+            },
+            "summary": counts,
+            "documents": summaries
+        })
+    
+    def _plan_file(self, client: DifyClient, dataset_id: str, name: str, path: str, document: Optional[Dict],
+                   manifest: Optional[UploadManifest]) -> Dict:
+        """Decide whether a file is created, left alone, patched segment by segment or indexed again"""
+        try:
+            with open(path, encoding='utf-8') as file:
+                text = file.read()
+        except (OSError, UnicodeDecodeError) as e:
+            logger.warning(fields("sync file unreadable", name=name, error=str(e)))
+            return {"name": name, "action": "error", "error": "Error: The file could not be read as UTF-8 text."}
+        
+        chunks = chunk_document(text)
+        plan = {"name": name, "hash": content_hash(text), "chunks": chunks}
+        if not chunks:
+            return dict(plan, action="error", error="Error: The file has no text to index.")
+        if document is None:
+            return dict(plan, action="create")
+        
+        plan["id"] = document.get('id')
+        # The manifest hash spares listing the segments of files unchanged since the last sync
+        entry = manifest.get(dataset_id, name) if manifest else None
+        if entry and entry['content_hash'] == plan['hash'] and entry['status'] == 'completed' and \
+                entry['document_id'] == plan['id'] and document.get('indexing_status') == 'completed':
+            return dict(plan, action="unchanged")
+        # Segments of a document that is still indexing or failed cannot be patched
+        if document.get('indexing_status') != 'completed':
+            return dict(plan, action="reindex")
+        
+        segments = list_segments(client, dataset_id, plan['id'])
+        if segments is None:
+            return dict(plan, action="reindex")
+        segment_plan = diff_segments(segments, chunks)
+        changed = changed_segments(segment_plan)
+        if not changed:
+            return dict(plan, action="unchanged", segments=segment_plan)
+        if changed > REINDEX_RATIO * max(len(segments), len(chunks)):
+            return dict(plan, action="reindex")
+        return dict(plan, action="patch", segments=segment_plan)
+    
+    def _changes(self, client: DifyClient, headers: Dict, base_url: Optional[str], dataset_id: str, plan: Dict,
+                 indexing_technique: str) -> List[Callable[[], Dict]]:
+        """Return the requests that apply one plan, each returning its result"""
+        action = plan['action']
+        if action == 'create':
+            return [lambda: self._index_document(headers, base_url, dataset_id, plan, indexing_technique)]
+        if action == 'reindex':
+            return [lambda: self._index_document(headers, base_url, dataset_id, plan, indexing_technique, plan['id'])]
+        if action == 'patch':
+            return segment_changes(client, dataset_id, plan['id'], plan['segments'])
+        if action == 'delete':
+            return [lambda: send_change(lambda: client.delete_document(dataset_id, plan['id']), 'delete_doc',
+                                        document_id=plan['id'])]
+        return []
+    
+    def _index_document(self, headers: Dict, base_url: Optional[str], dataset_id: str, plan: Dict,
+                        indexing_technique: str, document_id: Optional[str] = None) -> Dict:
+        """Create or replace a whole document, one segment per chunk"""
+        text = SEGMENT_SEPARATOR.join(plan['chunks'])
+        result = None
+        if document_id:
+            result = update_document_by_text(headers, dataset_id, document_id, plan['name'], text, base_url,
+                                             sync_process_rule())
+        if result is None:
+            result = create_document_by_text(headers, dataset_id, plan['name'], text, indexing_technique, base_url,
+                                             sync_process_rule())
+        if not isinstance(result, dict):
+            return {"error": result or "Error: Failed to index document."}
+        return result
+    
+    def _summarize(self, plans: List[Dict], changes: List[Tuple[int, Callable]], results: List[Dict]) -> List[Dict]:
+        """Combine the results of the changes of each plan into one summary per document"""
+        outcomes = [[] for _ in plans]
+        for (index, _), result in zip(changes, results):
+            outcomes[index].append(result)
+        
+        actions = {'create': 'created', 'reindex': 'reindexed', 'patch': 'patched', 'delete': 'deleted'}
+        summaries = []
+        for plan, outcome in zip(plans, outcomes):
+            summary = {"name": plan['name'], "id": plan.get('id'), "action": actions.get(plan['action'], plan['action'])}
+            errors = [result['error'] for result in outcome if result.get('error')]
+            if plan.get('error') or errors:
+                summary.update(action="error", status="error", error=plan.get('error') or errors[0])
+            elif plan['action'] in ('create', 'reindex'):
+                summary.update(id=outcome[0].get('id'), batch=outcome[0].get('batch'), status="waiting")
+            else:
+                summary["status"] = "completed"
+            if plan.get('segments'):
+                segments = plan['segments']
+                summary["segments"] = {"updated": len(segments['update']), "added": len(segments['add']),
+                                       "deleted": len(segments['delete']), "unchanged": segments['unchanged']}
+            summaries.append(summary)
+        return summaries
+    
+    def _record(self, manifest: Optional[UploadManifest], dataset_id: str, plans: List[Dict], summaries: List[Dict]) -> None:
+        """Store the synced content hashes so unchanged files are skipped next time"""
+        if not manifest:
+            return
+        for plan, summary in zip(plans, summaries):
+            if summary['action'] == 'deleted':
+                manifest.forget(dataset_id, plan['name'])
+            elif summary['action'] != 'error':
+                manifest.record(dataset_id, plan['name'], plan['hash'], summary['id'], summary['status'])
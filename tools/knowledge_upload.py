@@ -1,26 +1,50 @@
 import os
-import json
+import mimetypes
 import time
-import requests
-from collections.abc import Generator
-from typing import Any, Dict, Optional, List
+from collections.abc import Generator, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, List, Tuple
 
 from dify_plugin import Tool
 from dify_plugin.entities.tool import ToolInvokeMessage
 
+from utils.config import DEFAULT_MAX_CONCURRENCY, get_api_key, get_base_url, get_credentials
+from utils.dify_client import DifyClient, build_headers, get_session, get_timeout
+from utils.documents import (create_document_by_file, create_document_by_text, create_knowledge_base, find_knowledge_base,
+                             indexing_status_error, part_name, plan_upload, remove_stale_parts, update_document_by_text,
+                             upload_document)
+from utils.keyword_index import mark_documents_written, mirror_documents
+from utils.logger import fields, get_logger
+from utils.manifest import UploadManifest, open_upload_manifest
+from utils.multipart import CHUNK_SIZE, iter_file_chunks
+from utils.polling import TERMINAL_STATUSES, IndexingPoller, poll_deadline, poll_progress, run_to_completion
+from utils.retrieve_cache import get_retrieve_cache
+from utils.text_splitter import DEFAULT_MAX_PART_BYTES, MIN_PART_BYTES, split_text
+
+logger = get_logger(__name__)
+
 class KnowledgeUploadTool(Tool):
     def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[ToolInvokeMessage, None, None]:
+        deadline = poll_deadline()
+        
         # Get parameters
         knowledge_base_name = tool_parameters.get('knowledge_base_name')
         description = tool_parameters.get('description', '')
         document_name = tool_parameters.get('document_name')
         text_content = tool_parameters.get('text')
+        upload_file = tool_parameters.get('file')
+        file_path = tool_parameters.get('file_path')
         permission = tool_parameters.get('permission', 'only_me')
         indexing_technique = tool_parameters.get('indexing_technique', 'high_quality')
+        reuse_existing = tool_parameters.get('reuse_existing', False)
+        skip_unchanged = tool_parameters.get('skip_unchanged', True)
+        split_large_text = tool_parameters.get('split_large_text', False)
+        max_part_bytes = max(int(tool_parameters.get('max_part_bytes') or DEFAULT_MAX_PART_BYTES), MIN_PART_BYTES)
+        max_concurrency = int(tool_parameters.get('max_concurrency') or DEFAULT_MAX_CONCURRENCY)
+        wait_for_indexing = tool_parameters.get('wait_for_indexing', True)
         
-        # Debug information
-        print(f"Received parameters: {tool_parameters}")
-        print(f"Text content: {text_content}")
+        # Parameter names only, never the document content
+        logger.debug(fields("upload invoked", parameters=",".join(key for key in tool_parameters if key not in ('text', 'file'))))
         
         # Check required parameters
         if not knowledge_base_name:
@@ -31,68 +55,139 @@ class KnowledgeUploadTool(Tool):
             yield self.create_text_message("Document name is required.")
             return
         
-        if not text_content:
-            yield self.create_text_message("Text content is required.")
+        if not text_content and not upload_file and not file_path:
+            yield self.create_text_message("Text content or a file is required.")
+            return
+        
+        if file_path and not os.path.isfile(file_path):
+            yield self.create_text_message(f"File not found: {file_path}")
             return
         
-        # Get API Key from environment variables
-        api_key = os.environ.get('DIFY_KNOWLEDGE_API_KEY')
+        # Get API Key from the provider credentials
+        api_key = get_api_key(get_credentials(self.runtime))
         if not api_key:
             yield self.create_text_message("API Key not found. Please make sure it's set in the plugin configuration.")
             return
         
         # Set request headers
-        headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json'
-        }
+        headers = build_headers(api_key)
         
-        # Step 1: Create knowledge base
-        yield self.create_text_message(f"Creating knowledge base: {knowledge_base_name}...")
+        # Step 1: Create knowledge base, or reuse an existing one with the same name
+        dataset_id = None
+        if reuse_existing:
+            dataset_id = self._find_knowledge_base(headers, knowledge_base_name)
         
-        dataset_id = self._create_knowledge_base(headers, knowledge_base_name, description, permission, indexing_technique)
-        if not dataset_id:
-            yield self.create_text_message("Failed to create knowledge base. Please check your API Key and parameters.")
+        if dataset_id:
+            yield self.create_text_message(f"Using existing knowledge base: {knowledge_base_name}, ID: {dataset_id}")
+        else:
+            yield self.create_text_message(f"Creating knowledge base: {knowledge_base_name}...")
+            
+            dataset_id = self._create_knowledge_base(headers, knowledge_base_name, description, permission, indexing_technique)
+            if not dataset_id and reuse_existing:
+                # Another upload may have created it in the meantime
+                dataset_id = self._find_knowledge_base(headers, knowledge_base_name, force_refresh=True)
+            if not dataset_id:
+                yield self.create_text_message("Failed to create knowledge base. Please check your API Key and parameters.")
+                return
+            
+            yield self.create_text_message(f"Knowledge base created successfully, ID: {dataset_id}")
+        
+        # Files are streamed to the create-by-file endpoint instead of being read into memory
+        if upload_file or file_path:
+            yield from self._upload_file(headers, dataset_id, knowledge_base_name, document_name, upload_file, file_path,
+                                         indexing_technique, deadline, wait_for_indexing)
+            return
+        
+        manifest = open_upload_manifest() if skip_unchanged else None
+        
+        # Large text is uploaded as numbered parts that are indexed in parallel
+        if split_large_text:
+            parts = split_text(str(text_content), max_part_bytes)
+            if len(parts) > 1:
+                yield from self._upload_parts(headers, dataset_id, knowledge_base_name, document_name, parts,
+                                              indexing_technique, manifest, deadline, max_concurrency, wait_for_indexing)
+                return
+        
+        # Step 2: Create document with text, unless the manifest shows it was uploaded before
+        action, entry, text_hash = plan_upload(headers, dataset_id, document_name, text_content, manifest, self._get_base_url())
+        
+        if action == 'skip':
+            yield self.create_text_message(f"Document {document_name} is unchanged since the last upload, skipping.")
+            yield self.create_json_message({
+                "status": 200,
+                "id": dataset_id,
+                "knowledge_base": {
+                    "id": dataset_id,
+                    "name": knowledge_base_name
+                },
+                "document": {
+                    "id": entry['document_id'],
+                    "name": document_name,
+                    "batch": None,
+                    "status": entry['status'],
+                    "action": "skipped"
+                }
+            })
             return
         
-        yield self.create_text_message(f"Knowledge base created successfully, ID: {dataset_id}")
+        document_result = None
+        if action == 'update':
+            yield self.create_text_message(f"Document content changed, updating document: {document_name}...")
+            document_result = self._update_document_by_text(headers, dataset_id, entry['document_id'], document_name, text_content)
+            if document_result is None:
+                action = 'create'
         
-        # Step 2: Create document with text
-        yield self.create_text_message(f"Creating document: {document_name}...")
+        if action == 'create':
+            yield self.create_text_message(f"Creating document: {document_name}...")
+            document_result = self._create_document_by_text(headers, dataset_id, document_name, text_content, indexing_technique)
         
-        document_result = self._create_document_by_text(headers, dataset_id, document_name, text_content, indexing_technique)
         if not document_result:
             yield self.create_text_message("Failed to create document. Please check your parameters.")
             return
         
         if isinstance(document_result, str):
-            # This is an error message
-            yield self.create_text_message(f"Error: {document_result}")
+            # The document helpers return complete error messages
+            yield self.create_text_message(document_result)
             return
             
         document_id = document_result.get('id')
         batch = document_result.get('batch')
         
-        yield self.create_text_message(f"Document created successfully, ID: {document_id}, Batch: {batch}")
-        
-        # Step 3: Check document processing status
-        yield self.create_text_message(f"Processing document, please wait...")
+        # Cached retrieve results for this dataset no longer reflect its content
+        get_retrieve_cache().invalidate_dataset(dataset_id)
+        mark_documents_written(headers, self._get_base_url(), dataset_id, [document_id])
+        if manifest:
+            manifest.record(dataset_id, document_name, text_hash, document_id, "waiting")
         
-        status_result = self._check_document_status(headers, dataset_id, batch)
+        yield self.create_text_message(f"Document {action}d successfully, ID: {document_id}, Batch: {batch}")
         
-        if isinstance(status_result, str) and status_result.startswith("Error:"):
-            yield self.create_text_message(status_result)
-            return
+        # Step 3: Check document processing status, unless the caller tracks it with the status tool
+        if wait_for_indexing:
+            yield self.create_text_message("Processing document, please wait...")
             
-        status = status_result
+            status_result = yield from self._poll_document_status(headers, dataset_id, batch, deadline)
+            get_retrieve_cache().invalidate_dataset(dataset_id)
+            
+            if isinstance(status_result, str) and status_result.startswith("Error:"):
+                yield self.create_text_message(status_result)
+                return
+                
+            status = status_result
+            if manifest:
+                manifest.update_status(dataset_id, document_name, status)
+            if status == "completed":
+                mirror_documents(headers, self._get_base_url(), dataset_id, {document_id: document_name})
+        else:
+            status = "waiting"
+            yield self.create_text_message(f"Indexing continues in the background, check it with the Knowledge Status tool, batch: {batch}")
         
         if status == "completed":
-            yield self.create_text_message(f"Document processing completed!")
+            yield self.create_text_message("Document processing completed!")
         elif status == "error" or status == "failed":
-            yield self.create_text_message(f"Document processing failed. Please check your text content.")
-        else:
+            yield self.create_text_message("Document processing failed. Please check your text content.")
+        elif wait_for_indexing:
             yield self.create_text_message(f"Document is being processed, current status: {status}")
-            yield self.create_text_message(f"You can check the result later on the Dify platform.")
+            yield self.create_text_message("You can check the result later on the Dify platform.")
         
         # Return detailed information
         yield self.create_json_message({
@@ -106,134 +201,211 @@ class KnowledgeUploadTool(Tool):
                 "id": document_id,
                 "name": document_name,
                 "batch": batch,
-                "status": status
+                "status": status,
+                "action": f"{action}d"
             }
         })
     
-    def _create_knowledge_base(self, headers: Dict, name: str, description: str, permission: str, indexing_technique: str) -> Optional[str]:
-        """Create an empty knowledge base"""
-        try:
-            url = "https://api.dify.ai/v1/datasets"
-            payload = {
-                "name": name,
-                "description": description,
-                "permission": permission,
-                "indexing_technique": indexing_technique,
-                "provider": "vendor"
-            }
-            
-            print(f"Knowledge base creation request URL: {url}")
-            print(f"Knowledge base creation request parameters: {payload}")
-            
-            response = requests.post(url, headers=headers, json=payload)
+    def _upload_file(self, headers: Dict, dataset_id: str, knowledge_base_name: str, document_name: str, upload_file: Any,
+                     file_path: Optional[str], indexing_technique: str, deadline: float,
+                     wait_for_indexing: bool = True) -> Generator[ToolInvokeMessage, None, None]:
+        """Create a document from a file streamed in chunks, then optionally wait for it to be processed"""
+        filename, chunks, file_size, mime_type = self._open_file_source(upload_file, file_path)
+        # The uploaded file name becomes the document name, the extension tells Dify how to parse it
+        extension = os.path.splitext(filename)[1]
+        if extension and not document_name.endswith(extension):
+            filename = f"{document_name}{extension}"
+        else:
+            filename = document_name
+        
+        yield self.create_text_message(f"Uploading file as document: {filename}...")
+        
+        document_result = create_document_by_file(headers, dataset_id, filename, chunks, file_size, mime_type, indexing_technique,
+                                                  self._get_base_url())
+        if not document_result:
+            yield self.create_text_message("Failed to upload file. Please check your parameters.")
+            return
+        
+        if isinstance(document_result, str):
+            yield self.create_text_message(document_result)
+            return
+        
+        document_id = document_result.get('id')
+        batch = document_result.get('batch')
+        get_retrieve_cache().invalidate_dataset(dataset_id)
+        mark_documents_written(headers, self._get_base_url(), dataset_id, [document_id])
+        
+        yield self.create_text_message(f"Document created successfully, ID: {document_id}, Batch: {batch}")
+        
+        if wait_for_indexing:
+            yield self.create_text_message("Processing document, please wait...")
             
-            print(f"Knowledge base creation response status code: {response.status_code}")
-            print(f"Knowledge base creation response content: {response.text}")
+            status = yield from self._poll_document_status(headers, dataset_id, batch, deadline)
+            get_retrieve_cache().invalidate_dataset(dataset_id)
             
-            if response.status_code == 200:
-                result = response.json()
-                return result.get('id')
-            else:
-                error_data = response.json()
-                error_code = error_data.get('code', 'unknown_error')
-                error_message = error_data.get('message', 'Unknown error')
-                
-                if error_code == "dataset_name_duplicate":
-                    print(f"Error: The dataset name already exists. Please modify your dataset name.")
-                elif error_code == "invalid_action":
-                    print(f"Error: Invalid action.")
-                else:
-                    print(f"Error creating knowledge base: {error_message}")
-                    
-                print(f"Status code: {response.status_code}")
-                print(f"Response content: {response.text}")
-                return None
-        except Exception as e:
-            print(f"Error occurred while creating knowledge base: {str(e)}")
-            return None
+            if status.startswith("Error:"):
+                yield self.create_text_message(status)
+                return
+            if status == "completed":
+                mirror_documents(headers, self._get_base_url(), dataset_id, {document_id: filename})
+        else:
+            status = "waiting"
+            yield self.create_text_message(f"Indexing continues in the background, check it with the Knowledge Status tool, batch: {batch}")
+        
+        if status == "completed":
+            yield self.create_text_message("Document processing completed!")
+        elif status == "error" or status == "failed":
+            yield self.create_text_message("Document processing failed. Please check your file.")
+        elif wait_for_indexing:
+            yield self.create_text_message(f"Document is being processed, current status: {status}")
+            yield self.create_text_message("You can check the result later on the Dify platform.")
+        
+        yield self.create_json_message({
+            "status": 200,
+            "id": dataset_id,
+            "knowledge_base": {
+                "id": dataset_id,
+                "name": knowledge_base_name
+            },
+            "document": {
+                "id": document_id,
+                "name": filename,
+                "batch": batch,
+                "status": status,
+                "action": "created"
+            }
+        })
     
-    def _create_document_by_text(self, headers: Dict, dataset_id: str, document_name: str, text_content: str, indexing_technique: str) -> Optional[Dict]:
-        """Create document by text"""
+    def _open_file_source(self, upload_file: Any, file_path: Optional[str]) -> Tuple[str, Iterator[bytes], Optional[int], Optional[str]]:
+        """Return the name, content chunks, size and MIME type of a local file or a Dify file parameter"""
+        if file_path:
+            mime_type = mimetypes.guess_type(file_path)[0]
+            return os.path.basename(file_path), iter_file_chunks(file_path), os.path.getsize(file_path), mime_type
+        
+        filename = getattr(upload_file, 'filename', None) or 'document'
+        file_size = getattr(upload_file, 'size', None)
+        return filename, self._iter_remote_file(upload_file.url), file_size, getattr(upload_file, 'mime_type', None)
+    
+    def _iter_remote_file(self, url: str) -> Iterator[bytes]:
+        """Download a file in chunks so it never has to fit in memory"""
+        response = get_session().get(url, stream=True, timeout=get_timeout())
         try:
-            # Correct API endpoint
-            url = f"https://api.dify.ai/v1/datasets/{dataset_id}/document/create-by-text"
-            
-            # Prepare processing rules
-            process_rule = {
-                "mode": "automatic"
-            }
-            
-            # Ensure text content is a string
-            if not isinstance(text_content, str):
-                text_content = str(text_content)
+            response.raise_for_status()
+            yield from response.iter_content(CHUNK_SIZE)
+        finally:
+            response.close()
+    
+    def _upload_parts(self, headers: Dict, dataset_id: str, knowledge_base_name: str, document_name: str, parts: List[str],
+                      indexing_technique: str, manifest: Optional[UploadManifest], deadline: float,
+                      max_concurrency: int, wait_for_indexing: bool = True) -> Generator[ToolInvokeMessage, None, None]:
+        """Upload the parts of a split document concurrently and report one aggregated status"""
+        yield self.create_text_message(f"Text is too large for one document, uploading it as {len(parts)} parts...")
+        
+        part_names = [part_name(document_name, i + 1) for i in range(len(parts))]
+        base_url = self._get_base_url()
+        workers = max(1, min(max_concurrency, len(parts)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            summaries = list(executor.map(
+                lambda name, text: upload_document(headers, dataset_id, name, text, indexing_technique, manifest, base_url),
+                part_names, parts
+            ))
+        # Parts left over from a longer version of the text would otherwise stay searchable
+        removed = remove_stale_parts(DifyClient(headers, base_url), dataset_id, document_name, len(parts), manifest,
+                                     max_concurrency)
+        if removed:
+            yield self.create_text_message(f"Removed {len(removed)} parts left over from the previous version.")
+        get_retrieve_cache().invalidate_dataset(dataset_id)
+        mark_documents_written(headers, base_url, dataset_id, [summary['id'] for summary in summaries if summary.get('batch')])
+        mirror_documents(headers, base_url, dataset_id, {}, [document['id'] for document in removed])
+        
+        batches = [summary['batch'] for summary in summaries if summary.get('batch')]
+        if not wait_for_indexing:
+            yield self.create_text_message(f"{len(batches)} of {len(parts)} parts uploaded. Indexing continues in the background, check it with the Knowledge Status tool using the batches of the parts.")
+        else:
+            yield self.create_text_message(f"{len(batches)} of {len(parts)} parts uploaded, processing, please wait...")
+        
+        if batches and wait_for_indexing:
+            statuses = yield from poll_progress(
+                DifyClient(headers, base_url), dataset_id, batches, deadline, max_concurrency,
+                lambda finished, total: self.create_text_message(f"{finished} of {total} parts processed")
+            )
+            get_retrieve_cache().invalidate_dataset(dataset_id)
             
-            payload = {
+            for summary in summaries:
+                if summary.get('batch'):
+                    status = statuses.get(summary['batch'], {})
+                    summary['status'] = status.get('indexing_status', 'processing')
+                    if manifest:
+                        manifest.update_status(dataset_id, summary['name'], summary['status'])
+            mirror_documents(headers, base_url, dataset_id, {summary['id']: summary['name'] for summary in summaries
+                                                             if summary.get('batch') and summary['status'] == 'completed'})
+        
+        part_statuses = [summary['status'] for summary in summaries]
+        if all(status == 'completed' for status in part_statuses):
+            status = 'completed'
+        elif any(status in ('error', 'failed') for status in part_statuses):
+            status = 'error'
+        else:
+            status = 'processing'
+        
+        if status == 'completed':
+            yield self.create_text_message("Document processing completed!")
+        elif status == 'error':
+            yield self.create_text_message("Processing of some document parts failed. Please check the parts in the result.")
+        elif not wait_for_indexing:
+            status = 'waiting'
+        else:
+            yield self.create_text_message("Document parts are still being processed. You can check the result later on the Dify platform.")
+        
+        yield self.create_json_message({
+            "status": 200,
+            "id": dataset_id,
+            "knowledge_base": {
+                "id": dataset_id,
+                "name": knowledge_base_name
+            },
+            "document": {
                 "name": document_name,
-                "text": text_content,
-                "indexing_technique": indexing_technique,
-                "process_rule": process_rule
+                "status": status,
+                "parts": summaries,
+                "removed_parts": [document['name'] for document in removed]
             }
-            
-            print(f"Document creation request URL: {url}")
-            print(f"Document creation request parameters: {payload}")
-            
-            response = requests.post(url, headers=headers, json=payload)
-            
-            print(f"Document creation response status code: {response.status_code}")
-            print(f"Document creation response content: {response.text}")
-            
-            if response.status_code == 200:
-                result = response.json()
-                document = result.get('document', {})
-                batch = result.get('batch', '')
-                return {
-                    'id': document.get('id'),
-                    'batch': batch
-                }
-            else:
-                error_data = response.json()
-                error_code = error_data.get('code', 'unknown_error')
-                error_message = error_data.get('message', 'Unknown error')
-                
-                if error_code == "no_file_uploaded":
-                    return "Error: Please upload your file."
-                elif error_code == "too_many_files":
-                    return "Error: Only one file is allowed."
-                elif error_code == "file_too_large":
-                    return "Error: File size exceeded."
-                elif error_code == "unsupported_file_type":
-                    return "Error: File type not allowed."
-                elif error_code == "high_quality_dataset_only":
-                    return "Error: Current operation only supports 'high-quality' datasets."
-                elif error_code == "dataset_not_initialized":
-                    return "Error: The dataset is still being initialized or indexing. Please wait a moment."
-                elif error_code == "invalid_metadata":
-                    return "Error: The metadata content is incorrect. Please check and verify."
-                else:
-                    print(f"Error creating document: {error_message}")
-                    print(f"Status code: {response.status_code}")
-                    print(f"Response content: {response.text}")
-                    return None
-        except Exception as e:
-            print(f"Error occurred while creating document: {str(e)}")
-            print(f"Exception details: {repr(e)}")
-            return None
+        })
+    
+    def _find_knowledge_base(self, headers: Dict, name: str, force_refresh: bool = False) -> Optional[str]:
+        """Find an existing knowledge base by name"""
+        return find_knowledge_base(headers, name, force_refresh, self._get_base_url())
+    
+    def _create_knowledge_base(self, headers: Dict, name: str, description: str, permission: str, indexing_technique: str) -> Optional[str]:
+        """Create an empty knowledge base"""
+        return create_knowledge_base(headers, name, description, permission, indexing_technique, self._get_base_url())
+    
+    def _create_document_by_text(self, headers: Dict, dataset_id: str, document_name: str, text_content: str, indexing_technique: str) -> Optional[Dict]:
+        """Create document by text"""
+        return create_document_by_text(headers, dataset_id, document_name, text_content, indexing_technique, self._get_base_url())
+    
+    def _update_document_by_text(self, headers: Dict, dataset_id: str, document_id: str, document_name: str, text_content: str) -> Optional[Dict]:
+        """Update document by text"""
+        return update_document_by_text(headers, dataset_id, document_id, document_name, text_content, self._get_base_url())
+    
+    def _get_base_url(self) -> Optional[str]:
+        """Return the Dify API base URL configured for the provider"""
+        return get_base_url(get_credentials(self.runtime))
     
     def _check_document_status(self, headers: Dict, dataset_id: str, batch: str) -> str:
         """Check document processing status"""
+        return run_to_completion(self._poll_document_status(headers, dataset_id, batch))
+    
+    def _poll_document_status(self, headers: Dict, dataset_id: str, batch: str, deadline: Optional[float] = None) -> Generator[ToolInvokeMessage, None, str]:
+        """Poll document processing status with backoff until it finishes or the time budget runs out, yielding progress messages"""
         try:
-            # Use the correct API endpoint
-            url = f"https://api.dify.ai/v1/datasets/{dataset_id}/documents/{batch}/indexing-status"
-            
-            print(f"Document status check request URL: {url}")
+            client = DifyClient(headers, self._get_base_url())
             
-            # Try to check status, maximum 5 attempts
-            for i in range(5):
-                print(f"Document status check attempt {i+1}")
-                response = requests.get(url, headers=headers)
-                
-                print(f"Document status check response status code: {response.status_code}")
-                print(f"Document status check response content: {response.text}")
+            poller = IndexingPoller(deadline if deadline is not None else poll_deadline())
+            status = "processing"
+            last_progress = None
+            while True:
+                response = client.get_indexing_status(dataset_id, batch)
                 
                 if response.status_code == 200:
                     result = response.json()
@@ -242,32 +414,38 @@ class KnowledgeUploadTool(Tool):
                     if documents:
                         document = documents[0]
                         status = document.get('indexing_status', 'unknown')
-                        print(f"Document status: {status}")
+                        logger.debug(fields("indexing status", dataset_id=dataset_id, batch=batch, status=status,
+                                            attempt=poller.attempts + 1))
                         
-                        if status in ['completed', 'error', 'failed']:
+                        if status in TERMINAL_STATUSES:
                             return status
-                    
-                    # If still processing, wait 3 seconds before checking again
-                    print("Document is still being processed, waiting 3 seconds before checking again")
-                    time.sleep(3)
+                        
+                        completed = document.get('completed_segments')
+                        total = document.get('total_segments')
+                        poller.observe(completed, total)
+                        
+                        progress = (status, completed, total)
+                        if progress != last_progress:
+                            last_progress = progress
+                            yield self.create_text_message(self._format_progress(status, completed, total, poller.estimated_remaining))
                 else:
-                    error_data = response.json()
-                    error_code = error_data.get('code', 'unknown_error')
-                    error_message = error_data.get('message', 'Unknown error')
-                    
-                    if error_code == "archived_document_immutable":
-                        return "Error: The archived document is not editable."
-                    elif error_code == "document_already_finished":
-                        return "Error: The document has been processed. Please refresh the page or go to the document details."
-                    elif error_code == "document_indexing":
-                        return "Error: The document is being processed and cannot be edited."
-                    else:
-                        print(f"Error checking document status: {error_message}")
-                        print(f"Response content: {response.text}")
-                        return "Error: Failed to check document status."
-            
-            # If still not completed after 5 attempts, return processing status
-            return "processing"
+                    return indexing_status_error(response)
+                
+                # Wait with backoff before checking again, give up once the time budget is spent
+                delay = poller.next_delay()
+                if delay is None:
+                    return status
+                logger.debug(fields("indexing in progress", batch=batch, delay=f"{delay:.1f}"))
+                time.sleep(delay)
         except Exception as e:
-            print(f"Error occurred while checking document status: {str(e)}")
-            return "Error: An unexpected error occurred while checking document status." 
\ No newline at end of file
+            logger.error(fields("indexing status check failed", dataset_id=dataset_id, batch=batch, error=str(e)))
+            return "Error: An unexpected error occurred while checking document status."
+    
+    def _format_progress(self, status: str, completed: Any, total: Any, estimated_remaining: Optional[float]) -> str:
+        """Format an indexing progress message"""
+        if not isinstance(completed, int) or not isinstance(total, int) or total <= 0:
+            return f"Document status: {status}"
+        message = f"Document status: {status}, {completed}/{total} segments indexed"
+        if estimated_remaining is not None:
+            message += f", about {estimated_remaining:.0f}s remaining"
+        return message
@@ -0,0 +1,212 @@
+import asyncio
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Awaitable, Dict, Iterable, List, Optional
+
+import httpx
+
+from utils.dify_client import DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT, DIFY_API_BASE_URL, response_error_code
+from utils.logger import fields, get_logger
+from utils.metrics import get_metrics
+from utils.resilience import (CircuitBreaker, CircuitOpenError, get_circuit_breaker, get_rate_limiter,
+                              get_retry_policy)
+from utils.retrieve_cache import cache_scope
+
+logger = get_logger(__name__)
+
+# Connections the event loop keeps open, requests beyond them queue without holding a thread
+DEFAULT_ASYNC_POOL_SIZE = int(os.environ.get('DIFY_KNOWLEDGE_ASYNC_POOL_SIZE', 100))
+# httpx scans every waiting request against every connection of a pool, so the connections are split
+# over several small clients to keep that cost flat at high fan-out
+CONNECTIONS_PER_SHARD = 4
+
+
+class AsyncEngine:
+    """Runs an event loop and pooled httpx clients on a background thread for synchronous callers"""
+
+    def __init__(self, pool_size: int = DEFAULT_ASYNC_POOL_SIZE, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.pool_size = max(pool_size, 1)
+        self.transport = transport
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._clients: List[httpx.AsyncClient] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._next_client = itertools.count()
+        self._lock = threading.Lock()
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='dify-knowledge-async', daemon=True).start()
+                asyncio.run_coroutine_threadsafe(self._create_clients(), loop).result()
+                self._loop = loop
+        return self._loop
+
+    async def _create_clients(self) -> None:
+        timeout = httpx.Timeout(connect=DEFAULT_CONNECT_TIMEOUT, read=DEFAULT_READ_TIMEOUT, write=DEFAULT_READ_TIMEOUT,
+                                pool=None)
+        shards = -(-self.pool_size // CONNECTIONS_PER_SHARD)
+        limits = httpx.Limits(max_connections=CONNECTIONS_PER_SHARD, max_keepalive_connections=CONNECTIONS_PER_SHARD)
+        # Loading the CA bundle is slow, the shards share one SSL context
+        ssl_context = httpx.create_ssl_context()
+        self._clients = [httpx.AsyncClient(timeout=timeout, limits=limits, transport=self.transport, verify=ssl_context)
+                         for _ in range(shards)]
+        # Requests beyond the pool size wait here rather than in the clients' pools
+        self._slots = asyncio.Semaphore(self.pool_size)
+
+    async def request(self, method: str, url: str, **kwargs: Any) -> httpx.Response:
+        """Send a request from a coroutine running on the engine"""
+        async with self._slots:
+            client = self._clients[next(self._next_client) % len(self._clients)]
+            return await client.request(method, url, **kwargs)
+
+    def submit(self, coroutine: Awaitable) -> Future:
+        """Schedule a coroutine on the engine and return a future for its result"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop or self._start())
+
+    def run(self, coroutine: Awaitable, timeout: Optional[float] = None) -> Any:
+        """Run a coroutine on the engine and block until it returns"""
+        return self.submit(coroutine).result(timeout)
+
+    def close(self) -> None:
+        with self._lock:
+            loop, clients = self._loop, self._clients
+            self._loop, self._clients = None, []
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self._close_clients(clients), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+
+    @staticmethod
+    async def _close_clients(clients: List[httpx.AsyncClient]) -> None:
+        await asyncio.gather(*(client.aclose() for client in clients))
+
+
+async def gather_limited(coroutines: Iterable[Awaitable], limit: int) -> List[Any]:
+    """Await coroutines concurrently, at most limit at a time, returning their results in order"""
+    semaphore = asyncio.Semaphore(max(int(limit), 1))
+
+    async def limited(coroutine: Awaitable) -> Any:
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(limited(coroutine) for coroutine in coroutines))
+
+
+class AsyncDifyClient:
+    """asyncio client for the Dify datasets API, with the same retries, limits and metrics as DifyClient"""
+
+    def __init__(self, headers: Dict, base_url: Optional[str] = None, engine: Optional[AsyncEngine] = None):
+        self.headers = headers
+        self.base_url = (base_url or DIFY_API_BASE_URL).rstrip('/')
+        self.engine = engine or get_async_engine()
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}{path}"
+
+    async def request(self, method: str, path: str, phase: str = 'request', idempotent: Optional[bool] = None,
+                      retry: bool = True, **kwargs: Any) -> httpx.Response:
+        """Send a request through the rate limiter and circuit breaker, retrying throttled and failed attempts"""
+        headers = dict(self.headers, **kwargs.pop('headers', {}))
+        if idempotent is None:
+            idempotent = method == 'GET'
+        policy = get_retry_policy()
+        breaker = get_circuit_breaker(self.base_url)
+        bucket = get_rate_limiter(cache_scope(self.headers, self.base_url))
+
+        attempt = 0
+        while True:
+            retry_in = breaker.allow()
+            if retry_in is not None:
+                get_metrics().increment('dify_knowledge_requests_total', phase=phase, outcome='circuit_open')
+                raise CircuitOpenError(self.base_url, retry_in)
+            waited = bucket.reserve()
+            if waited:
+                get_metrics().increment('dify_knowledge_rate_limited_seconds_total', waited, phase=phase)
+                await asyncio.sleep(waited)
+
+            try:
+                response = await self._send(method, path, phase, headers, **kwargs)
+            except httpx.HTTPError as e:
+                self._record_failure(breaker)
+                # A request that timed out while connecting never reached the server
+                if not retry or not policy.should_retry(attempt, idempotent or isinstance(e, httpx.ConnectTimeout), error=e):
+                    raise
+                delay = policy.delay(attempt)
+                reason = type(e).__name__
+            except BaseException:
+                # Cancelled and otherwise failed attempts must not leave a half-open circuit waiting for them forever
+                breaker.release_probe()
+                raise
+            else:
+                if response.status_code >= 500:
+                    self._record_failure(breaker)
+                else:
+                    breaker.record_success()
+                if not retry or not policy.should_retry(attempt, idempotent, response=response):
+                    return response
+                delay = policy.delay(attempt, response)
+                if delay is None:
+                    return response
+                reason = f'http_{response.status_code}'
+                if response.status_code == 429 and bucket.rate > 0:
+                    bucket.pause(delay)
+                    delay = 0.0
+
+            attempt += 1
+            get_metrics().increment('dify_knowledge_retries_total', phase=phase, reason=reason)
+            logger.info(fields("retrying dify api request", phase=phase, method=method, path=path, attempt=attempt,
+                               reason=reason, delay=f"{delay:.2f}"))
+            await asyncio.sleep(delay)
+
+    async def _send(self, method: str, path: str, phase: str, headers: Dict, **kwargs: Any) -> httpx.Response:
+        """Send one attempt, recording its latency and outcome under the given phase"""
+        started_at = time.perf_counter()
+        try:
+            response = await self.engine.request(method, self.url(path), headers=headers, **kwargs)
+        except Exception as e:
+            elapsed = time.perf_counter() - started_at
+            get_metrics().observe(phase, elapsed, 'exception', type(e).__name__)
+            logger.warning(fields("dify api request failed", phase=phase, method=method, path=path,
+                                  elapsed_ms=round(elapsed * 1000, 1), error=type(e).__name__))
+            raise
+        elapsed = time.perf_counter() - started_at
+
+        if response.status_code >= 400:
+            error_code = response_error_code(response)
+            get_metrics().observe(phase, elapsed, 'error', error_code)
+            logger.warning(fields("dify api request returned an error", phase=phase, method=method, path=path,
+                                  status=response.status_code, code=error_code, elapsed_ms=round(elapsed * 1000, 1)))
+        else:
+            get_metrics().observe(phase, elapsed)
+            logger.debug(fields("dify api request", phase=phase, method=method, path=path,
+                                status=response.status_code, elapsed_ms=round(elapsed * 1000, 1)))
+        return response
+
+    def _record_failure(self, breaker: CircuitBreaker) -> None:
+        if breaker.record_failure():
+            get_metrics().increment('dify_knowledge_circuit_opened_total')
+            logger.error(fields("dify api circuit opened", base_url=self.base_url, failures=breaker.failures,
+                                reset_seconds=breaker.reset_timeout))
+
+    async def get_indexing_status(self, dataset_id: str, batch: str) -> httpx.Response:
+        return await self.request('GET', f'/datasets/{dataset_id}/documents/{batch}/indexing-status', 'poll')
+
+    async def retrieve(self, dataset_id: str, payload: Dict) -> httpx.Response:
+        return await self.request('POST', f'/datasets/{dataset_id}/retrieve', 'retrieve', idempotent=True, json=payload)
+
+
+_engine: Optional[AsyncEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_async_engine() -> AsyncEngine:
+    """Return the process-wide async engine, its event loop starts on first use"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = AsyncEngine()
+    return _engine
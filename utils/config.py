@@ -0,0 +1,47 @@
+import os
+import tempfile
+from typing import Any, Dict, Optional
+
+# Upper bound for a single plugin invocation, shared with the plugin entrypoint
+MAX_REQUEST_TIMEOUT = 120
+
+# Directory for state kept between invocations, such as the upload manifest
+DATA_DIR = os.environ.get('DIFY_KNOWLEDGE_DATA_DIR', os.path.join(tempfile.gettempdir(), 'dify_knowledge'))
+
+# Default number of API requests a tool keeps in flight at once
+DEFAULT_MAX_CONCURRENCY = 4
+
+# 'threads' sends concurrent API requests from thread pools, 'asyncio' from one event loop per worker
+HTTP_ENGINE = os.environ.get('DIFY_KNOWLEDGE_HTTP_ENGINE', 'threads').strip().lower()
+
+
+def use_async_engine() -> bool:
+    return HTTP_ENGINE == 'asyncio'
+
+
+def get_credentials(runtime: Any) -> Dict:
+    """Return the provider credentials attached to a tool runtime"""
+    credentials = getattr(runtime, 'credentials', None)
+    return credentials if isinstance(credentials, dict) else {}
+
+
+def get_api_key(settings: Dict) -> Optional[str]:
+    """Return the API key from the provider credentials, or from the environment when running outside Dify"""
+    return settings.get('api_key') or os.environ.get('DIFY_KNOWLEDGE_API_KEY')
+
+
+def get_base_url(settings: Dict) -> Optional[str]:
+    """Return the configured Dify API base URL, or None to use the default"""
+    base_url = str(settings.get('base_url') or '').strip().rstrip('/')
+    return base_url or None
+
+
+def get_int_setting(settings: Dict, key: str, default: int) -> int:
+    """Read a non-negative integer setting, falling back to the default when unset or invalid"""
+    value = settings.get(key)
+    if value is None or value == '':
+        return default
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return default
@@ -0,0 +1,54 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+# Seconds a successful credential validation is trusted without asking the API again
+DEFAULT_CREDENTIAL_TTL = float(os.environ.get('DIFY_KNOWLEDGE_CREDENTIAL_CACHE_TTL', 300))
+
+
+def credential_key(api_key: str, base_url: Optional[str] = None) -> str:
+    """Hash an API key and deployment so the key itself is never kept in memory longer than needed"""
+    return hashlib.sha256(f"{base_url or ''} {api_key}".encode('utf-8')).hexdigest()
+
+
+class CredentialCache:
+    """Remembers recently validated credentials by their hash"""
+
+    def __init__(self, ttl: float = DEFAULT_CREDENTIAL_TTL):
+        self.ttl = ttl
+        self._validated: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def is_valid(self, key: str) -> bool:
+        with self._lock:
+            expires_at = self._validated.get(key)
+            if expires_at is None:
+                return False
+            if expires_at <= time.monotonic():
+                del self._validated[key]
+                return False
+            return True
+
+    def remember(self, key: str) -> None:
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._validated[key] = time.monotonic() + self.ttl
+
+    def forget(self, key: str) -> None:
+        with self._lock:
+            self._validated.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._validated.clear()
+
+
+_credential_cache = CredentialCache()
+
+
+def get_credential_cache() -> CredentialCache:
+    """Return the process-wide credential validation cache"""
+    return _credential_cache
@@ -0,0 +1,74 @@
+import threading
+import time
+from typing import Dict, Optional
+
+from utils.dify_client import DifyClient
+from utils.logger import fields, get_logger
+from utils.retrieve_cache import cache_scope
+
+logger = get_logger(__name__)
+
+DEFAULT_INDEX_TTL = 300
+LIST_PAGE_LIMIT = 100
+
+
+class DatasetNameIndex:
+    """Cached knowledge base name to ID mapping, refreshed from the paginated dataset list"""
+
+    def __init__(self, ttl: float = DEFAULT_INDEX_TTL):
+        self.ttl = ttl
+        self._indexes: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, client: DifyClient, name: str, force_refresh: bool = False) -> Optional[str]:
+        """Return the ID of the knowledge base with the given name, or None if it does not exist"""
+        scope = cache_scope(client.headers, client.base_url)
+        with self._lock:
+            entry = self._indexes.get(scope)
+            fresh = entry is not None and entry['expires_at'] > time.monotonic()
+            if fresh and not force_refresh and name in entry['names']:
+                return entry['names'][name]
+
+        # Unknown or stale names trigger a refresh, the new dataset may have been created elsewhere
+        names = self._fetch_names(client)
+        if names is None:
+            return None
+        with self._lock:
+            self._indexes[scope] = {'names': names, 'expires_at': time.monotonic() + self.ttl}
+        return names.get(name)
+
+    def add(self, client: DifyClient, name: str, dataset_id: str) -> None:
+        """Record a knowledge base created by this process"""
+        scope = cache_scope(client.headers, client.base_url)
+        with self._lock:
+            entry = self._indexes.get(scope)
+            if entry is not None:
+                entry['names'][name] = dataset_id
+
+    def clear(self) -> None:
+        with self._lock:
+            self._indexes.clear()
+
+    def _fetch_names(self, client: DifyClient) -> Optional[Dict[str, str]]:
+        names = {}
+        page = 1
+        while True:
+            response = client.list_datasets(page=page, limit=LIST_PAGE_LIMIT)
+            if response.status_code != 200:
+                logger.error(fields("knowledge base listing failed", status=response.status_code, page=page))
+                return None
+            result = response.json()
+            for dataset in result.get('data', []):
+                # Keep the first match when several knowledge bases share a name
+                names.setdefault(dataset.get('name'), dataset.get('id'))
+            if not result.get('has_more'):
+                return names
+            page += 1
+
+
+_dataset_name_index = DatasetNameIndex()
+
+
+def get_dataset_name_index() -> DatasetNameIndex:
+    """Return the process-wide knowledge base name index"""
+    return _dataset_name_index
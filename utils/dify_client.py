@@ -0,0 +1,237 @@
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.logger import fields, get_logger
+from utils.metrics import get_metrics
+from utils.resilience import (CircuitBreaker, CircuitOpenError, get_circuit_breaker, get_rate_limiter,
+                              get_retry_policy)
+from utils.retrieve_cache import cache_scope
+
+logger = get_logger(__name__)
+
+DEFAULT_API_BASE_URL = "https://api.dify.ai/v1"
+# Can point the tools at another deployment, e.g. a local stub for benchmarks
+DIFY_API_BASE_URL = os.environ.get('DIFY_KNOWLEDGE_API_BASE_URL') or DEFAULT_API_BASE_URL
+
+# Connection pool settings, can be overridden through environment variables
+DEFAULT_POOL_SIZE = int(os.environ.get('DIFY_KNOWLEDGE_POOL_SIZE', 16))
+DEFAULT_CONNECT_TIMEOUT = float(os.environ.get('DIFY_KNOWLEDGE_CONNECT_TIMEOUT', 5))
+DEFAULT_READ_TIMEOUT = float(os.environ.get('DIFY_KNOWLEDGE_READ_TIMEOUT', 60))
+
+_session: Optional[requests.Session] = None
+_timeout: Tuple[float, float] = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT)
+_session_lock = threading.Lock()
+
+
+def _build_session(pool_size: int) -> requests.Session:
+    """Create a session whose connections are kept alive and reused"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """Return the process-wide pooled session, creating it on first use"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session(DEFAULT_POOL_SIZE)
+    return _session
+
+
+def get_timeout() -> Tuple[float, float]:
+    """Return the (connect, read) timeout used for API calls"""
+    return _timeout
+
+
+def build_headers(api_key: str) -> Dict:
+    """Build the request headers for the Dify datasets API"""
+    return {
+        'Authorization': f'Bearer {api_key}',
+        'Content-Type': 'application/json'
+    }
+
+
+def response_error(response: Any) -> Tuple[str, str]:
+    """Return the Dify error code and message of a failed response, also when the body is not JSON"""
+    try:
+        error_data = response.json()
+    except ValueError:
+        error_data = None
+    if not isinstance(error_data, dict):
+        error_data = {}
+    code = error_data.get('code') or f'http_{response.status_code}'
+    message = error_data.get('message')
+    if not message:
+        if response.status_code == 429:
+            message = "Rate limit exceeded, please try again later"
+        else:
+            # httpx responses of the async client name the reason phrase differently
+            reason = getattr(response, 'reason', None) or getattr(response, 'reason_phrase', None) or ''
+            message = f"HTTP {response.status_code} {reason}".strip()
+    return code, message
+
+
+def response_error_code(response: Any) -> str:
+    """Return the Dify error code of a failed response, or the HTTP status when the body is not JSON"""
+    return response_error(response)[0]
+
+
+class DifyClient:
+    """Client for the Dify datasets API backed by the shared session"""
+
+    def __init__(self, headers: Dict, base_url: Optional[str] = None):
+        self.headers = headers
+        self.base_url = (base_url or DIFY_API_BASE_URL).rstrip('/')
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}{path}"
+
+    def request(self, method: str, path: str, phase: str = 'request', idempotent: Optional[bool] = None,
+                retry: bool = True, **kwargs: Any) -> requests.Response:
+        """Send a request through the rate limiter and circuit breaker, retrying throttled and failed attempts"""
+        kwargs.setdefault('timeout', get_timeout())
+        headers = dict(self.headers, **kwargs.pop('headers', {}))
+        # Requests that may have been processed are only sent again when idempotent
+        if idempotent is None:
+            idempotent = method == 'GET'
+        policy = get_retry_policy()
+        breaker = get_circuit_breaker(self.base_url)
+        bucket = get_rate_limiter(cache_scope(self.headers, self.base_url))
+
+        attempt = 0
+        while True:
+            retry_in = breaker.allow()
+            if retry_in is not None:
+                get_metrics().increment('dify_knowledge_requests_total', phase=phase, outcome='circuit_open')
+                raise CircuitOpenError(self.base_url, retry_in)
+            waited = bucket.acquire()
+            if waited:
+                get_metrics().increment('dify_knowledge_rate_limited_seconds_total', waited, phase=phase)
+
+            try:
+                response = self._send(method, path, phase, headers, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self._record_failure(breaker)
+                if not retry or not policy.should_retry(attempt, idempotent, error=e):
+                    raise
+                delay = policy.delay(attempt)
+                reason = type(e).__name__
+            except Exception:
+                # Neither a success nor a server failure, a half-open circuit must not wait for this probe forever
+                breaker.release_probe()
+                raise
+            else:
+                if response.status_code >= 500:
+                    self._record_failure(breaker)
+                else:
+                    breaker.record_success()
+                if not retry or not policy.should_retry(attempt, idempotent, response=response):
+                    return response
+                delay = policy.delay(attempt, response)
+                if delay is None:
+                    return response
+                reason = f'http_{response.status_code}'
+                response.close()
+                if response.status_code == 429 and bucket.rate > 0:
+                    # Everyone sharing the key waits, the limiter then releases them at the allowed rate
+                    bucket.pause(delay)
+                    delay = 0.0
+
+            attempt += 1
+            get_metrics().increment('dify_knowledge_retries_total', phase=phase, reason=reason)
+            logger.info(fields("retrying dify api request", phase=phase, method=method, path=path, attempt=attempt,
+                               reason=reason, delay=f"{delay:.2f}"))
+            time.sleep(delay)
+
+    def _send(self, method: str, path: str, phase: str, headers: Dict, **kwargs: Any) -> requests.Response:
+        """Send one attempt, recording its latency and outcome under the given phase"""
+        started_at = time.perf_counter()
+        try:
+            response = get_session().request(method, self.url(path), headers=headers, **kwargs)
+        except Exception as e:
+            elapsed = time.perf_counter() - started_at
+            get_metrics().observe(phase, elapsed, 'exception', type(e).__name__)
+            logger.warning(fields("dify api request failed", phase=phase, method=method, path=path,
+                                  elapsed_ms=round(elapsed * 1000, 1), error=type(e).__name__))
+            raise
+        elapsed = time.perf_counter() - started_at
+
+        if response.status_code >= 400:
+            error_code = response_error_code(response)
+            get_metrics().observe(phase, elapsed, 'error', error_code)
+            logger.warning(fields("dify api request returned an error", phase=phase, method=method, path=path,
+                                  status=response.status_code, code=error_code, elapsed_ms=round(elapsed * 1000, 1)))
+        else:
+            get_metrics().observe(phase, elapsed)
+            logger.debug(fields("dify api request", phase=phase, method=method, path=path,
+                                status=response.status_code, elapsed_ms=round(elapsed * 1000, 1)))
+        return response
+
+    def _record_failure(self, breaker: CircuitBreaker) -> None:
+        if breaker.record_failure():
+            get_metrics().increment('dify_knowledge_circuit_opened_total')
+            logger.error(fields("dify api circuit opened", base_url=self.base_url, failures=breaker.failures,
+                                reset_seconds=breaker.reset_timeout))
+
+    def list_datasets(self, page: int = 1, limit: int = 20) -> requests.Response:
+        return self.request('GET', '/datasets', 'list_datasets', params={'page': page, 'limit': limit})
+
+    def validate_credentials(self) -> requests.Response:
+        return self.request('GET', '/datasets', 'validate_credentials', params={'page': 1, 'limit': 1})
+
+    def create_dataset(self, payload: Dict) -> requests.Response:
+        return self.request('POST', '/datasets', 'create_kb', json=payload)
+
+    def create_document_by_text(self, dataset_id: str, payload: Dict) -> requests.Response:
+        return self.request('POST', f'/datasets/{dataset_id}/document/create-by-text', 'create_doc', json=payload)
+
+    def create_document_by_file(self, dataset_id: str, body: Any) -> requests.Response:
+        # The streamed body cannot be sent twice
+        return self.request('POST', f'/datasets/{dataset_id}/document/create-by-file', 'create_doc_by_file', retry=False,
+                            data=body, headers={'Content-Type': body.content_type})
+
+    def update_document_by_text(self, dataset_id: str, document_id: str, payload: Dict) -> requests.Response:
+        return self.request('POST', f'/datasets/{dataset_id}/documents/{document_id}/update-by-text', 'update_doc',
+                            json=payload)
+
+    def list_documents(self, dataset_id: str, page: int = 1, limit: int = 100) -> requests.Response:
+        return self.request('GET', f'/datasets/{dataset_id}/documents', 'list_docs', params={'page': page, 'limit': limit})
+
+    def get_document(self, dataset_id: str, document_id: str) -> requests.Response:
+        return self.request('GET', f'/datasets/{dataset_id}/documents/{document_id}', 'get_doc')
+
+    def delete_document(self, dataset_id: str, document_id: str) -> requests.Response:
+        return self.request('DELETE', f'/datasets/{dataset_id}/documents/{document_id}', 'delete_doc', idempotent=True)
+
+    def list_segments(self, dataset_id: str, document_id: str, page: int = 1, limit: int = 100) -> requests.Response:
+        return self.request('GET', f'/datasets/{dataset_id}/documents/{document_id}/segments', 'list_segments',
+                            params={'page': page, 'limit': limit})
+
+    def add_segments(self, dataset_id: str, document_id: str, segments: List[Dict]) -> requests.Response:
+        return self.request('POST', f'/datasets/{dataset_id}/documents/{document_id}/segments', 'add_segments',
+                            json={'segments': segments})
+
+    def update_segment(self, dataset_id: str, document_id: str, segment_id: str, segment: Dict) -> requests.Response:
+        # Writing the same content again leaves the segment as it is
+        return self.request('POST', f'/datasets/{dataset_id}/documents/{document_id}/segments/{segment_id}', 'update_segment',
+                            idempotent=True, json={'segment': segment})
+
+    def delete_segment(self, dataset_id: str, document_id: str, segment_id: str) -> requests.Response:
+        return self.request('DELETE', f'/datasets/{dataset_id}/documents/{document_id}/segments/{segment_id}',
+                            'delete_segment', idempotent=True)
+
+    def get_indexing_status(self, dataset_id: str, batch: str) -> requests.Response:
+        return self.request('GET', f'/datasets/{dataset_id}/documents/{batch}/indexing-status', 'poll')
+
+    def retrieve(self, dataset_id: str, payload: Dict) -> requests.Response:
+        # Retrieval does not change anything and is safe to repeat
+        return self.request('POST', f'/datasets/{dataset_id}/retrieve', 'retrieve', idempotent=True, json=payload)
@@ -0,0 +1,321 @@
+import json
+import re
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from utils.dataset_index import get_dataset_name_index
+from utils.dify_client import DifyClient, response_error
+from utils.listing import list_documents
+from utils.logger import fields, get_logger
+from utils.manifest import UploadManifest
+from utils.multipart import MultipartStream
+from utils.resilience import CircuitOpenError, is_transient_status
+
+logger = get_logger(__name__)
+
+
+def find_knowledge_base(headers: Dict, name: str, force_refresh: bool = False, base_url: Optional[str] = None) -> Optional[str]:
+    """Find an existing knowledge base by name"""
+    try:
+        return get_dataset_name_index().resolve(DifyClient(headers, base_url), name, force_refresh)
+    except Exception as e:
+        logger.error(fields("knowledge base lookup failed", name=name, error=str(e)))
+        return None
+
+
+def create_knowledge_base(headers: Dict, name: str, description: str, permission: str, indexing_technique: str,
+                          base_url: Optional[str] = None) -> Optional[str]:
+    """Create an empty knowledge base"""
+    try:
+        client = DifyClient(headers, base_url)
+        payload = {
+            "name": name,
+            "description": description,
+            "permission": permission,
+            "indexing_technique": indexing_technique,
+            "provider": "vendor"
+        }
+
+        response = client.create_dataset(payload)
+
+        if response.status_code == 200:
+            result = response.json()
+            get_dataset_name_index().add(client, name, result.get('id'))
+            logger.info(fields("knowledge base created", dataset_id=result.get('id')))
+            return result.get('id')
+        else:
+            error_code, error_message = response_error(response)
+
+            if error_code == "dataset_name_duplicate":
+                logger.warning(fields("knowledge base name already exists", name=name))
+            elif error_code == "invalid_action":
+                logger.warning(fields("knowledge base creation rejected", code=error_code))
+            else:
+                logger.error(fields("knowledge base creation failed", status=response.status_code, code=error_code,
+                                    message=error_message))
+            return None
+    except Exception as e:
+        logger.error(fields("knowledge base creation failed", error=str(e)))
+        return None
+
+
+def create_document_by_text(headers: Dict, dataset_id: str, document_name: str, text_content: str, indexing_technique: str,
+                            base_url: Optional[str] = None, process_rule: Optional[Dict] = None) -> Optional[Dict]:
+    """Create document by text"""
+    try:
+        client = DifyClient(headers, base_url)
+
+        # Prepare processing rules
+        process_rule = process_rule or {
+            "mode": "automatic"
+        }
+
+        # Ensure text content is a string
+        if not isinstance(text_content, str):
+            text_content = str(text_content)
+
+        payload = {
+            "name": document_name,
+            "text": text_content,
+            "indexing_technique": indexing_technique,
+            "process_rule": process_rule
+        }
+
+        response = client.create_document_by_text(dataset_id, payload)
+
+        if response.status_code == 200:
+            result = response.json()
+            document = result.get('document', {})
+            batch = result.get('batch', '')
+            logger.info(fields("document created", dataset_id=dataset_id, document_id=document.get('id'),
+                               characters=len(text_content)))
+            return {
+                'id': document.get('id'),
+                'batch': batch
+            }
+        else:
+            error_code, error_message = response_error(response)
+
+            known_error = document_error_message(error_code)
+            if known_error:
+                return known_error
+            else:
+                logger.error(fields("document creation failed", dataset_id=dataset_id, status=response.status_code,
+                                    code=error_code, message=error_message))
+                # Throttling and server errors outlasted the retries, report them instead of blaming the parameters
+                return f"Error: {error_message}" if is_transient_status(response.status_code) else None
+    except CircuitOpenError as e:
+        return f"Error: {str(e)}"
+    except Exception as e:
+        logger.error(fields("document creation failed", dataset_id=dataset_id, error=repr(e)))
+        return None
+
+
+def create_document_by_file(headers: Dict, dataset_id: str, filename: str, chunks: Iterable[bytes], file_size: Optional[int],
+                            mime_type: Optional[str], indexing_technique: str, base_url: Optional[str] = None) -> Optional[Dict]:
+    """Create document by file, streaming the file content in the request body"""
+    try:
+        client = DifyClient(headers, base_url)
+
+        data = {
+            "indexing_technique": indexing_technique,
+            "process_rule": {
+                "mode": "automatic"
+            }
+        }
+        body = MultipartStream({"data": json.dumps(data)}, "file", filename, chunks, file_size, mime_type)
+
+        response = client.create_document_by_file(dataset_id, body)
+
+        if response.status_code == 200:
+            result = response.json()
+            document = result.get('document', {})
+            logger.info(fields("document file uploaded", dataset_id=dataset_id, document_id=document.get('id'),
+                               bytes=file_size if file_size is not None else 'unknown'))
+            return {
+                'id': document.get('id'),
+                'batch': result.get('batch', '')
+            }
+        else:
+            error_code, error_message = response_error(response)
+
+            known_error = document_error_message(error_code)
+            if known_error:
+                return known_error
+            logger.error(fields("document file upload failed", dataset_id=dataset_id, status=response.status_code,
+                                code=error_code, message=error_message))
+            return f"Error: {error_message}" if is_transient_status(response.status_code) else None
+    except CircuitOpenError as e:
+        return f"Error: {str(e)}"
+    except Exception as e:
+        logger.error(fields("document file upload failed", dataset_id=dataset_id, error=str(e)))
+        return None
+
+
+def update_document_by_text(headers: Dict, dataset_id: str, document_id: str, document_name: str, text_content: str,
+                            base_url: Optional[str] = None, process_rule: Optional[Dict] = None) -> Optional[Dict]:
+    """Replace the text of an existing document, returning None if it no longer exists"""
+    try:
+        client = DifyClient(headers, base_url)
+
+        if not isinstance(text_content, str):
+            text_content = str(text_content)
+
+        payload = {
+            "name": document_name,
+            "text": text_content,
+            "process_rule": process_rule or {
+                "mode": "automatic"
+            }
+        }
+
+        response = client.update_document_by_text(dataset_id, document_id, payload)
+
+        if response.status_code == 200:
+            result = response.json()
+            document = result.get('document', {})
+            return {
+                'id': document.get('id') or document_id,
+                'batch': result.get('batch', '')
+            }
+        elif response.status_code == 404:
+            # The document was deleted on the platform, the caller creates it again
+            logger.info(fields("document no longer exists", dataset_id=dataset_id, document_id=document_id))
+            return None
+        else:
+            error_code, error_message = response_error(response)
+
+            known_error = document_error_message(error_code)
+            if known_error:
+                return known_error
+            logger.error(fields("document update failed", dataset_id=dataset_id, document_id=document_id,
+                                status=response.status_code, code=error_code, message=error_message))
+            return f"Error: {error_message}"
+    except CircuitOpenError as e:
+        return f"Error: {str(e)}"
+    except Exception as e:
+        logger.error(fields("document update failed", dataset_id=dataset_id, document_id=document_id, error=str(e)))
+        return "Error: An unexpected error occurred while updating document."
+
+
+def document_exists(headers: Dict, dataset_id: str, document_id: str, base_url: Optional[str] = None) -> bool:
+    """Check that a document is still in its knowledge base, only a 404 counts as missing"""
+    try:
+        response = DifyClient(headers, base_url).get_document(dataset_id, document_id)
+    except Exception as e:
+        logger.warning(fields("document check failed", dataset_id=dataset_id, document_id=document_id, error=str(e)))
+        return True
+    return response.status_code != 404
+
+
+def plan_upload(headers: Dict, dataset_id: str, name: str, text: str, manifest: Optional[UploadManifest],
+                base_url: Optional[str] = None) -> Tuple[str, Optional[Dict], Optional[str]]:
+    """Decide whether a document has to be created, updated or can be skipped, skipping only documents that still exist"""
+    if manifest is None:
+        return 'create', None, None
+    action, entry, text_hash = manifest.plan(dataset_id, name, text)
+    if action == 'skip' and not document_exists(headers, dataset_id, entry['document_id'], base_url):
+        # The document or its knowledge base was deleted on the platform
+        logger.info(fields("recorded document no longer exists", dataset_id=dataset_id, document_id=entry['document_id']))
+        manifest.forget(dataset_id, name)
+        return 'create', None, text_hash
+    return action, entry, text_hash
+
+
+def upload_document(headers: Dict, dataset_id: str, name: str, text: str, indexing_technique: str,
+                    manifest: Optional[UploadManifest] = None, base_url: Optional[str] = None) -> Dict:
+    """Create, update or skip one document depending on the manifest, returning its summary"""
+    action, entry, text_hash = plan_upload(headers, dataset_id, name, text, manifest, base_url)
+    if action == 'skip':
+        return {"name": name, "id": entry['document_id'], "status": entry['status'], "action": "skipped"}
+
+    result = None
+    if action == 'update':
+        result = update_document_by_text(headers, dataset_id, entry['document_id'], name, text, base_url)
+        if result is None:
+            action = 'create'
+    if action == 'create':
+        result = create_document_by_text(headers, dataset_id, name, text, indexing_technique, base_url)
+
+    if not isinstance(result, dict):
+        return {"name": name, "status": "error", "error": result or f"Failed to {action} document."}
+
+    if manifest:
+        manifest.record(dataset_id, name, text_hash, result.get('id'), "waiting")
+    return {"name": name, "id": result.get('id'), "batch": result.get('batch'), "status": "waiting", "action": f"{action}d"}
+
+
+def part_name(document_name: str, number: int) -> str:
+    """Name of one part of a split document, it does not change with the number of parts"""
+    return f"{document_name} (part {number})"
+
+
+def remove_stale_parts(client: DifyClient, dataset_id: str, document_name: str, part_count: int,
+                       manifest: Optional[UploadManifest] = None, max_concurrency: int = 1) -> List[Dict]:
+    """Delete the parts of a split document beyond its current number of parts, returning the deleted documents"""
+    documents = list_documents(client, dataset_id, max_concurrency)
+    if documents is None:
+        return []
+    current = {part_name(document_name, number) for number in range(1, part_count + 1)}
+    # Part names used to include the number of parts, those documents are replaced as well
+    pattern = re.compile(re.escape(document_name) + r' \(part \d+(/\d+)?\)')
+    stale = [document for document in documents
+             if pattern.fullmatch(document.get('name') or '') and document.get('name') not in current]
+
+    def delete(document: Dict) -> bool:
+        try:
+            response = client.delete_document(dataset_id, document['id'])
+        except Exception as e:
+            logger.error(fields("stale part not deleted", dataset_id=dataset_id, document_id=document['id'], error=str(e)))
+            return False
+        # A part that is already gone counts as deleted
+        if response.status_code < 300 or response.status_code == 404:
+            return True
+        logger.error(fields("stale part not deleted", dataset_id=dataset_id, document_id=document['id'],
+                            status=response.status_code, code=response_error(response)[0]))
+        return False
+
+    if not stale:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(int(max_concurrency), len(stale)))) as executor:
+        deleted = [document for document, ok in zip(stale, executor.map(delete, stale)) if ok]
+    if manifest:
+        for document in deleted:
+            manifest.forget(dataset_id, document['name'])
+    return deleted
+
+
+def document_error_message(error_code: str) -> Optional[str]:
+    """Map a document creation error code to an error message"""
+    if error_code == "no_file_uploaded":
+        return "Error: Please upload your file."
+    elif error_code == "too_many_files":
+        return "Error: Only one file is allowed."
+    elif error_code == "file_too_large":
+        return "Error: File size exceeded."
+    elif error_code == "unsupported_file_type":
+        return "Error: File type not allowed."
+    elif error_code == "high_quality_dataset_only":
+        return "Error: Current operation only supports 'high-quality' datasets."
+    elif error_code == "dataset_not_initialized":
+        return "Error: The dataset is still being initialized or indexing. Please wait a moment."
+    elif error_code == "invalid_metadata":
+        return "Error: The metadata content is incorrect. Please check and verify."
+    return None
+
+
+def indexing_status_error(response) -> str:
+    """Map a failed indexing status response to an error message"""
+    error_code, error_message = response_error(response)
+
+    if error_code == "archived_document_immutable":
+        return "Error: The archived document is not editable."
+    elif error_code == "document_already_finished":
+        return "Error: The document has been processed. Please refresh the page or go to the document details."
+    elif error_code == "document_indexing":
+        return "Error: The document is being processed and cannot be edited."
+    else:
+        logger.error(fields("indexing status check failed", status=response.status_code, code=error_code,
+                            message=error_message))
+        return "Error: Failed to check document status."
@@ -0,0 +1,382 @@
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from array import array
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, mirrors are then written without a lock
+    fcntl = None
+
+from utils.config import DATA_DIR, DEFAULT_MAX_CONCURRENCY
+from utils.dify_client import DifyClient
+from utils.listing import list_documents, list_segments
+from utils.logger import fields, get_logger
+from utils.metrics import get_metrics
+from utils.retrieve_cache import cache_scope
+
+logger = get_logger(__name__)
+
+# Seconds a keyword mirror answers keyword searches before it is rebuilt, 0 disables the mirrors
+KEYWORD_MIRROR_TTL = float(os.environ.get('DIFY_KNOWLEDGE_KEYWORD_MIRROR_TTL', 0))
+KEYWORD_MIRROR_DIR = os.path.join(DATA_DIR, 'keyword_mirror')
+INDEX_VERSION = 1
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Segment fields kept in the mirror, enough to answer like the retrieve API
+SEGMENT_FIELDS = ('id', 'position', 'document_id', 'content', 'answer', 'keywords', 'word_count')
+
+_CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af'
+# CJK text is not separated by spaces, each of its characters is a term
+_TOKEN = re.compile(f'[{_CJK}]|[^\\W{_CJK}]+')
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall((text or '').lower())
+
+
+def write_index(directory: str, segments: List[Dict], meta: Dict) -> None:
+    """Write a BM25 index of the segments, postings are stored as flat arrays to be memory-mapped"""
+    postings: Dict[str, List] = {}
+    lengths = array('I')
+    for number, segment in enumerate(segments):
+        terms = tokenize(f"{segment.get('content') or ''} {segment.get('answer') or ''}")
+        lengths.append(len(terms))
+        for term, count in Counter(terms).items():
+            postings.setdefault(term, []).append((number, count))
+
+    # Every term points at a run of segment numbers and a parallel run of term frequencies
+    numbers = array('I')
+    frequencies = array('H')
+    terms = {}
+    for term in sorted(postings):
+        entries = postings[term]
+        terms[term] = [len(numbers), len(entries)]
+        numbers.extend(number for number, _ in entries)
+        frequencies.extend(min(count, 0xFFFF) for _, count in entries)
+
+    os.makedirs(directory, exist_ok=True)
+    for name, values in (('postings.bin', numbers), ('frequencies.bin', frequencies), ('lengths.bin', lengths)):
+        with open(os.path.join(directory, name), 'wb') as file:
+            values.tofile(file)
+    with open(os.path.join(directory, 'terms.json'), 'w', encoding='utf-8') as file:
+        json.dump(terms, file, ensure_ascii=False, separators=(',', ':'))
+    with open(os.path.join(directory, 'segments.json'), 'w', encoding='utf-8') as file:
+        json.dump(segments, file, ensure_ascii=False, separators=(',', ':'))
+    meta = dict(meta, version=INDEX_VERSION, segments=len(segments),
+                average_length=(sum(lengths) / len(lengths)) if lengths else 0.0)
+    with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as file:
+        json.dump(meta, file)
+
+
+class KeywordIndex:
+    """BM25 index of the segments of one knowledge base, loaded from memory-mapped files"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json'), encoding='utf-8') as file:
+            self.meta = json.load(file)
+        if self.meta.get('version') != INDEX_VERSION:
+            raise ValueError(f"unsupported keyword index version {self.meta.get('version')}")
+        with open(os.path.join(directory, 'terms.json'), encoding='utf-8') as file:
+            self.terms = json.load(file)
+        self._maps = []
+        self.postings = self._map('postings.bin', 'I')
+        self.frequencies = self._map('frequencies.bin', 'H')
+        self.lengths = self._map('lengths.bin', 'I')
+        # Replaced builds are removed, so every file that is not memory-mapped is read while opening
+        with open(os.path.join(directory, 'segments.json'), encoding='utf-8') as file:
+            self.segments: List[Dict] = json.load(file)
+
+    def _map(self, name: str, typecode: str) -> memoryview:
+        with open(os.path.join(self.directory, name), 'rb') as file:
+            # Empty files cannot be mapped
+            if os.fstat(file.fileno()).st_size == 0:
+                return memoryview(array(typecode))
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        return memoryview(mapped).cast(typecode)
+
+    def search(self, query: str, top_k: int) -> List[Dict]:
+        """Return the best matching segments as retrieve records, scores are relative to the best match"""
+        total = len(self.lengths)
+        average_length = self.meta.get('average_length') or 1.0
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            entry = self.terms.get(term)
+            if entry is None:
+                continue
+            offset, count = entry
+            idf = math.log(1 + (total - count + 0.5) / (count + 0.5))
+            for number, frequency in zip(self.postings[offset:offset + count], self.frequencies[offset:offset + count]):
+                length_norm = 1 - BM25_B + BM25_B * self.lengths[number] / average_length
+                score = idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+                scores[number] = scores.get(number, 0.0) + score
+        if not scores:
+            return []
+
+        best = heapq.nlargest(int(top_k), scores.items(), key=lambda item: item[1])
+        top_score = best[0][1]
+        return [{"segment": self.segments[number], "score": round(score / top_score, 4)} for number, score in best]
+
+
+class KeywordMirror:
+    """Local copies of knowledge base segments with a BM25 index to answer keyword searches"""
+
+    def __init__(self, root: str = KEYWORD_MIRROR_DIR, ttl: float = KEYWORD_MIRROR_TTL):
+        self.root = root
+        self.ttl = ttl
+        self._indexes: Dict[str, KeywordIndex] = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def _directory(self, scope: str, dataset_id: str) -> str:
+        return os.path.join(self.root, scope, dataset_id)
+
+    def _current(self, directory: str) -> Optional[str]:
+        """Return the directory of the current build of a mirror"""
+        try:
+            with open(os.path.join(directory, 'current'), encoding='utf-8') as file:
+                return os.path.join(directory, file.read().strip())
+        except OSError:
+            return None
+
+    def _pending(self, directory: str) -> List[str]:
+        try:
+            return os.listdir(os.path.join(directory, 'pending'))
+        except OSError:
+            return []
+
+    def search(self, scope: str, dataset_id: str, query: str, top_k: int) -> Optional[List[Dict]]:
+        """Answer a keyword search locally, or return None when the mirror is missing or stale"""
+        if not self.enabled:
+            return None
+        directory = self._directory(scope, dataset_id)
+        build = self._current(directory)
+        # Documents written since the build keep the mirror stale until they are mirrored
+        stale = build is None or bool(self._pending(directory))
+        try:
+            index = None if stale else self._load(build)
+            expired = index is None or time.time() - index.meta.get('built_at', 0) > self.ttl
+            records = None if expired else index.search(query, top_k)
+        except Exception as e:
+            logger.warning(fields("keyword mirror unreadable", dataset_id=dataset_id, error=str(e)))
+            records = None
+        if records is None:
+            get_metrics().increment('dify_knowledge_keyword_mirror_total', result='stale')
+            return None
+        get_metrics().increment('dify_knowledge_keyword_mirror_total', result='hit')
+        return records
+
+    def _load(self, build: str) -> KeywordIndex:
+        index = self._indexes.get(build)
+        if index is None:
+            index = KeywordIndex(build)
+            with self._lock:
+                # Builds never change, an index is loaded once and kept until the next build
+                self._indexes = {path: loaded for path, loaded in self._indexes.items()
+                                 if os.path.dirname(path) != os.path.dirname(build)}
+                self._indexes[build] = index
+        return index
+
+    def mark_stale(self, scope: str, dataset_id: str, document_ids: Iterable[str]) -> None:
+        """Record documents written to a knowledge base, its mirror is not used until they are mirrored"""
+        directory = self._directory(scope, dataset_id)
+        # Knowledge bases that were never mirrored are not tracked
+        if not self.enabled or not os.path.isdir(directory):
+            return
+        try:
+            os.makedirs(os.path.join(directory, 'pending'), exist_ok=True)
+            for document_id in document_ids:
+                if document_id:
+                    path = os.path.join(directory, 'pending', document_id)
+                    open(path, 'a').close()
+                    os.utime(path)
+        except OSError as e:
+            logger.warning(fields("keyword mirror not marked stale", dataset_id=dataset_id, error=str(e)))
+
+    def rebuild(self, client: DifyClient, scope: str, dataset_id: str,
+                max_concurrency: int = DEFAULT_MAX_CONCURRENCY) -> bool:
+        """Copy every enabled segment of a knowledge base and index them"""
+        started_at = time.time()
+        directory = self._directory(scope, dataset_id)
+        # Documents written from now on are marked stale for this copy
+        os.makedirs(directory, exist_ok=True)
+        documents = list_documents(client, dataset_id, max_concurrency)
+        if documents is None:
+            return False
+        documents = {document['id']: document.get('name', '') for document in documents
+                     if document.get('indexing_status') == 'completed' and document.get('enabled', True)
+                     and not document.get('archived')}
+        segments = self._fetch_segments(client, dataset_id, documents, max_concurrency)
+        if segments is None:
+            return False
+
+        with self._write_lock(directory):
+            build = self._current(directory)
+            if build is not None and self._meta(build).get('updated_at', 0) > started_at:
+                # A document was mirrored while this copy was made, the newer build is kept
+                return False
+            self._write(directory, segments, started_at, started_at)
+            self._clear_pending(directory, started_at)
+        logger.info(fields("keyword mirror built", dataset_id=dataset_id, documents=len(documents),
+                           segments=len(segments), elapsed_ms=round((time.time() - started_at) * 1000, 1)))
+        return True
+
+    def update_documents(self, client: DifyClient, scope: str, dataset_id: str, documents: Dict[str, str],
+                         removed: Iterable[str] = ()) -> bool:
+        """Replace the segments of written documents in an existing mirror, documents maps IDs to names"""
+        directory = self._directory(scope, dataset_id)
+        if not self.enabled or self._current(directory) is None or not (documents or removed):
+            return False
+        started_at = time.time()
+        segments = self._fetch_segments(client, dataset_id, documents, DEFAULT_MAX_CONCURRENCY)
+        if segments is None:
+            return False
+
+        dropped = set(documents) | set(removed)
+        with self._write_lock(directory):
+            build = self._current(directory)
+            if build is None:
+                return False
+            try:
+                meta = self._meta(build)
+                with open(os.path.join(build, 'segments.json'), encoding='utf-8') as file:
+                    kept = [segment for segment in json.load(file) if segment.get('document_id') not in dropped]
+            except (OSError, ValueError) as e:
+                logger.warning(fields("keyword mirror unreadable", dataset_id=dataset_id, error=str(e)))
+                return False
+            # Only the written documents are known to be current, the age of the rest is unchanged
+            self._write(directory, kept + segments, meta.get('built_at', 0), time.time())
+            self._clear_pending(directory, started_at, dropped)
+        return True
+
+    def refresh_in_background(self, client: DifyClient, scope: str, dataset_id: str) -> None:
+        """Rebuild a stale mirror on a background thread, once at a time per knowledge base"""
+        if not self.enabled:
+            return
+        key = (scope, dataset_id)
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh() -> None:
+            try:
+                self.rebuild(client, scope, dataset_id)
+            except Exception as e:
+                logger.error(fields("keyword mirror rebuild failed", dataset_id=dataset_id, error=str(e)))
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, name='dify-knowledge-keyword-mirror', daemon=True).start()
+
+    def _fetch_segments(self, client: DifyClient, dataset_id: str, documents: Dict[str, str],
+                        max_concurrency: int) -> Optional[List[Dict]]:
+        """List the enabled segments of the documents concurrently, or return None when one failed"""
+        if not documents:
+            return []
+        workers = max(1, min(int(max_concurrency), len(documents)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            listed = list(executor.map(lambda document_id: list_segments(client, dataset_id, document_id), documents))
+        if any(segments is None for segments in listed):
+            return None
+
+        mirrored = []
+        for (document_id, name), segments in zip(documents.items(), listed):
+            for segment in sorted(segments, key=lambda segment: segment.get('position') or 0):
+                if not segment.get('enabled', True) or segment.get('status', 'completed') != 'completed':
+                    continue
+                mirrored.append(dict({key: segment.get(key) for key in SEGMENT_FIELDS}, document_id=document_id,
+                                     document={"id": document_id, "name": name}))
+        return mirrored
+
+    def _meta(self, build: str) -> Dict:
+        try:
+            with open(os.path.join(build, 'meta.json'), encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write(self, directory: str, segments: List[Dict], built_at: float, updated_at: float) -> None:
+        """Write a new build and switch the mirror to it, readers of the old build are unaffected"""
+        build_name = uuid.uuid4().hex
+        write_index(os.path.join(directory, build_name), segments, {"built_at": built_at, "updated_at": updated_at})
+        current = os.path.join(directory, f'current.{build_name}')
+        with open(current, 'w', encoding='utf-8') as file:
+            file.write(build_name)
+        os.replace(current, os.path.join(directory, 'current'))
+        # Indexes already open keep working, their memory maps hold the removed files and the rest was read on opening
+        for entry in os.scandir(directory):
+            if entry.is_dir() and entry.name not in (build_name, 'pending'):
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def _clear_pending(self, directory: str, before: float, document_ids: Optional[Iterable[str]] = None) -> None:
+        """Remove the stale marks the new build covers, marks made after it started stay"""
+        document_ids = set(document_ids) if document_ids is not None else None
+        for name in self._pending(directory):
+            path = os.path.join(directory, 'pending', name)
+            try:
+                if (document_ids is None or name in document_ids) and os.stat(path).st_mtime < before:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    @contextmanager
+    def _write_lock(self, directory: str) -> Iterator[None]:
+        """Serialize writers of one mirror across the plugin workers"""
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, 'lock'), 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+
+_mirror: Optional[KeywordMirror] = None
+_mirror_lock = threading.Lock()
+
+
+def get_keyword_mirror() -> KeywordMirror:
+    """Return the process-wide keyword mirror"""
+    global _mirror
+    if _mirror is None:
+        with _mirror_lock:
+            if _mirror is None:
+                _mirror = KeywordMirror()
+    return _mirror
+
+
+def mark_documents_written(headers: Dict, base_url: Optional[str], dataset_id: str, document_ids: Iterable[str]) -> None:
+    """Keep keyword searches of a knowledge base off its mirror until the written documents are mirrored"""
+    mirror = get_keyword_mirror()
+    if mirror.enabled:
+        mirror.mark_stale(cache_scope(headers, base_url), dataset_id, list(document_ids))
+
+
+def mirror_documents(headers: Dict, base_url: Optional[str], dataset_id: str, documents: Dict[str, str],
+                     removed: Iterable[str] = ()) -> None:
+    """Copy the segments of indexed documents into the mirror of their knowledge base, if it has one"""
+    mirror = get_keyword_mirror()
+    if not mirror.enabled or not (documents or removed):
+        return
+    try:
+        mirror.update_documents(DifyClient(headers, base_url), cache_scope(headers, base_url), dataset_id, documents,
+                                removed)
+    except Exception as e:
+        logger.warning(fields("keyword mirror update failed", dataset_id=dataset_id, error=str(e)))
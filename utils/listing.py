@@ -0,0 +1,88 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from utils.dify_client import DifyClient, response_error
+from utils.logger import fields, get_logger
+
+logger = get_logger(__name__)
+
+# The Dify list endpoints return at most this many items per page
+MAX_PAGE_SIZE = 100
+
+
+def fetch_page(fetch: Callable, page: int, limit: int, what: str, **context) -> Optional[Dict]:
+    """Request one page of a list endpoint, or return None when it could not be read"""
+    try:
+        response = fetch(page, limit)
+    except Exception as e:
+        logger.error(fields(f"listing {what} failed", page=page, error=str(e), **context))
+        return None
+    if response.status_code != 200:
+        error_code, error_message = response_error(response)
+        logger.error(fields(f"listing {what} failed", page=page, status=response.status_code, code=error_code,
+                            message=error_message, **context))
+        return None
+    return response.json()
+
+
+def iter_pages(fetch: Callable, limit: int, max_concurrency: int, what: str,
+               **context) -> Iterator[Tuple[int, Optional[List[Dict]]]]:
+    """Yield the items of every page in order, None for a page that failed"""
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    first = fetch_page(fetch, 1, limit, what, **context)
+    yield 1, first.get('data', []) if first else None
+    if not first or not first.get('has_more'):
+        return
+
+    # The first page tells the total, the others are fetched concurrently with at most
+    # max_concurrency of them held in memory
+    total = first.get('total')
+    # The server may serve fewer items per page than asked for
+    limit = first.get('limit') or limit
+    last_page = -(-total // limit) if isinstance(total, int) and total > 0 else 1
+    result = first
+    if last_page > 1:
+        workers = max(1, min(int(max_concurrency), last_page - 1))
+        pages = iter(range(2, last_page + 1))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque((page, executor.submit(fetch_page, fetch, page, limit, what, **context))
+                            for page in [next(pages) for _ in range(workers)])
+            while pending:
+                page, future = pending.popleft()
+                # Keep the window full before handing the page out
+                following = next(pages, None)
+                if following is not None:
+                    pending.append((following, executor.submit(fetch_page, fetch, following, limit, what, **context)))
+                result = future.result()
+                yield page, result.get('data', []) if result else None
+
+    # Items added while listing, or an endpoint without a total, continue page by page
+    page = last_page
+    while result and result.get('has_more'):
+        page += 1
+        result = fetch_page(fetch, page, limit, what, **context)
+        yield page, result.get('data', []) if result else None
+
+
+def list_all(fetch: Callable, limit: int, max_concurrency: int, what: str, **context) -> Optional[List[Dict]]:
+    """Return the items of every page, or None when a page could not be read"""
+    items = []
+    for _, page_items in iter_pages(fetch, limit, max_concurrency, what, **context):
+        if page_items is None:
+            return None
+        items.extend(page_items)
+    return items
+
+
+def list_documents(client: DifyClient, dataset_id: str, max_concurrency: int = 1) -> Optional[List[Dict]]:
+    """Return every document of a knowledge base"""
+    return list_all(lambda page, limit: client.list_documents(dataset_id, page, limit), MAX_PAGE_SIZE,
+                    max_concurrency, 'documents', dataset_id=dataset_id)
+
+
+def list_segments(client: DifyClient, dataset_id: str, document_id: str) -> Optional[List[Dict]]:
+    """Return every segment of a document"""
+    # Callers list the segments of several documents concurrently, the pages of one are read in turn
+    return list_all(lambda page, limit: client.list_segments(dataset_id, document_id, page, limit), MAX_PAGE_SIZE,
+                    1, 'segments', dataset_id=dataset_id, document_id=document_id)
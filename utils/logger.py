@@ -0,0 +1,21 @@
+import logging
+import os
+from typing import Any
+
+from dify_plugin.config.logger_format import plugin_logger_handler
+
+LOG_LEVEL = os.environ.get('DIFY_KNOWLEDGE_LOG_LEVEL', 'INFO').upper()
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Return a logger that writes through the plugin daemon's log handler"""
+    logger = logging.getLogger(name)
+    if plugin_logger_handler not in logger.handlers:
+        logger.addHandler(plugin_logger_handler)
+    logger.setLevel(LOG_LEVEL)
+    return logger
+
+
+def fields(event: str, **values: Any) -> str:
+    """Format a log event with key=value fields, e.g. 'retrieve done dataset_id=... status=200'"""
+    return event + ''.join(f" {key}={value}" for key, value in values.items())
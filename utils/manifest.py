@@ -0,0 +1,118 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Dict, Optional, Tuple
+
+from utils.config import DATA_DIR
+from utils.logger import fields, get_logger
+
+logger = get_logger(__name__)
+
+MANIFEST_FILENAME = 'upload_manifest.sqlite3'
+# Documents that ended in these statuses are uploaded again even when unchanged
+FAILED_STATUSES = ('error', 'failed')
+
+
+def content_hash(text: str) -> str:
+    """Hash document text to detect unchanged uploads"""
+    return hashlib.sha256(str(text).encode('utf-8')).hexdigest()
+
+
+class UploadManifest:
+    """Persistent record of uploaded documents keyed by knowledge base and document name"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS documents ("
+                " dataset_id TEXT NOT NULL,"
+                " document_name TEXT NOT NULL,"
+                " content_hash TEXT NOT NULL,"
+                " document_id TEXT,"
+                " status TEXT,"
+                " updated_at REAL NOT NULL,"
+                " PRIMARY KEY (dataset_id, document_name))"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection per operation keeps the manifest safe to share between threads and workers
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, dataset_id: str, document_name: str) -> Optional[Dict]:
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                "SELECT content_hash, document_id, status FROM documents WHERE dataset_id = ? AND document_name = ?",
+                (dataset_id, document_name)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'content_hash': row[0], 'document_id': row[1], 'status': row[2]}
+
+    def record(self, dataset_id: str, document_name: str, text_hash: str, document_id: Optional[str], status: str) -> None:
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO documents (dataset_id, document_name, content_hash, document_id, status, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (dataset_id, document_name, text_hash, document_id, status, time.time())
+            )
+
+    def update_status(self, dataset_id: str, document_name: str, status: str) -> None:
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "UPDATE documents SET status = ?, updated_at = ? WHERE dataset_id = ? AND document_name = ?",
+                (status, time.time(), dataset_id, document_name)
+            )
+
+    def update_status_by_document(self, dataset_id: str, document_id: str, status: str) -> None:
+        """Record the status of a document known only by its ID, e.g. when it is checked after the upload"""
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                "UPDATE documents SET status = ?, updated_at = ? WHERE dataset_id = ? AND document_id = ?",
+                (status, time.time(), dataset_id, document_id)
+            )
+
+    def forget(self, dataset_id: str, document_name: str) -> None:
+        """Drop the entry of a document deleted from the knowledge base"""
+        with closing(self._connect()) as connection, connection:
+            connection.execute("DELETE FROM documents WHERE dataset_id = ? AND document_name = ?", (dataset_id, document_name))
+
+    def plan(self, dataset_id: str, document_name: str, text: str) -> Tuple[str, Optional[Dict], str]:
+        """Decide from the local record whether a document has to be created, updated or can be skipped"""
+        text_hash = content_hash(text)
+        entry = self.get(dataset_id, document_name)
+        if entry is None or not entry['document_id']:
+            return 'create', entry, text_hash
+        # Unchanged documents that are still indexing are left to finish, only failed ones are sent again
+        if entry['content_hash'] == text_hash and entry['status'] not in FAILED_STATUSES:
+            return 'skip', entry, text_hash
+        return 'update', entry, text_hash
+
+
+_manifest: Optional[UploadManifest] = None
+_manifest_lock = threading.Lock()
+
+
+def get_upload_manifest() -> UploadManifest:
+    """Return the upload manifest stored in the plugin data directory"""
+    global _manifest
+    if _manifest is None:
+        with _manifest_lock:
+            if _manifest is None:
+                _manifest = UploadManifest(os.path.join(DATA_DIR, MANIFEST_FILENAME))
+    return _manifest
+
+
+def open_upload_manifest() -> Optional[UploadManifest]:
+    """Return the upload manifest, or None when it cannot be opened"""
+    try:
+        return get_upload_manifest()
+    except Exception as e:
+        logger.warning(fields("upload manifest unavailable", error=str(e)))
+        return None
@@ -0,0 +1,145 @@
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+MetricsHook = Callable[[str, float, str, Optional[str]], None]
+
+
+class Histogram:
+    """Cumulative latency histogram with fixed buckets"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        total = 0
+        result = []
+        for bound, count in zip(list(self.buckets) + [float('inf')], self.counts):
+            total += count
+            result.append(('+Inf' if bound == float('inf') else f'{bound:g}', total))
+        return result
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile as the upper bound of the bucket containing it"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        total = 0
+        for bound, count in zip(list(self.buckets) + [float('inf')], self.counts):
+            total += count
+            if total >= rank:
+                return bound
+        return float('inf')
+
+
+class Metrics:
+    """Per-phase latency histograms, outcome counters and error code tallies"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._histograms: Dict[str, Histogram] = {}
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._hooks: List[MetricsHook] = []
+        self._lock = threading.Lock()
+
+    def observe(self, phase: str, seconds: float, outcome: str = 'ok', error_code: Optional[str] = None) -> None:
+        """Record one completed phase, e.g. an API call, and notify the hooks"""
+        with self._lock:
+            histogram = self._histograms.get(phase)
+            if histogram is None:
+                histogram = self._histograms[phase] = Histogram(self.buckets)
+            histogram.observe(seconds)
+            self._increment('dify_knowledge_requests_total', 1, (('outcome', outcome), ('phase', phase)))
+            if error_code:
+                self._increment('dify_knowledge_errors_total', 1, (('code', error_code), ('phase', phase)))
+            hooks = list(self._hooks)
+        for hook in hooks:
+            try:
+                hook(phase, seconds, outcome, error_code)
+            except Exception:
+                # A broken hook must never break an API call
+                pass
+
+    def increment(self, name: str, amount: float = 1, **labels: str) -> None:
+        with self._lock:
+            self._increment(name, amount, tuple(sorted(labels.items())))
+
+    def _increment(self, name: str, amount: float, labels: Tuple) -> None:
+        # Labels are sorted by name so equal label sets share a counter
+        key = (name, labels)
+        self._counters[key] = self._counters.get(key, 0) + amount
+
+    def add_hook(self, hook: MetricsHook) -> None:
+        """Register a callable invoked as hook(phase, seconds, outcome, error_code) for every observation"""
+        with self._lock:
+            self._hooks.append(hook)
+
+    def remove_hook(self, hook: MetricsHook) -> None:
+        with self._lock:
+            if hook in self._hooks:
+                self._hooks.remove(hook)
+
+    def snapshot(self) -> Dict:
+        """Return the current metrics as plain data"""
+        with self._lock:
+            return {
+                "phases": {
+                    phase: {
+                        "count": histogram.count,
+                        "sum": histogram.sum,
+                        "p50": histogram.quantile(0.5),
+                        "p95": histogram.quantile(0.95),
+                        "p99": histogram.quantile(0.99)
+                    }
+                    for phase, histogram in self._histograms.items()
+                },
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in self._counters.items()
+                ]
+            }
+
+    def render_text(self) -> str:
+        """Render the metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            if self._histograms:
+                lines.append('# TYPE dify_knowledge_phase_seconds histogram')
+            for phase, histogram in sorted(self._histograms.items()):
+                for bound, total in histogram.cumulative():
+                    lines.append(f'dify_knowledge_phase_seconds_bucket{{phase="{phase}",le="{bound}"}} {total}')
+                lines.append(f'dify_knowledge_phase_seconds_sum{{phase="{phase}"}} {histogram.sum:.6f}')
+                lines.append(f'dify_knowledge_phase_seconds_count{{phase="{phase}"}} {histogram.count}')
+            names = sorted({name for name, _ in self._counters})
+            for name in names:
+                lines.append(f'# TYPE {name} counter')
+                for (counter_name, labels), value in sorted(self._counters.items()):
+                    if counter_name != name:
+                        continue
+                    label_text = ','.join(f'{key}="{value_}"' for key, value_ in labels)
+                    lines.append(f'{name}{{{label_text}}} {value:g}' if label_text else f'{name} {value:g}')
+        return '\n'.join(lines) + '\n'
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    """Return the process-wide metrics registry"""
+    return _metrics
@@ -0,0 +1,58 @@
+import json
+import uuid
+from collections.abc import Iterable, Iterator
+from typing import Dict, Optional
+
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_file_chunks(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Read a local file in fixed-size chunks"""
+    with open(path, 'rb') as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+class MultipartStream:
+    """multipart/form-data request body that streams the file part chunk by chunk"""
+
+    def __init__(self, fields: Dict[str, str], file_field: str, filename: str, chunks: Iterable[bytes],
+                 file_size: Optional[int] = None, mime_type: Optional[str] = None):
+        self.boundary = uuid.uuid4().hex
+        self.chunks = chunks
+        self.file_size = file_size
+        self._head = b''.join(self._field_part(name, value) for name, value in fields.items())
+        self._head += (
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{file_field}"; filename={json.dumps(filename, ensure_ascii=False)}\r\n'
+            f'Content-Type: {mime_type or "application/octet-stream"}\r\n\r\n'
+        ).encode('utf-8')
+        self._tail = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+
+    @property
+    def content_type(self) -> str:
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def _field_part(self, name: str, value: str) -> bytes:
+        return (
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+            f'{value}\r\n'
+        ).encode('utf-8')
+
+    def __iter__(self) -> Iterator[bytes]:
+        yield self._head
+        for chunk in self.chunks:
+            if chunk:
+                yield chunk
+        yield self._tail
+
+    @property
+    def len(self) -> int:
+        # requests sends Content-Length for a known length and falls back to chunked encoding for 0
+        if self.file_size is None:
+            return 0
+        return len(self._head) + self.file_size + len(self._tail)
@@ -0,0 +1,179 @@
+import random
+import time
+from collections.abc import Generator
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+from utils.config import DEFAULT_MAX_CONCURRENCY, MAX_REQUEST_TIMEOUT, use_async_engine
+from utils.dify_client import DifyClient
+from utils.documents import indexing_status_error
+from utils.logger import fields, get_logger
+
+if TYPE_CHECKING:
+    from utils.async_client import AsyncDifyClient
+
+logger = get_logger(__name__)
+
+# Time kept free at the end of an invocation for the final messages
+POLL_SAFETY_MARGIN = 10
+FIRST_POLL_INTERVAL = 0.5
+MAX_POLL_INTERVAL = 8.0
+POLL_BACKOFF_FACTOR = 1.8
+POLL_JITTER = 0.2
+TERMINAL_STATUSES = ('completed', 'error', 'failed')
+
+
+def poll_deadline(started_at: Optional[float] = None) -> float:
+    """Return the monotonic time by which polling must stop for an invocation started at started_at"""
+    if started_at is None:
+        started_at = time.monotonic()
+    return started_at + max(MAX_REQUEST_TIMEOUT - POLL_SAFETY_MARGIN, 0)
+
+
+def run_to_completion(generator: Generator) -> Any:
+    """Exhaust a generator, discarding what it yields, and return its return value"""
+    while True:
+        try:
+            next(generator)
+        except StopIteration as stop:
+            return stop.value
+
+
+class IndexingPoller:
+    """Schedules indexing status checks with exponential backoff, progress estimates and a deadline"""
+
+    def __init__(self, deadline: float, first_interval: float = FIRST_POLL_INTERVAL,
+                 max_interval: float = MAX_POLL_INTERVAL, factor: float = POLL_BACKOFF_FACTOR,
+                 jitter: float = POLL_JITTER):
+        self.deadline = deadline
+        self.max_interval = max_interval
+        self.factor = factor
+        self.jitter = jitter
+        self.attempts = 0
+        self._interval = first_interval
+        self._first_progress = None
+        self._estimate = None
+
+    def observe(self, completed: Any, total: Any) -> None:
+        """Record segment progress reported by the indexing status endpoint"""
+        if not isinstance(completed, int) or not isinstance(total, int) or total <= 0:
+            return
+        now = time.monotonic()
+        if self._first_progress is None:
+            self._first_progress = (now, completed)
+            return
+        started_at, started_completed = self._first_progress
+        done = completed - started_completed
+        elapsed = now - started_at
+        if done > 0 and elapsed > 0:
+            self._estimate = (total - completed) * elapsed / done
+
+    @property
+    def estimated_remaining(self) -> Optional[float]:
+        return self._estimate
+
+    def next_delay(self) -> Optional[float]:
+        """Return how long to wait before the next check, or None once the deadline is reached"""
+        remaining_budget = self.deadline - time.monotonic()
+        if remaining_budget <= 0:
+            return None
+
+        delay = self._interval
+        self._interval = min(self._interval * self.factor, self.max_interval)
+        # Check back around the estimated completion time rather than sleeping past it
+        if self._estimate is not None:
+            delay = min(delay, max(self._estimate, FIRST_POLL_INTERVAL))
+        delay *= 1 + random.uniform(-self.jitter, self.jitter)
+        self.attempts += 1
+        return max(min(delay, remaining_budget), 0)
+
+
+def check_batch(client: DifyClient, dataset_id: str, batch: str) -> Optional[Dict]:
+    """Return the indexing status of one batch, or None when it could not be checked"""
+    try:
+        response = client.get_indexing_status(dataset_id, batch)
+        if response.status_code != 200:
+            return {'indexing_status': 'error', 'error': indexing_status_error(response)}
+        documents = response.json().get('data', [])
+        return documents[0] if documents else None
+    except Exception as e:
+        logger.warning(fields("indexing status check failed", dataset_id=dataset_id, batch=batch, error=str(e)))
+        return None
+
+
+async def check_batch_async(client: 'AsyncDifyClient', dataset_id: str, batch: str) -> Optional[Dict]:
+    """Return the indexing status of one batch from the async engine, or None when it could not be checked"""
+    try:
+        response = await client.get_indexing_status(dataset_id, batch)
+        if response.status_code != 200:
+            return {'indexing_status': 'error', 'error': indexing_status_error(response)}
+        documents = response.json().get('data', [])
+        return documents[0] if documents else None
+    except Exception as e:
+        logger.warning(fields("indexing status check failed", dataset_id=dataset_id, batch=batch, error=str(e)))
+        return None
+
+
+def check_batches(client: DifyClient, dataset_id: str, batches: List[str],
+                  max_concurrency: int = DEFAULT_MAX_CONCURRENCY) -> Dict[str, Optional[Dict]]:
+    """Check the indexing status of many batches once, concurrently"""
+    if not batches:
+        return {}
+    if use_async_engine():
+        # All checks share the engine's event loop instead of a thread each, asyncio is only imported here
+        from utils.async_client import AsyncDifyClient, gather_limited, get_async_engine
+        async_client = AsyncDifyClient(client.headers, client.base_url)
+        checks = [check_batch_async(async_client, dataset_id, batch) for batch in batches]
+        return dict(zip(batches, get_async_engine().run(gather_limited(checks, max_concurrency))))
+    workers = max(1, min(int(max_concurrency), len(batches)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(batches, executor.map(lambda batch: check_batch(client, dataset_id, batch), batches)))
+
+
+def poll_batches(client: DifyClient, dataset_id: str, batches: List[str], deadline: float,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY) -> Generator[Dict[str, Dict], None, Dict[str, Dict]]:
+    """Track the indexing status of many batches in one polling loop, yielding all statuses after every round"""
+    # Each round checks the unfinished batches concurrently, then waits once for the whole set
+    statuses = {batch: {'indexing_status': 'waiting'} for batch in batches}
+    pending = list(batches)
+    poller = IndexingPoller(deadline)
+
+    # Batches that could not be checked stay pending, the next round checks them again
+    check = lambda batch: check_batch(client, dataset_id, batch)
+
+    workers = max(1, min(int(max_concurrency), len(batches) or 1))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending:
+            for batch, document in zip(pending, executor.map(check, pending)):
+                if document is not None:
+                    statuses[batch] = document
+            pending = [batch for batch in pending if statuses[batch].get('indexing_status') not in TERMINAL_STATUSES]
+
+            completed = sum(status.get('completed_segments') or 0 for status in statuses.values())
+            total = sum(status.get('total_segments') or 0 for status in statuses.values())
+            poller.observe(completed, total)
+            yield statuses
+
+            if not pending:
+                break
+            delay = poller.next_delay()
+            if delay is None:
+                break
+            time.sleep(delay)
+    return statuses
+
+
+def poll_progress(client: DifyClient, dataset_id: str, batches: List[str], deadline: float, max_concurrency: int,
+                  progress: Callable[[int, int], Any]) -> Generator[Any, None, Dict[str, Dict]]:
+    """Poll all batches together, yielding progress(finished, total) when the number of finished batches changes"""
+    poll = poll_batches(client, dataset_id, batches, deadline, max_concurrency)
+    last_finished = None
+    while True:
+        try:
+            statuses = next(poll)
+        except StopIteration as stop:
+            return stop.value
+        finished = sum(1 for status in statuses.values() if status.get('indexing_status') in TERMINAL_STATUSES)
+        if finished != last_finished:
+            last_finished = finished
+            yield progress(finished, len(batches))
@@ -0,0 +1,198 @@
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+import requests
+
+# Retry settings, can be overridden through environment variables
+DEFAULT_MAX_RETRIES = int(os.environ.get('DIFY_KNOWLEDGE_MAX_RETRIES', 3))
+DEFAULT_RETRY_BASE_DELAY = 0.5
+# Longer Retry-After waits are not worth blocking an invocation for, the error is returned instead
+DEFAULT_MAX_RETRY_DELAY = float(os.environ.get('DIFY_KNOWLEDGE_MAX_RETRY_DELAY', 10))
+RETRY_JITTER = 0.25
+
+# Requests per second allowed per API key and deployment, 0 disables the limiter
+DEFAULT_RATE_LIMIT = float(os.environ.get('DIFY_KNOWLEDGE_RATE_LIMIT', 0))
+DEFAULT_RATE_BURST = int(os.environ.get('DIFY_KNOWLEDGE_RATE_BURST', 10))
+
+# Consecutive failures that open the circuit of a deployment, and how long it stays open
+DEFAULT_BREAKER_THRESHOLD = int(os.environ.get('DIFY_KNOWLEDGE_BREAKER_THRESHOLD', 5))
+DEFAULT_BREAKER_RESET = float(os.environ.get('DIFY_KNOWLEDGE_BREAKER_RESET', 30))
+
+# Rejected before processing, safe to send again whatever the method
+RETRY_ALWAYS_STATUSES = (429, 503)
+# May have been processed, only retried for idempotent requests
+RETRY_IDEMPOTENT_STATUSES = (500, 502, 504)
+
+
+def is_transient_status(status_code: int) -> bool:
+    """Return True for throttling and server errors that may succeed when tried later"""
+    return status_code in RETRY_ALWAYS_STATUSES or status_code >= 500
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Raised instead of sending a request while the deployment's circuit is open"""
+
+    def __init__(self, base_url: str, retry_in: float):
+        super().__init__(f"Dify API at {base_url} is unavailable, retrying in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+def retry_after(response: requests.Response) -> Optional[float]:
+    """Return the delay requested by a Retry-After header in seconds, given as seconds or an HTTP date"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """Decides whether a failed attempt is sent again and how long to wait before it"""
+
+    def __init__(self, max_retries: int = DEFAULT_MAX_RETRIES, base_delay: float = DEFAULT_RETRY_BASE_DELAY,
+                 max_delay: float = DEFAULT_MAX_RETRY_DELAY):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, attempt: int, idempotent: bool, response: Optional[requests.Response] = None,
+                     error: Optional[Exception] = None) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        if error is not None:
+            # A request that timed out while connecting never reached the server
+            return idempotent or isinstance(error, requests.exceptions.ConnectTimeout)
+        status = response.status_code
+        return status in RETRY_ALWAYS_STATUSES or (idempotent and status in RETRY_IDEMPOTENT_STATUSES)
+
+    def delay(self, attempt: int, response: Optional[requests.Response] = None) -> Optional[float]:
+        """Return the wait before the next attempt, or None when the server asks for longer than max_delay"""
+        requested = retry_after(response) if response is not None else None
+        if requested is not None:
+            return requested if requested <= self.max_delay else None
+        delay = min(self.base_delay * (2 ** attempt), self.max_delay)
+        return delay * random.uniform(1 - RETRY_JITTER, 1 + RETRY_JITTER)
+
+
+class TokenBucket:
+    """Client-side rate limiter shared by all concurrent callers of one API key"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take one token, waiting until it is available, and return the time waited"""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def reserve(self) -> float:
+        """Take one token without waiting and return how long the caller has to wait before using it"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            # Reserve the token now so concurrent callers queue up behind each other
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def pause(self, seconds: float) -> None:
+        """Hold back every caller for a while, e.g. after the server asked to retry later"""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+class CircuitBreaker:
+    """Fails calls fast after repeated server failures, letting one probe through once the reset time passed"""
+
+    def __init__(self, threshold: int = DEFAULT_BREAKER_THRESHOLD, reset_timeout: float = DEFAULT_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.state = 'closed'
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> Optional[float]:
+        """Return None when a call may proceed, otherwise the seconds until the circuit is probed again"""
+        if self.threshold <= 0:
+            return None
+        with self._lock:
+            if self.state == 'closed':
+                return None
+            remaining = self._opened_at + self.reset_timeout - time.monotonic()
+            if self.state == 'open' and remaining <= 0:
+                # Let a single probe through, the others keep failing fast until it returns
+                self.state = 'half_open'
+                return None
+            return max(remaining, 0.0) if self.state == 'open' else self.reset_timeout
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.state = 'closed'
+
+    def release_probe(self) -> None:
+        """Let the next call probe a half-open circuit again when the probe ended without an answer"""
+        with self._lock:
+            if self.state == 'half_open':
+                self.state = 'open'
+
+    def record_failure(self) -> bool:
+        """Count a failure and return True when it opened the circuit"""
+        if self.threshold <= 0:
+            return False
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.threshold):
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+                return True
+            return False
+
+
+_retry_policy = RetryPolicy()
+_buckets: Dict[str, TokenBucket] = {}
+_breakers: Dict[str, CircuitBreaker] = {}
+_registry_lock = threading.Lock()
+
+
+def get_retry_policy() -> RetryPolicy:
+    return _retry_policy
+
+
+def get_rate_limiter(scope: str) -> TokenBucket:
+    """Return the token bucket of an API key and deployment"""
+    with _registry_lock:
+        bucket = _buckets.get(scope)
+        if bucket is None:
+            bucket = _buckets[scope] = TokenBucket(DEFAULT_RATE_LIMIT, DEFAULT_RATE_BURST)
+        return bucket
+
+
+def get_circuit_breaker(base_url: str) -> CircuitBreaker:
+    """Return the circuit breaker of a deployment"""
+    with _registry_lock:
+        breaker = _breakers.get(base_url)
+        if breaker is None:
+            breaker = _breakers[base_url] = CircuitBreaker()
+        return breaker
@@ -0,0 +1,117 @@
+import heapq
+import json
+from itertools import chain
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Search methods that can be run side by side and fused, hybrid search already combines them on the server
+FUSION_METHODS = ('semantic_search', 'full_text_search', 'keyword_search')
+# Rank offset of reciprocal rank fusion, dampens the weight of the first few ranks
+RRF_K = 60
+
+
+def parse_list_parameter(value: Any) -> List[str]:
+    """Parse a parameter given as a list, a JSON array string or a comma separated string"""
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        items = value
+    else:
+        text = str(value).strip()
+        items = None
+        if text.startswith('['):
+            try:
+                parsed = json.loads(text)
+                if isinstance(parsed, list):
+                    items = parsed
+            except ValueError:
+                items = None
+        if items is None:
+            items = text.split(',')
+    return [str(item).strip() for item in items if item is not None and str(item).strip()]
+
+
+def record_score(record: Dict) -> float:
+    score = record.get('score')
+    return score if isinstance(score, (int, float)) else 0.0
+
+
+def merge_top_k(record_lists: Iterable[List[Dict]], top_k: int,
+                score_threshold: Optional[float] = None) -> List[Dict]:
+    """Merge per-dataset records into one global top-k by score, then apply the threshold"""
+    merged = heapq.nlargest(max(int(top_k), 0), chain.from_iterable(record_lists), key=record_score)
+    if score_threshold is not None:
+        merged = [record for record in merged if record_score(record) >= score_threshold]
+    return merged
+
+
+def parse_query_batch(query: Any) -> Optional[List[str]]:
+    """Return the queries of a batch given as a JSON array, or None for a single query"""
+    if isinstance(query, (list, tuple)):
+        items = query
+    else:
+        text = str(query).strip()
+        if not text.startswith('['):
+            return None
+        try:
+            items = json.loads(text)
+        except ValueError:
+            return None
+        if not isinstance(items, list):
+            return None
+    return [str(item).strip() for item in items if item is not None and str(item).strip()]
+
+
+def record_key(record: Dict) -> str:
+    """Identify a retrieved segment, falling back to its content when it has no ID"""
+    segment = record.get('segment') or {}
+    return segment.get('id') or segment.get('content', '')
+
+
+def reciprocal_rank_fusion(record_lists: Iterable[List[Dict]], top_k: int, k: int = RRF_K) -> List[Dict]:
+    """Merge ranked record lists by segment, scoring each segment by the sum of 1 / (k + rank) over the lists"""
+    scores: Dict[str, float] = {}
+    records: Dict[str, Dict] = {}
+    for record_list in record_lists:
+        for rank, record in enumerate(record_list, start=1):
+            key = record_key(record)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            # The first list a segment appears in provides its content
+            records.setdefault(key, record)
+    best = heapq.nlargest(max(int(top_k), 0), scores, key=scores.get)
+    return [dict(records[key], score=round(scores[key], 6)) for key in best]
+
+
+def compact_record(record: Dict) -> Dict:
+    """Reduce a retrieved record to its content, document name, score and segment ID"""
+    segment = record.get('segment') or {}
+    document = segment.get('document') or {}
+    compact = {
+        "segment_id": segment.get('id'),
+        "document": document.get('name'),
+        "score": record.get('score'),
+        "content": segment.get('content') or ''
+    }
+    if 'dataset_id' in record:
+        compact["dataset_id"] = record['dataset_id']
+    return compact
+
+
+def compact_records(records: List[Dict], max_record_chars: Optional[int] = None,
+                    max_total_chars: Optional[int] = None) -> Tuple[List[Dict], int]:
+    """Compact records and cut their contents to the character budgets, returning them and how many were left out"""
+    compacted = []
+    remaining = max_total_chars
+    for index, record in enumerate(records):
+        if remaining is not None and remaining <= 0:
+            return compacted, len(records) - index
+        compact = compact_record(record)
+        content = compact['content']
+        limit = min(len(content), max_record_chars if max_record_chars is not None else len(content),
+                    remaining if remaining is not None else len(content))
+        if limit < len(content):
+            compact['content'] = content[:limit]
+            compact['truncated'] = True
+        if remaining is not None:
+            remaining -= limit
+        compacted.append(compact)
+    return compacted, 0
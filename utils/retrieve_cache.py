@@ -0,0 +1,258 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from utils.config import DATA_DIR
+from utils.logger import fields, get_logger
+
+DEFAULT_CACHE_SIZE = 256
+DEFAULT_CACHE_TTL = 60
+
+# 'memory' keeps results per worker process, 'sqlite' shares them between workers and restarts
+CACHE_BACKEND = os.environ.get('DIFY_KNOWLEDGE_RETRIEVE_CACHE_BACKEND', 'memory').strip().lower()
+CACHE_FILENAME = 'retrieve_cache.sqlite3'
+
+logger = get_logger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """Collapse whitespace so trivially different queries share a cache entry"""
+    return ' '.join(str(query).split())
+
+
+def cache_scope(headers: Dict, base_url: Optional[str] = None) -> str:
+    """Derive a cache namespace from the API key and deployment so tenants never share entries"""
+    authorization = headers.get('Authorization', '')
+    return hashlib.sha256(f"{base_url or ''} {authorization}".encode('utf-8')).hexdigest()[:16]
+
+
+class RetrieveCache:
+    """Bounded LRU cache with per-entry TTL for retrieve responses"""
+
+    def __init__(self, max_size: int = DEFAULT_CACHE_SIZE, ttl: float = DEFAULT_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._dataset_keys: Dict[str, set] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.ttl > 0
+
+    @staticmethod
+    def make_key(dataset_id: str, query: str, retrieval_model: Dict, scope: str = '') -> Tuple:
+        return (scope, dataset_id, normalize_query(query), json.dumps(retrieval_model, sort_keys=True))
+
+    def configure(self, max_size: int, ttl: float) -> None:
+        """Apply new limits, evicting entries that no longer fit"""
+        with self._lock:
+            self.max_size = max_size
+            self.ttl = ttl
+            self._evict_overflow()
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Tuple, value: Any) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            self._dataset_keys.setdefault(key[1], set()).add(key)
+            self._evict_overflow()
+
+    def invalidate_dataset(self, dataset_id: str) -> int:
+        """Drop every cached response for a dataset, returning how many were removed"""
+        with self._lock:
+            keys = self._dataset_keys.pop(dataset_id, set())
+            for key in keys:
+                self._entries.pop(key, None)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._dataset_keys.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl
+            }
+
+    def _remove(self, key: Tuple) -> None:
+        self._entries.pop(key, None)
+        keys = self._dataset_keys.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._dataset_keys[key[1]]
+
+    def _evict_overflow(self) -> None:
+        while self._entries and len(self._entries) > self.max_size:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+
+
+class DiskRetrieveCache(RetrieveCache):
+    """Retrieve cache stored in SQLite in WAL mode, shared by every worker process using the same file"""
+
+    def __init__(self, path: str, max_size: int = DEFAULT_CACHE_SIZE, ttl: float = DEFAULT_CACHE_TTL):
+        super().__init__(max_size, ttl)
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        # WAL lets workers read while another one writes
+        connection.execute("PRAGMA journal_mode=WAL")
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY,"
+                " dataset_id TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_dataset ON entries (dataset_id)")
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread, sqlite3 connections must not be shared between threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _row_key(key: Tuple) -> str:
+        return hashlib.sha256(json.dumps(list(key)).encode('utf-8')).hexdigest()
+
+    def configure(self, max_size: int, ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._write(self._evict_overflow)
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        # Entries expire by wall clock time, monotonic clocks are not comparable between processes
+        now = time.time()
+        try:
+            connection = self._connection()
+            row = connection.execute("SELECT value, expires_at FROM entries WHERE key = ?", (self._row_key(key),)).fetchone()
+            if row is not None and row[1] >= now:
+                with connection:
+                    connection.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, self._row_key(key)))
+                value = json.loads(row[0])
+            else:
+                value = None
+        except (sqlite3.Error, ValueError) as e:
+            logger.warning(fields("retrieve cache read failed", error=str(e)))
+            value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key: Tuple, value: Any) -> None:
+        if not self.enabled:
+            return
+        now = time.time()
+
+        def insert(connection: sqlite3.Connection) -> None:
+            connection.execute(
+                "INSERT OR REPLACE INTO entries (key, dataset_id, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (self._row_key(key), key[1], json.dumps(value), now + self.ttl, now)
+            )
+            self._evict_overflow(connection)
+
+        self._write(insert)
+
+    def invalidate_dataset(self, dataset_id: str) -> int:
+        removed = self._write(lambda connection: connection.execute(
+            "DELETE FROM entries WHERE dataset_id = ?", (dataset_id,)
+        ).rowcount)
+        return removed or 0
+
+    def clear(self) -> None:
+        self._write(lambda connection: connection.execute("DELETE FROM entries"))
+
+    def stats(self) -> Dict:
+        try:
+            size = self._connection().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        except sqlite3.Error:
+            size = None
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": size,
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "path": self.path
+            }
+
+    def _write(self, operation) -> Any:
+        """Run a write in its own transaction, a failing cache never fails the retrieval"""
+        try:
+            connection = self._connection()
+            with connection:
+                return operation(connection)
+        except sqlite3.Error as e:
+            logger.warning(fields("retrieve cache write failed", error=str(e)))
+            return None
+
+    def _evict_overflow(self, connection: sqlite3.Connection) -> None:
+        connection.execute("DELETE FROM entries WHERE expires_at < ?", (time.time(),))
+        # Least recently used entries beyond the size limit
+        connection.execute(
+            "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (max(self.max_size, 0),)
+        )
+
+
+_retrieve_cache: Optional[RetrieveCache] = None
+_retrieve_cache_lock = threading.Lock()
+
+
+def get_retrieve_cache() -> RetrieveCache:
+    """Return the process-wide retrieve cache of the configured backend"""
+    global _retrieve_cache
+    if _retrieve_cache is None:
+        with _retrieve_cache_lock:
+            if _retrieve_cache is None:
+                if CACHE_BACKEND == 'sqlite':
+                    _retrieve_cache = DiskRetrieveCache(os.path.join(DATA_DIR, CACHE_FILENAME))
+                else:
+                    _retrieve_cache = RetrieveCache()
+    return _retrieve_cache
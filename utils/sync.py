@@ -0,0 +1,157 @@
+import hashlib
+import os
+import re
+from difflib import SequenceMatcher
+from fnmatch import fnmatch
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from utils.dify_client import DifyClient, response_error
+from utils.logger import fields, get_logger
+from utils.text_splitter import split_text
+
+logger = get_logger(__name__)
+
+DEFAULT_SYNC_PATTERNS = ('*.md', '*.markdown', '*.txt', '*.rst')
+# Chunks stay well below the segment token limit so Dify keeps each of them as one segment
+DEFAULT_SEGMENT_BYTES = 2000
+SEGMENT_MAX_TOKENS = 1000
+# Joins the chunks of a synced document, Dify splits it there and nowhere else
+SEGMENT_SEPARATOR = '\u241e'
+# Above this share of changed segments the whole document is indexed again instead
+REINDEX_RATIO = 0.5
+MAX_SEGMENTS_PER_REQUEST = 50
+
+_HEADING = re.compile(r'^#{1,6}\s', re.MULTILINE)
+# Dify drops leading punctuation and whitespace from segments when indexing them
+_LEADING_SYMBOLS = re.compile(r'^[\u2000-\u206f\u2e00-\u2e7f\u3000-\u303f!"#$%&\'()*+,\-./:;<=>?@\[\]^_`{|}~\s]+')
+
+
+def list_files(directory: str, patterns: Iterable[str] = DEFAULT_SYNC_PATTERNS) -> List[Tuple[str, str]]:
+    """Return the (relative name, path) of every matching file below a directory, skipping hidden ones"""
+    patterns = list(patterns)
+    files = []
+    for root, dirs, names in os.walk(directory):
+        dirs[:] = sorted(name for name in dirs if not name.startswith('.'))
+        for name in sorted(names):
+            if name.startswith('.') or not any(fnmatch(name, pattern) for pattern in patterns):
+                continue
+            path = os.path.join(root, name)
+            files.append((os.path.relpath(path, directory).replace(os.sep, '/'), path))
+    return files
+
+
+def _sections(text: str) -> List[str]:
+    """Split markdown text at its headings"""
+    starts = [match.start() for match in _HEADING.finditer(text) if match.start() > 0]
+    bounds = [0] + starts + [len(text)]
+    return [text[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+def normalize_segment(content: str) -> str:
+    """Reduce segment content to what survives Dify's indexing, to compare local and remote segments"""
+    return ' '.join(_LEADING_SYMBOLS.sub('', content or '').split())
+
+
+def segment_fingerprint(content: str) -> str:
+    return hashlib.sha256(normalize_segment(content).encode('utf-8')).hexdigest()
+
+
+def chunk_document(text: str, max_bytes: int = DEFAULT_SEGMENT_BYTES) -> List[str]:
+    """Split a document into segment sized chunks, packing paragraphs per heading section so an edit only moves its own section"""
+    chunks = []
+    for section in _sections(text):
+        chunks.extend(split_text(section, max_bytes))
+    # Chunks Dify would index as empty segments are left out
+    return [chunk.replace(SEGMENT_SEPARATOR, ' ') for chunk in chunks if normalize_segment(chunk)]
+
+
+def sync_process_rule() -> Dict:
+    """Processing rule that turns every chunk of a synced document into exactly one segment"""
+    return {
+        "mode": "custom",
+        "rules": {
+            "pre_processing_rules": [
+                {"id": "remove_extra_spaces", "enabled": False},
+                {"id": "remove_urls_emails", "enabled": False}
+            ],
+            "segmentation": {
+                "separator": SEGMENT_SEPARATOR,
+                "max_tokens": SEGMENT_MAX_TOKENS
+            }
+        }
+    }
+
+
+def diff_segments(segments: List[Dict], chunks: List[str]) -> Dict:
+    """Plan the segment updates, additions and deletions that turn the remote segments into the local chunks"""
+    segments = sorted(segments, key=lambda segment: segment.get('position') or 0)
+    remote = [segment_fingerprint(segment.get('content', '')) for segment in segments]
+    local = [segment_fingerprint(chunk) for chunk in chunks]
+
+    plan = {"update": [], "add": [], "delete": [], "unchanged": 0}
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, remote, local, autojunk=False).get_opcodes():
+        if tag == 'equal':
+            plan["unchanged"] += i2 - i1
+            continue
+        # Edited chunks overwrite the segments they replace, only the difference is added or deleted
+        paired = min(i2 - i1, j2 - j1)
+        plan["update"].extend((segments[i1 + k]['id'], chunks[j1 + k]) for k in range(paired))
+        plan["delete"].extend(segment['id'] for segment in segments[i1 + paired:i2])
+        plan["add"].extend(chunks[j1 + paired:j2])
+        if j2 - j1 > paired and i2 < len(segments):
+            # Added segments are appended to the document, chunks inserted before existing segments
+            # would end up out of order
+            return _positional_plan(segments, remote, chunks, local)
+    return plan
+
+
+def _positional_plan(segments: List[Dict], remote: List[str], chunks: List[str], local: List[str]) -> Dict:
+    """Plan the changes that keep every segment at its position, rewriting the segments after an insertion in place"""
+    plan = {"update": [], "add": chunks[len(segments):], "delete": [segment['id'] for segment in segments[len(chunks):]],
+            "unchanged": 0}
+    for segment, remote_fingerprint, chunk, local_fingerprint in zip(segments, remote, chunks, local):
+        if remote_fingerprint == local_fingerprint:
+            plan["unchanged"] += 1
+        else:
+            plan["update"].append((segment['id'], chunk))
+    return plan
+
+
+def changed_segments(plan: Dict) -> int:
+    return len(plan["update"]) + len(plan["add"]) + len(plan["delete"])
+
+
+def send_change(call: Callable, action: str, **context) -> Dict:
+    """Send one change request, returning an empty result or its error"""
+    try:
+        response = call()
+    except Exception as e:
+        logger.error(fields("sync change failed", action=action, error=str(e), **context))
+        return {"error": f"Error: {str(e)}"}
+    # Deleting what is already gone is not an error
+    if response.status_code < 300 or (response.status_code == 404 and action.startswith('delete')):
+        return {}
+    error_code, error_message = response_error(response)
+    logger.error(fields("sync change failed", action=action, status=response.status_code, code=error_code,
+                        message=error_message, **context))
+    return {"error": f"Error: {error_message}"}
+
+
+def segment_changes(client: DifyClient, dataset_id: str, document_id: str, plan: Dict) -> List[Callable[[], Dict]]:
+    """Return one request per segment change of a document, additions are sent in batches"""
+    changes = []
+    for segment_id, content in plan["update"]:
+        changes.append(lambda segment_id=segment_id, content=content: send_change(
+            lambda: client.update_segment(dataset_id, document_id, segment_id, {"content": content, "enabled": True}),
+            'update_segment', document_id=document_id
+        ))
+    for start in range(0, len(plan["add"]), MAX_SEGMENTS_PER_REQUEST):
+        batch = [{"content": content} for content in plan["add"][start:start + MAX_SEGMENTS_PER_REQUEST]]
+        changes.append(lambda batch=batch: send_change(
+            lambda: client.add_segments(dataset_id, document_id, batch), 'add_segments', document_id=document_id
+        ))
+    for segment_id in plan["delete"]:
+        changes.append(lambda segment_id=segment_id: send_change(
+            lambda: client.delete_segment(dataset_id, document_id, segment_id), 'delete_segment', document_id=document_id
+        ))
+    return changes
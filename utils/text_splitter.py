@@ -0,0 +1,106 @@
+import re
+from typing import Iterator, List
+
+DEFAULT_MAX_PART_BYTES = 1024 * 1024
+# A UTF-8 character takes up to 4 bytes, smaller parts could not hold every character
+MIN_PART_BYTES = 4
+
+# Blocks start at markdown headings or after blank lines
+_HEADING = re.compile(r'^#{1,6}\s')
+
+
+def text_size(text: str) -> int:
+    return len(text.encode('utf-8'))
+
+
+def _blocks(text: str) -> Iterator[str]:
+    """Split text into paragraphs, starting a new block at every heading"""
+    block: List[str] = []
+    for line in text.splitlines(keepends=True):
+        if block and (_HEADING.match(line) or not line.strip()):
+            if not line.strip():
+                block.append(line)
+            yield ''.join(block)
+            block = [] if not line.strip() else [line]
+            continue
+        block.append(line)
+    if block:
+        yield ''.join(block)
+
+
+def _utf8_boundary(encoded: bytes, end: int) -> int:
+    """Step back from end so a multi-byte character is never cut in half"""
+    while 0 < end < len(encoded) and (encoded[end] & 0xC0) == 0x80:
+        end -= 1
+    return end
+
+
+def _character_end(encoded: bytes) -> int:
+    """Return the length of the first character"""
+    end = 1
+    while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:
+        end += 1
+    return end
+
+
+def _hard_split(text: str, max_bytes: int) -> Iterator[str]:
+    """Split a block that is too large on line boundaries, cutting lines longer than the limit"""
+    part: List[str] = []
+    size = 0
+    for line in text.splitlines(keepends=True):
+        encoded = line.encode('utf-8')
+        while encoded:
+            room = max_bytes - size
+            if len(encoded) <= room:
+                part.append(encoded.decode('utf-8'))
+                size += len(encoded)
+                break
+            # Lines that fit in a part of their own are moved whole to the next part
+            if part and len(encoded) <= max_bytes:
+                yield ''.join(part)
+                part, size = [], 0
+                continue
+            end = _utf8_boundary(encoded, room)
+            if end == 0 and part:
+                yield ''.join(part)
+                part, size = [], 0
+                continue
+            if end == 0:
+                # The limit is below one character, a part holds at least one whole character
+                end = _character_end(encoded)
+            part.append(encoded[:end].decode('utf-8'))
+            yield ''.join(part)
+            part, size = [], 0
+            encoded = encoded[end:]
+    if part:
+        yield ''.join(part)
+
+
+def split_text(text: str, max_bytes: int = DEFAULT_MAX_PART_BYTES) -> List[str]:
+    """Split text into parts of at most max_bytes UTF-8 bytes on paragraph and heading boundaries"""
+    if max_bytes <= 0 or text_size(text) <= max_bytes:
+        return [text]
+    max_bytes = max(max_bytes, MIN_PART_BYTES)
+
+    parts: List[str] = []
+    current: List[str] = []
+    current_size = 0
+    for block in _blocks(text):
+        block_size = text_size(block)
+        if block_size > max_bytes:
+            # An oversized block starts its own parts so its heading stays at the top
+            if current:
+                parts.append(''.join(current))
+            pieces = list(_hard_split(block, max_bytes))
+            parts.extend(pieces[:-1])
+            current, current_size = [pieces[-1]], text_size(pieces[-1])
+            continue
+        if current and current_size + block_size > max_bytes:
+            parts.append(''.join(current))
+            current, current_size = [], 0
+        current.append(block)
+        current_size += block_size
+    if current:
+        parts.append(''.join(current))
+    # Parts made only of whitespace would be rejected by the API
+    return [part for part in parts if part.strip()]